@@ -63,6 +63,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'app.core.context_processors.alertas',
             ],
         },
     },
@@ -121,6 +122,97 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+LOGIN_URL = 'security:login'
+
+# Modelo de detección de enfermedades
+# Versión en producción y candidata en sombra: archivos .keras dentro de static/models.
+# La candidata recibe una fracción del tráfico en segundo plano (sin afectar a la respuesta)
+# y sus estadísticas de latencia y acuerdo quedan en ComparacionModelo.
+MODELO_CUSTOM_ARCHIVO = os.environ.get('AGROBANANIA_MODELO', 'best_custom_cnn_improved.keras')
+MODELO_SHADOW_ARCHIVO = os.environ.get('AGROBANANIA_MODELO_SHADOW') or None
+MODELO_SHADOW_FRACCION = float(os.environ.get('AGROBANANIA_MODELO_SHADOW_FRACCION', '0.1'))
+MODELO_SHADOW_MAX_PENDIENTES = 32
+
+# Los procesos que sirven peticiones exportan AGROBANANIA_PRECARGAR_MODELO=1 para
+# cargar el modelo en CoreConfig.ready(); el resto (migrate, shell...) lo carga bajo demanda.
+MODELO_PRECARGAR = os.environ.get('AGROBANANIA_PRECARGAR_MODELO', '0') == '1'
+
+# Ruta de inferencia: 'keras' (model.predict), 'compilado' (tf.function con firma fija)
+# o 'tflite' (static/models/<modelo>.tflite, generado con `manage.py exportar_modelo_tflite`)
+INFERENCIA_MODO = os.environ.get('AGROBANANIA_INFERENCIA_MODO', 'compilado')
+INFERENCIA_XLA = False
+
+# Micro-batching de inferencia: las peticiones concurrentes se agrupan hasta
+# INFERENCIA_BATCH_MAX imágenes o INFERENCIA_BATCH_ESPERA_MS milisegundos
+INFERENCIA_BATCHING = True
+INFERENCIA_BATCH_MAX = 16
+INFERENCIA_BATCH_ESPERA_MS = 10
+
+# Inferencia por teselas: la foto se recorre en teselas de 128x128 (con solape) en lugar
+# de reducirla entera, para no perder lesiones pequeñas. INFERENCIA_TESELAS_MAX acota la
+# latencia (la imagen se reduce hasta que entren) y una tesela enferma con confianza
+# >= INFERENCIA_TESELAS_UMBRAL basta para el diagnóstico.
+INFERENCIA_TESELAS = os.environ.get('AGROBANANIA_INFERENCIA_TESELAS', '0') == '1'
+INFERENCIA_TESELAS_SOLAPE = 0.25
+INFERENCIA_TESELAS_MAX = 256
+INFERENCIA_TESELAS_BATCH = 64
+INFERENCIA_TESELAS_UMBRAL = 0.5
+
+# Las fotos con un lado mayor a este valor se reducen antes de segmentar (None para desactivar)
+SEGMENTACION_MAX_LADO = 2048
+
+# Segmentación: 'umbral' (zonas oscuras, el más rápido) o 'adaptativo' (rango HSV
+# y morfología según la enfermedad predicha). `manage.py benchmark_segmentacion` compara ambos.
+SEGMENTACION_MODO = os.environ.get('AGROBANANIA_SEGMENTACION_MODO', 'umbral')
+# Solo se guarda la máscara (PNG); contorno, overlay y región dañada se generan al pedirlos
+SEGMENTACION_DIFERIDA = True
+
+# Subida de imágenes en analizar_imagen: tamaño máximo (coincide con el indicado en el
+# formulario) y hasta cuánto se mantiene en memoria; por encima va a un temporal
+SUBIDA_MAX_BYTES = 10 * 1024 * 1024
+SUBIDA_MEMORIA_BYTES = 5 * 1024 * 1024
+
+# Workers del pool local que procesa los trabajos de análisis asíncronos
+ANALISIS_WORKERS = 2
+
+# Caché de resultados por hash de la imagen: tamaño máximo de los artefactos en disco (LRU)
+CACHE_ANALISIS_MAX_BYTES = 500 * 1024 * 1024
+
+# Análisis por lotes (levantamientos de campo con cientos de fotos)
+LOTE_TAMANO_BATCH = 32
+LOTE_WORKERS_DECODIFICACION = 4
+LOTE_MAX_IMAGEN_BYTES = 25 * 1024 * 1024
+
+# Series de registros de campo para gráficas: sin periodo explícito se usa el más fino
+# (día, semana o mes) que no pase de SERIES_MAX_PUNTOS puntos
+SERIES_MAX_PUNTOS = 120
+
+# Listado de análisis (paginado por cursor)
+DETECCIONES_POR_PAGINA = 12
+
+# Alertas comunitarias: al detectar una enfermedad se avisa a los productores con
+# plantaciones a ALERTA_RADIO_KM o menos. Quien ya recibió la misma enfermedad desde la
+# misma zona en las últimas ALERTA_VENTANA_HORAS no recibe otra.
+ALERTAS_ACTIVAS = True
+ALERTA_RADIO_KM = 15
+ALERTA_VENTANA_HORAS = 24
+ALERTA_BATCH = 1000
+# Bandeja de entrada: alertas por página y vigencia del contador de no leídas en la caché
+ALERTAS_POR_PAGINA = 20
+ALERTAS_CONTADOR_TTL = 300
+
+# Mapa del dashboard: las plantaciones se sirven por teselas XYZ guardadas en la caché
+# MAPA_CACHE_TTL segundos. Desde MAPA_ZOOM_DETALLE se muestran una a una (hasta
+# MAPA_MAX_PUNTOS_TESELA por tesela); por debajo, agrupadas en el servidor.
+MAPA_ZOOM_DETALLE = 12
+MAPA_MAX_PUNTOS_TESELA = 200
+MAPA_MAX_TESELAS = 64
+MAPA_CACHE_TTL = 300
+
+# Métricas de Prometheus en /metrics: histogramas de duración por etapa del análisis.
+# Las consultan los usuarios staff o el scraper con "Authorization: Bearer <token>".
+METRICAS_TOKEN = os.environ.get('AGROBANANIA_METRICAS_TOKEN') or None
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,124 @@
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Agrupa predicciones concurrentes en un único forward pass.
+
+    Cada petición encola su tensor (1, H, W, C) y recibe un Future. Un hilo de
+    fondo espera como máximo `max_wait_ms` a que lleguen más peticiones (o hasta
+    llenar `max_batch_size`), ejecuta `predict_fn` una sola vez sobre el lote y
+    reparte cada fila del resultado a su Future, que además lleva en
+    `duracion_inferencia` los segundos de esa llamada a `predict_fn`.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=10, nombre='batcher'):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+        self.nombre = nombre
+        self._cola = queue.Queue()
+        self._hilo = None
+        self._lock = threading.Lock()
+        self._metricas = {
+            'lotes': 0,
+            'peticiones': 0,
+            'muestras': 0,
+            'espera_total': 0.0,
+            'espera_max': 0.0,
+            'inferencia_total': 0.0,
+            'errores': 0,
+        }
+
+    def _asegurar_hilo(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._bucle, name=self.nombre, daemon=True)
+                self._hilo.start()
+
+    def submit(self, x):
+        """Encola una muestra (con o sin eje de batch) y devuelve un Future con su fila de salida."""
+        x = np.asarray(x)
+        if x.ndim == 3:
+            x = np.expand_dims(x, axis=0)
+        futuro = Future()
+        self._cola.put((x, futuro, time.perf_counter()))
+        self._asegurar_hilo()
+        return futuro
+
+    def predict(self, x, timeout=None):
+        return self.submit(x).result(timeout=timeout)
+
+    def _recolectar(self):
+        primero = self._cola.get()
+        lote = [primero]
+        n = primero[0].shape[0]
+        limite = time.perf_counter() + self.max_wait
+        while n < self.max_batch_size:
+            restante = limite - time.perf_counter()
+            if restante <= 0:
+                break
+            try:
+                item = self._cola.get(timeout=restante)
+            except queue.Empty:
+                break
+            lote.append(item)
+            n += item[0].shape[0]
+        return lote
+
+    def _bucle(self):
+        while True:
+            lote = self._recolectar()
+            inicio = time.perf_counter()
+            esperas = [inicio - encolado for _, _, encolado in lote]
+            try:
+                entradas = np.concatenate([x for x, _, _ in lote], axis=0)
+                salidas = np.asarray(self.predict_fn(entradas))
+            except Exception as e:
+                logger.exception(f"Error en el lote de inferencia ({len(lote)} peticiones): {e}")
+                with self._lock:
+                    self._metricas['errores'] += 1
+                for _, futuro, _ in lote:
+                    futuro.set_exception(e)
+                continue
+
+            duracion = time.perf_counter() - inicio
+            desplazamiento = 0
+            for x, futuro, _ in lote:
+                n = x.shape[0]
+                # Solo el forward pass del lote, sin la espera en cola (lo usa la inferencia en sombra)
+                futuro.duracion_inferencia = duracion
+                futuro.set_result(salidas[desplazamiento:desplazamiento + n])
+                desplazamiento += n
+
+            with self._lock:
+                self._metricas['lotes'] += 1
+                self._metricas['peticiones'] += len(lote)
+                self._metricas['muestras'] += desplazamiento
+                self._metricas['espera_total'] += sum(esperas)
+                self._metricas['espera_max'] = max(self._metricas['espera_max'], max(esperas))
+                self._metricas['inferencia_total'] += duracion
+
+    def metricas(self):
+        """Tasa de llenado de los lotes y latencia en cola (segundos)."""
+        with self._lock:
+            m = dict(self._metricas)
+        lotes = m['lotes'] or 1
+        peticiones = m['peticiones'] or 1
+        m['tamano_medio_lote'] = m['muestras'] / lotes
+        m['tasa_llenado'] = m['muestras'] / (lotes * self.max_batch_size)
+        m['espera_media'] = m['espera_total'] / peticiones
+        m['inferencia_media_lote'] = m['inferencia_total'] / lotes
+        m['en_cola'] = self._cola.qsize()
+        return m
@@ -1,18 +1,27 @@
+import io
 import os
+import math
+import time
 import logging
-import traceback
 import numpy as np
 import cv2
-import uuid
+from PIL import Image
+from numpy.lib.stride_tricks import sliding_window_view
 from django.conf import settings
-import tensorflow as tf
-from keras import preprocessing, models
+from AgroBananIA.utils.model_registry import model_registry
+from AgroBananIA.utils.batching import MicroBatcher
+from AgroBananIA.utils import segmentation
+from AgroBananIA.utils.metricas import medir, registro
 
 
 logger = logging.getLogger(__name__)
 
 
 MODEL_DIR = os.path.join(settings.BASE_DIR, 'static', 'models')
+MODEL_CUSTOM = 'custom_cnn'
+MODEL_SHADOW = 'custom_cnn_shadow'
+CLASE_SANA = 1
+TAMANO_ENTRADA = 128
 
 
 class_mapping = {
@@ -24,17 +33,6 @@ class_mapping = {
     5: "Banana Yellow Sigatoka Disease",
 }
 
-# Rangos HSV optimizados por enfermedad
-# Formato: (lower_bound, upper_bound)
-# color_ranges_by_disease = {
-#     0: ([0, 0, 0], [180, 255, 100]),           # Black Sigatoka: zonas oscuras/necróticas (marrón-negro)
-#     1: ([35, 40, 40], [85, 255, 255]),         # Healthy Leaf: verde saludable (no debería segmentar mucho)
-#     2: ([0, 50, 50], [15, 255, 255]),          # Insect Pest: áreas rojizas, marrones claras
-#     3: ([15, 60, 60], [35, 255, 230]),         # Moko: amarillo-verdoso con manchas marrones
-#     4: ([18, 70, 50], [30, 255, 200]),         # Panama: amarillo-marrón en márgenes de hojas
-#     5: ([20, 100, 100], [35, 255, 255]),       # Yellow Sigatoka: amarillo brillante con centro marrón
-# }
-
 recomendaciones_mapping = {
     0: "Retirar y destruir hojas gravemente afectadas. Aplicar fungicidas sistémicos (como triazoles) y de contacto (como clorotalonil o mancozeb) de forma alternada. Mejorar la ventilación y drenaje del cultivo para reducir la humedad.",
     1: "La planta está sana. Continuar con buenas prácticas de manejo agronómico, monitoreo periódico de plagas y enfermedades, y fertilización balanceada.",
@@ -45,138 +43,331 @@ recomendaciones_mapping = {
 }
 
 
-def load_custom_model():
-    model_path = os.path.join(MODEL_DIR, 'best_custom_cnn_improved.keras')
+# El modelo ya no se carga al importar el módulo: el registro lo carga en la
+# primera predicción o en el warm-up de CoreConfig.ready()
+model_registry.register(
+    MODEL_CUSTOM,
+    os.path.join(MODEL_DIR, getattr(settings, 'MODELO_CUSTOM_ARCHIVO', 'best_custom_cnn_improved.keras')),
+    modo=getattr(settings, 'INFERENCIA_MODO', 'compilado'),
+    jit_compile=getattr(settings, 'INFERENCIA_XLA', False),
+)
+
+# Versión candidata para inferencia en sombra (ver app/core/shadow.py)
+if getattr(settings, 'MODELO_SHADOW_ARCHIVO', None):
+    model_registry.register(
+        MODEL_SHADOW,
+        os.path.join(MODEL_DIR, settings.MODELO_SHADOW_ARCHIVO),
+        modo=getattr(settings, 'INFERENCIA_MODO', 'compilado'),
+        jit_compile=getattr(settings, 'INFERENCIA_XLA', False),
+    )
+
+
+def versiones_disponibles():
+    """Archivos .keras desplegados en MODEL_DIR que se pueden activar o probar en sombra."""
     try:
-        model = models.load_model(model_path, compile=False)
-        logger.info(f"Modelo Custom CNN cargado correctamente: {model_path}")
-        return model
-    except Exception as e:
-        logger.error(f"Error al cargar Custom CNN: {e}")
-        logger.debug(traceback.format_exc())
-        return None
+        return sorted(nombre for nombre in os.listdir(MODEL_DIR) if nombre.endswith('.keras'))
+    except OSError:
+        return []
 
 
-model_custom = load_custom_model()
+def load_custom_model():
+    return model_registry.get(MODEL_CUSTOM)
+
+
+def predict_batch_custom(batch):
+    predictor = model_registry.predictor(MODEL_CUSTOM)
+    if predictor is None:
+        raise RuntimeError("El modelo Custom CNN no está cargado correctamente.")
+    return predictor(batch)
+
+
+# Las peticiones concurrentes de analizar_imagen comparten un único forward pass
+custom_batcher = MicroBatcher(
+    predict_batch_custom,
+    max_batch_size=getattr(settings, 'INFERENCIA_BATCH_MAX', 16),
+    max_wait_ms=getattr(settings, 'INFERENCIA_BATCH_ESPERA_MS', 10),
+    nombre='custom-cnn-batcher',
+)
+
+
+def _metricas_batcher():
+    m = custom_batcher.metricas()
+    lineas = []
+    for clave, tipo, ayuda in (
+        ('peticiones', 'counter', 'Predicciones recibidas por el micro-batcher'),
+        ('lotes', 'counter', 'Forward passes ejecutados por el micro-batcher'),
+        ('tasa_llenado', 'gauge', 'Fracción media de ocupación de los lotes'),
+        ('espera_media', 'gauge', 'Espera media en cola por petición (segundos)'),
+        ('en_cola', 'gauge', 'Peticiones esperando lote'),
+    ):
+        nombre = f'agrobanania_batcher_{clave}'
+        lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} {tipo}", f"{nombre} {m[clave]}"]
+    return lineas
+
+
+registro.registrar_recolector(_metricas_batcher)
+
+
+def decode_image_bytes(data):
+    """
+    Decodifica los bytes de una imagen (JPG/PNG...) a un array BGR de OpenCV, sin
+    aplicar la orientación EXIF: como load_img de Keras, con el que se entrenó el
+    clasificador. Para la segmentación se gira con orientar().
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    with medir('decodificacion'):
+        img = cv2.imdecode(buffer, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if img is None:
+        raise ValueError("No se pudo decodificar la imagen. Verifique que sea un JPG o PNG válido.")
+    return img
+
+
+# Transformación que lleva los píxeles tal como están guardados a como se ve la
+# foto, para cada valor de la etiqueta Orientation
+ORIENTACION_EXIF = 0x0112
+_ORIENTAR = {
+    1: lambda img: img,
+    2: lambda img: img[:, ::-1],
+    3: lambda img: img[::-1, ::-1],
+    4: lambda img: img[::-1],
+    5: lambda img: img.transpose(1, 0, 2),
+    6: lambda img: np.rot90(img, -1),
+    7: lambda img: img.transpose(1, 0, 2)[::-1, ::-1],
+    8: lambda img: np.rot90(img, 1),
+}
 
 
-def preprocess_image_custom(image_path, target_size=(128, 128)):
-    img = preprocessing.image.load_img(image_path, target_size=target_size)
-    img_array = preprocessing.image.img_to_array(img) / 255.0
+def orientacion_exif(data):
+    """Etiqueta Orientation (1-8) de la imagen; 1 si no tiene EXIF o no se puede leer."""
+    try:
+        # Image.open solo lee la cabecera, no decodifica los píxeles
+        orientacion = Image.open(io.BytesIO(data)).getexif().get(ORIENTACION_EXIF, 1)
+    except Exception:
+        return 1
+    return orientacion if orientacion in _ORIENTAR else 1
+
+
+def orientar(img, orientacion):
+    """La imagen de decode_image_bytes girada según su orientación EXIF (la que ve el usuario)."""
+    if orientacion in (None, 1):
+        return img
+    return np.ascontiguousarray(_ORIENTAR[orientacion](img))
+
+
+def _load_bgr(image):
+    # Acepta una ruta (compatibilidad) o una imagen ya decodificada en memoria
+    if isinstance(image, np.ndarray):
+        return image
+    img = cv2.imread(image, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if img is None:
+        raise ValueError(f"No se pudo cargar la imagen: {image}")
+    return img
+
+
+def preprocess_image_custom(image, target_size=(128, 128)):
+    img = _load_bgr(image)
+    # Se reduce antes de convertir de color: la conversión se hace sobre 128x128 px.
+    # INTER_NEAREST_EXACT da los mismos píxeles que el load_img(target_size=...) de
+    # Keras (vecino más cercano de PIL); INTER_NEAREST muestrea con otro desfase.
+    # Tampoco se aplica la orientación EXIF, igual que en load_img.
+    img = cv2.resize(img, target_size, interpolation=cv2.INTER_NEAREST_EXACT)
+    img_array = cv2.cvtColor(img, cv2.COLOR_BGR2RGB).astype(np.float32) / 255.0
     return np.expand_dims(img_array, axis=0)
 
 
-def predict_with_custom(image_path):
-    if model_custom is None:
+def inferir_custom(img):
+    """
+    Predice un tensor ya preprocesado y devuelve (clase, predicciones, ms). Los
+    milisegundos son solo los de predict_batch_custom: sin el preprocesado ni la
+    espera en la cola del batcher, igual que se mide el modelo en sombra.
+    """
+    if model_registry.predictor(MODEL_CUSTOM) is None:
         raise RuntimeError("El modelo Custom CNN no está cargado correctamente.")
-    img = preprocess_image_custom(image_path)
     try:
-        pred = model_custom.predict(img)
+        # Con micro-batching incluye la espera en la cola del batcher
+        with medir('inferencia'):
+            if getattr(settings, 'INFERENCIA_BATCHING', True):
+                futuro = custom_batcher.submit(img)
+                pred = futuro.result()
+                latencia_ms = futuro.duracion_inferencia * 1000
+            else:
+                inicio = time.perf_counter()
+                pred = predict_batch_custom(img)
+                latencia_ms = (time.perf_counter() - inicio) * 1000
         pred = np.squeeze(pred)
         if pred.ndim == 1:
             pred = np.expand_dims(pred, axis=0)
         pred_class = int(np.argmax(pred, axis=1)[0])
-        return pred_class, pred
+        return pred_class, pred, latencia_ms
     except Exception as e:
         logger.exception("Error durante la predicción con Custom CNN: %s", e)
         raise RuntimeError("Error al predecir con el modelo Custom CNN.")
 
 
-# def segment_and_save_custom(image_path, output_dir, predicted_class=None, adaptive=True):
-#     os.makedirs(output_dir, exist_ok=True)
-#     img = cv2.imread(image_path)
-#     if img is None:
-#         raise ValueError(f"No se pudo cargar la imagen: {image_path}")
-    
-#     img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-#     img_hsv = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2HSV)
-    
-#     # Seleccionar rango de color según la enfermedad predicha
-#     if adaptive and predicted_class is not None and predicted_class in color_ranges_by_disease:
-#         lower_bound, upper_bound = color_ranges_by_disease[predicted_class]
-#         lower = np.array(lower_bound)
-#         upper = np.array(upper_bound)
-#         disease_name = class_mapping.get(predicted_class, "Desconocida")
-#         logger.info(f"Segmentación adaptativa para: {disease_name} (clase {predicted_class})")
-#         logger.debug(f"Rango HSV: {lower} - {upper}")
-#     else:
-#         # Rango por defecto (zonas oscuras - Black Sigatoka)
-#         lower = np.array([0, 0, 0])
-#         upper = np.array([180, 255, 100])
-#         logger.info("Usando segmentación por defecto (zonas oscuras)")
-    
-#     # Crear máscara
-#     mask = cv2.inRange(img_hsv, lower, upper)
-    
-#     # Operaciones morfológicas adaptativas
-#     if predicted_class in [0, 5]:  # Sigatokas: lesiones alargadas
-#         kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
-#     elif predicted_class in [3, 4]:  # Moko, Panama: manchas irregulares
-#         kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-#     else: 
-#         kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-    
-#     mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
-#     mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=1)
-
-#     contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-#     min_area = 100  
-#     mask_filtered = np.zeros_like(mask)
-#     for contour in contours:
-#         if cv2.contourArea(contour) > min_area:
-#             cv2.drawContours(mask_filtered, [contour], -1, 255, -1)
-
-#     contoured = img_rgb.copy()
-#     cv2.drawContours(contoured, contours, -1, (255, 0, 0), 2)
-
-#     heatmap = np.zeros_like(img_rgb)
-#     heatmap[:, :, 0] = mask_filtered  
-#     overlay = cv2.addWeighted(img_rgb, 0.7, heatmap, 0.5, 0)
-
-#     only_damage = cv2.bitwise_and(img_rgb, img_rgb, mask=mask_filtered)
-    
-#     uid = uuid.uuid4().hex
-#     paths = {
-#         "contorno": os.path.join(output_dir, f"{uid}_contour.jpg"),
-#         "overlay": os.path.join(output_dir, f"{uid}_overlay.jpg"),
-#         "damage": os.path.join(output_dir, f"{uid}_damage.jpg"),
-#     }
-    
-#     cv2.imwrite(paths["contorno"], cv2.cvtColor(contoured, cv2.COLOR_RGB2BGR))
-#     cv2.imwrite(paths["overlay"], cv2.cvtColor(overlay, cv2.COLOR_RGB2BGR))
-#     cv2.imwrite(paths["damage"], cv2.cvtColor(only_damage, cv2.COLOR_RGB2BGR))
-    
-#     logger.info(f"Segmentación completada. Archivos guardados en: {output_dir}")
-#     return paths
-def segment_and_save(image_path, output_dir):
-    os.makedirs(output_dir, exist_ok=True)
-
-    img = cv2.imread(image_path)
-    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    _, mask = cv2.threshold(gray, 90, 255, cv2.THRESH_BINARY_INV)
-
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    contoured = img_rgb.copy()
-    cv2.drawContours(contoured, contours, -1, (255, 0, 0), 2)
-
-    heatmap = np.zeros_like(img_rgb)
-    heatmap[:, :, 0] = mask
-    overlay = cv2.addWeighted(img_rgb, 0.7, heatmap, 0.6, 0)
-    only_damage = cv2.bitwise_and(img_rgb, img_rgb, mask=mask)
-
-    uid = uuid.uuid4().hex
-    paths = {
-        "contorno": os.path.join(output_dir, f"{uid}_contour.jpg"),
-        "overlay": os.path.join(output_dir, f"{uid}_overlay.jpg"),
-        "damage": os.path.join(output_dir, f"{uid}_damage.jpg"),
+def predict_with_custom(image):
+    if model_registry.predictor(MODEL_CUSTOM) is None:
+        raise RuntimeError("El modelo Custom CNN no está cargado correctamente.")
+    with medir('preprocesado'):
+        img = preprocess_image_custom(image)
+    pred_class, pred, _ = inferir_custom(img)
+    return pred_class, pred
+
+
+def _posiciones(longitud, tamano, paso):
+    # Inicios de las teselas en un eje; la última se ajusta al borde para no dejar franjas sin cubrir
+    posiciones = list(range(0, longitud - tamano + 1, paso))
+    if posiciones[-1] != longitud - tamano:
+        posiciones.append(longitud - tamano)
+    return np.array(posiciones)
+
+
+def _escala_teselas(alto, ancho, tamano, paso, max_teselas):
+    """Factor (<= 1) al que hay que reducir la imagen para no superar `max_teselas`."""
+    def teselas(escala):
+        filas = math.ceil(max(alto * escala - tamano, 0) / paso) + 1
+        columnas = math.ceil(max(ancho * escala - tamano, 0) / paso) + 1
+        return filas * columnas
+
+    escala = 1.0
+    if teselas(escala) > max_teselas:
+        escala = math.sqrt(max_teselas / teselas(escala))
+        while escala * min(alto, ancho) > tamano and teselas(escala) > max_teselas:
+            escala *= 0.95
+    return max(escala, tamano / min(alto, ancho))
+
+
+def agregar_teselas(probabilidades, umbral=0.5):
+    """
+    Diagnóstico de la hoja a partir de las probabilidades por tesela (N, clases).
+    Basta con que algunas teselas muestren una enfermedad con confianza >= `umbral`:
+    gana la enfermedad con mayor confianza acumulada y su vector es la media de esas
+    teselas. Si ninguna la supera, la hoja se considera sana (media de todas).
+    """
+    clases = probabilidades.argmax(axis=1)
+    confianzas = probabilidades.max(axis=1)
+    enfermas = (clases != CLASE_SANA) & (confianzas >= umbral)
+    if not enfermas.any():
+        return CLASE_SANA, probabilidades.mean(axis=0, keepdims=True)
+    acumulado = np.bincount(clases[enfermas], weights=confianzas[enfermas], minlength=probabilidades.shape[1])
+    clase = int(acumulado.argmax())
+    return clase, probabilidades[enfermas & (clases == clase)].mean(axis=0, keepdims=True)
+
+
+def predict_tiled_custom(image, solape=None, max_teselas=None, batch=None):
+    """
+    Clasificación por teselas para fotos de alta resolución, donde reducir la hoja
+    completa a 128x128 borra las lesiones tempranas.
+
+    La imagen se reduce solo lo necesario para no superar `max_teselas`, las teselas
+    de 128x128 (con `solape`) son vistas de sliding_window_view sobre ella y se
+    copian a float32 bloque a bloque de `batch` teselas. Devuelve (clase, pred, mapa),
+    con `mapa` la clase y la confianza de cada tesela. Si la imagen no da para más
+    de una tesela, o su lado corto no llega a una (una tira de 100x1000), se usa
+    predict_with_custom.
+    """
+    solape = getattr(settings, 'INFERENCIA_TESELAS_SOLAPE', 0.25) if solape is None else solape
+    max_teselas = max_teselas or getattr(settings, 'INFERENCIA_TESELAS_MAX', 256)
+    batch = batch or getattr(settings, 'INFERENCIA_TESELAS_BATCH', 64)
+    if model_registry.predictor(MODEL_CUSTOM) is None:
+        raise RuntimeError("El modelo Custom CNN no está cargado correctamente.")
+
+    img = _load_bgr(image)
+    tamano = TAMANO_ENTRADA
+    paso = max(1, int(tamano * (1 - solape)))
+    alto, ancho = img.shape[:2]
+    if min(alto, ancho) < tamano or max(alto, ancho) < tamano + paso:
+        clase, pred = predict_with_custom(img)
+        return clase, pred, None
+
+    with medir('preprocesado'):
+        escala = _escala_teselas(alto, ancho, tamano, paso, max_teselas)
+        if escala < 1:
+            img = cv2.resize(img, (max(tamano, round(ancho * escala)), max(tamano, round(alto * escala))),
+                             interpolation=cv2.INTER_AREA)
+        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        # (alto - 127, ancho - 127, 128, 128, 3) sin copiar: cada índice es una tesela
+        ventanas = sliding_window_view(rgb, (tamano, tamano, 3))[:, :, 0]
+        filas = _posiciones(rgb.shape[0], tamano, paso)
+        columnas = _posiciones(rgb.shape[1], tamano, paso)
+        ys, xs = (eje.ravel() for eje in np.meshgrid(filas, columnas, indexing='ij'))
+
+    probabilidades = []
+    for inicio in range(0, len(ys), batch):
+        with medir('preprocesado'):
+            entradas = ventanas[ys[inicio:inicio + batch], xs[inicio:inicio + batch]].astype(np.float32)
+            entradas /= 255.0
+        with medir('inferencia'):
+            probabilidades.append(np.asarray(predict_batch_custom(entradas)).reshape(len(entradas), -1))
+    probabilidades = np.concatenate(probabilidades, axis=0)
+
+    clase, pred = agregar_teselas(probabilidades, getattr(settings, 'INFERENCIA_TESELAS_UMBRAL', 0.5))
+    clases = probabilidades.argmax(axis=1)
+    mapa = {
+        'filas': len(filas),
+        'columnas': len(columnas),
+        'escala': round(escala, 4),
+        'clases': clases.reshape(len(filas), len(columnas)).tolist(),
+        'confianza': np.round(probabilidades.max(axis=1), 3).reshape(len(filas), len(columnas)).tolist(),
+        'afectadas_pct': round(float((clases != CLASE_SANA).mean()) * 100, 2),
     }
+    logger.info(
+        f"Inferencia por teselas: {len(clases)} teselas ({mapa['filas']}x{mapa['columnas']}, "
+        f"escala {escala:.2f}), {mapa['afectadas_pct']}% con síntomas"
+    )
+    return clase, pred, mapa
+
+
+def inferencia_por_teselas():
+    return getattr(settings, 'INFERENCIA_TESELAS', False)
+
+
+def modo_segmentacion():
+    return getattr(settings, 'SEGMENTACION_MODO', segmentation.MODO_UMBRAL)
+
+
+def segment_and_save(image, output_dir, predicted_class=None, modo=None, nombre_original=None):
+    # En modo 'adaptativo' el rango HSV y la morfología dependen de predicted_class.
+    # Con el nombre del original guardado y SEGMENTACION_DIFERIDA solo se escribe la
+    # máscara; los artefactos se generan al pedirlos (ver renderizar_artefacto).
+    img = _load_bgr(image)
+    parametros = {
+        'max_lado': getattr(settings, 'SEGMENTACION_MAX_LADO', None),
+        'modo': modo or modo_segmentacion(),
+        'clase': predicted_class,
+    }
+    if nombre_original and getattr(settings, 'SEGMENTACION_DIFERIDA', True):
+        uid = segmentation.uid_diferido(os.path.basename(nombre_original))
+        return segmentation.guardar_mascara(img, output_dir, uid, **parametros)
+    return segmentation.segment_and_save(img, output_dir, **parametros)
+
+
+def renderizar_artefacto(carpeta, nombre):
+    """
+    Ruta del artefacto `nombre` dentro de `carpeta`, generándolo desde la máscara
+    si todavía no existe. None si el nombre no corresponde a una segmentación.
+    """
+    # Solo contorno, overlay o región dañada: ni máscaras ni originales
+    partes = segmentation.separar_artefacto(nombre)
+    if partes is None:
+        return None
+    ruta = os.path.join(carpeta, nombre)
+    if os.path.exists(ruta):
+        return ruta
+
+    uid, clave = partes
+    nombre_original = segmentation.original_de(uid)
+    ruta_mascara = os.path.join(carpeta, segmentation.nombres_artefactos(uid)['mascara'])
+    if nombre_original is None or not os.path.exists(ruta_mascara):
+        return None
 
-    cv2.imwrite(paths["contorno"], cv2.cvtColor(contoured, cv2.COLOR_RGB2BGR))
-    cv2.imwrite(paths["overlay"], cv2.cvtColor(overlay, cv2.COLOR_RGB2BGR))
-    cv2.imwrite(paths["damage"], cv2.cvtColor(only_damage, cv2.COLOR_RGB2BGR))
+    return segmentation.renderizar_artefacto(
+        os.path.join(carpeta, nombre_original),
+        ruta_mascara,
+        clave,
+        ruta,
+        max_lado=getattr(settings, 'SEGMENTACION_MAX_LADO', None),
+    )
 
-    return paths
 
 def obtener_nombre_enfermedad_custom(diagnostico):
     if diagnostico is None:
@@ -0,0 +1,120 @@
+import math
+
+import numpy as np
+
+
+RADIO_TIERRA_KM = 6371.0088
+KM_POR_GRADO = math.pi * RADIO_TIERRA_KM / 180
+
+# Rejilla fija de celdas de CELDA_GRADOS x CELDA_GRADOS (0.1° ≈ 11 km en el ecuador).
+# La celda se guarda como un entero fila * COLUMNAS + columna, así las celdas de una
+# misma fila son contiguas y una búsqueda por radio se resuelve con unos pocos rangos
+# sobre un índice normal. Cambiar el tamaño obliga a recalcular Plantacion.celda_geo.
+CELDA_GRADOS = 0.1
+FILAS = round(180 / CELDA_GRADOS)
+COLUMNAS = round(360 / CELDA_GRADOS)
+# Con más filas que esto (radios de cientos de km) se usa la franja de latitud completa:
+# un único rango es más barato que decenas de condiciones OR
+MAX_FILAS = 32
+
+
+def _fila(latitud):
+    return min(max(math.floor((latitud + 90) / CELDA_GRADOS), 0), FILAS - 1)
+
+
+def _columna(longitud):
+    return math.floor((longitud + 180) / CELDA_GRADOS) % COLUMNAS
+
+
+def celda(latitud, longitud):
+    """Celda de la rejilla que contiene el punto (grados decimales)."""
+    return _fila(float(latitud)) * COLUMNAS + _columna(float(longitud))
+
+
+def rangos_celdas(latitud, longitud, radio_km):
+    """
+    Intervalos [inicio, fin] de celdas que cubren el círculo de `radio_km` alrededor
+    del punto: uno por fila de la rejilla (dos si cruza el antimeridiano), fusionando
+    los contiguos. Puede incluir puntos algo más lejanos; el filtro exacto lo hace
+    haversine_km sobre los candidatos.
+    """
+    latitud, longitud = float(latitud), float(longitud)
+    delta_lat = radio_km / KM_POR_GRADO
+    fila_min, fila_max = _fila(latitud - delta_lat), _fila(latitud + delta_lat)
+    if fila_max - fila_min + 1 > MAX_FILAS:
+        return [(fila_min * COLUMNAS, fila_max * COLUMNAS + COLUMNAS - 1)]
+
+    # El ancho en longitud se calcula con la latitud del borde más cercano al polo
+    latitud_extrema = min(abs(latitud) + delta_lat, 90)
+    coseno = math.cos(math.radians(latitud_extrema))
+    delta_lon = radio_km / (KM_POR_GRADO * coseno) if coseno > 1e-9 else 360
+    if delta_lon >= 180:
+        columnas = [(0, COLUMNAS - 1)]
+    else:
+        inicio = math.floor((longitud - delta_lon + 180) / CELDA_GRADOS)
+        fin = math.floor((longitud + delta_lon + 180) / CELDA_GRADOS)
+        if inicio < 0:
+            columnas = [(0, fin), (inicio + COLUMNAS, COLUMNAS - 1)]
+        elif fin >= COLUMNAS:
+            columnas = [(0, fin - COLUMNAS), (inicio, COLUMNAS - 1)]
+        else:
+            columnas = [(inicio, fin)]
+
+    rangos = []
+    for fila in range(fila_min, fila_max + 1):
+        for inicio, fin in columnas:
+            rango = (fila * COLUMNAS + inicio, fila * COLUMNAS + fin)
+            if rangos and rangos[-1][1] + 1 >= rango[0]:
+                rangos[-1] = (rangos[-1][0], max(rangos[-1][1], rango[1]))
+            else:
+                rangos.append(rango)
+    return sorted(rangos)
+
+
+def haversine_km(latitud, longitud, latitudes, longitudes):
+    """Distancia en km desde un punto a un array de puntos (vectorizado con NumPy)."""
+    lat1 = np.radians(float(latitud))
+    lat2 = np.radians(np.asarray(latitudes, dtype=np.float64))
+    dlat = lat2 - lat1
+    dlon = np.radians(np.asarray(longitudes, dtype=np.float64) - float(longitud))
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+# --------------------- TESELAS WEB MERCATOR ---------------------
+
+# Latitud máxima de la proyección Web Mercator (la de los mapas de Leaflet/OSM)
+LATITUD_MAX_MERCATOR = 85.0511287798
+
+
+def limites_tesela(zoom, x, y):
+    """(sur, oeste, norte, este) en grados de la tesela z/x/y del esquema XYZ."""
+    n = 2 ** zoom
+    oeste = x / n * 360 - 180
+    este = (x + 1) / n * 360 - 180
+    norte = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    sur = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return sur, oeste, norte, este
+
+
+def _fila_tesela(latitud, n):
+    latitud = math.radians(min(max(latitud, -LATITUD_MAX_MERCATOR), LATITUD_MAX_MERCATOR))
+    fila = math.floor((1 - math.asinh(math.tan(latitud)) / math.pi) / 2 * n)
+    return min(max(fila, 0), n - 1)
+
+
+def teselas_bbox(sur, oeste, norte, este, zoom):
+    """
+    Teselas (x, y) del zoom que cubren el recuadro. Las longitudes pueden salirse de
+    [-180, 180] (el mapa se desplazó más allá del antimeridiano): las columnas se
+    toman módulo 2**zoom.
+    """
+    n = 2 ** zoom
+    if este - oeste >= 360:
+        columnas = range(n)
+    else:
+        inicio = math.floor((oeste + 180) / 360 * n)
+        fin = math.floor((este + 180) / 360 * n)
+        columnas = sorted({x % n for x in range(inicio, fin + 1)})
+    filas = range(_fila_tesela(norte, n), _fila_tesela(sur, n) + 1)
+    return [(x, y) for y in filas for x in columnas]
@@ -0,0 +1,110 @@
+import os
+import logging
+import threading
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+MODOS_INFERENCIA = ('keras', 'compilado', 'tflite')
+
+
+class KerasPredictor:
+    """Ruta original: model.predict() (pipeline de datos, callbacks y bucle de steps)."""
+
+    modo = 'keras'
+
+    def __init__(self, modelo):
+        self.modelo = modelo
+        self.input_shape = tuple(modelo.input_shape[1:])
+
+    def __call__(self, x):
+        return self.modelo.predict(x, verbose=0)
+
+
+class CompiledPredictor:
+    """
+    Llamada directa al modelo trazada con tf.function y firma de entrada fija.
+
+    Se traza una sola vez (batch variable, 128x128x3) y cada predicción es un
+    único call al grafo, sin el overhead de model.predict().
+    """
+
+    modo = 'compilado'
+
+    def __init__(self, modelo, jit_compile=False):
+        import tensorflow as tf
+
+        self.modelo = modelo
+        self.input_shape = tuple(modelo.input_shape[1:])
+        self._tf = tf
+        self._fn = tf.function(
+            lambda x: modelo(x, training=False),
+            input_signature=[tf.TensorSpec(shape=(None,) + self.input_shape, dtype=tf.float32)],
+            jit_compile=jit_compile,
+        )
+
+    def __call__(self, x):
+        x = self._tf.convert_to_tensor(np.asarray(x, dtype=np.float32))
+        return self._fn(x).numpy()
+
+
+class TFLitePredictor:
+    """Artefacto .tflite exportado (ver `manage.py exportar_modelo_tflite`)."""
+
+    modo = 'tflite'
+
+    def __init__(self, ruta, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.ruta = ruta
+        self._interprete = Interpreter(model_path=ruta, num_threads=num_threads)
+        self._interprete.allocate_tensors()
+        self._entrada = self._interprete.get_input_details()[0]
+        self._salida = self._interprete.get_output_details()[0]
+        self.input_shape = tuple(int(d) for d in self._entrada['shape'][1:])
+        self._batch_actual = int(self._entrada['shape'][0])
+        # El intérprete no es thread-safe
+        self._lock = threading.Lock()
+
+    def __call__(self, x):
+        x = np.asarray(x, dtype=self._entrada['dtype'])
+        with self._lock:
+            if x.shape[0] != self._batch_actual:
+                self._interprete.resize_tensor_input(self._entrada['index'], (x.shape[0],) + self.input_shape)
+                self._interprete.allocate_tensors()
+                self._batch_actual = x.shape[0]
+            self._interprete.set_tensor(self._entrada['index'], x)
+            self._interprete.invoke()
+            return self._interprete.get_tensor(self._salida['index']).copy()
+
+
+def ruta_tflite(ruta_modelo):
+    return os.path.splitext(ruta_modelo)[0] + '.tflite'
+
+
+def build_predictor(ruta_modelo, modo, modelo=None, jit_compile=False):
+    """
+    Construye el callable (batch -> probabilidades) para el modo indicado.
+
+    Devuelve (predictor, modelo_keras). En modo tflite no se carga Keras.
+    """
+    if modo not in MODOS_INFERENCIA:
+        raise ValueError(f"Modo de inferencia no soportado: {modo}")
+
+    if modo == 'tflite':
+        return TFLitePredictor(ruta_tflite(ruta_modelo)), None
+
+    if modelo is None:
+        from keras import models
+        modelo = models.load_model(ruta_modelo, compile=False)
+
+    if modo == 'compilado':
+        return CompiledPredictor(modelo, jit_compile=jit_compile), modelo
+    return KerasPredictor(modelo), modelo
@@ -0,0 +1,181 @@
+import time
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+
+# Límites (segundos) de los histogramas de duración: de 1 ms a 30 s
+BUCKETS_DURACION = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _etiquetas_texto(nombres, valores, extra=None):
+    pares = [f'{nombre}="{str(valor)}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+class Histograma:
+    """Histograma acumulativo al estilo Prometheus, una serie por combinación de etiquetas."""
+
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_DURACION):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, **etiquetas):
+        clave = tuple(etiquetas.get(nombre, '') for nombre in self.etiquetas)
+        indice = bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = {'buckets': [0] * (len(self.buckets) + 1), 'suma': 0.0, 'cuenta': 0}
+            serie['buckets'][indice] += 1
+            serie['suma'] += valor
+            serie['cuenta'] += 1
+
+    def resumen(self):
+        """{etiquetas: (cuenta, suma)} para consultas rápidas sin pasar por el texto."""
+        with self._lock:
+            return {clave: (serie['cuenta'], serie['suma']) for clave, serie in self._series.items()}
+
+    def exportar(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            series = {clave: (list(s['buckets']), s['suma'], s['cuenta']) for clave, s in self._series.items()}
+        for clave, (buckets, suma, cuenta) in sorted(series.items()):
+            acumulado = 0
+            for limite, n in zip(self.buckets + ('+Inf',), buckets):
+                acumulado += n
+                etiquetas = _etiquetas_texto(self.etiquetas, clave, 'le="%s"' % limite)
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas_texto(self.etiquetas, clave)} {suma}")
+            lineas.append(f"{self.nombre}_count{_etiquetas_texto(self.etiquetas, clave)} {cuenta}")
+        return lineas
+
+
+class Contador:
+    tipo = 'counter'
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, cantidad=1, **etiquetas):
+        clave = tuple(etiquetas.get(nombre, '') for nombre in self.etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+    def exportar(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        with self._lock:
+            valores = dict(self._valores)
+        for clave, valor in sorted(valores.items()):
+            lineas.append(f"{self.nombre}{_etiquetas_texto(self.etiquetas, clave)} {valor}")
+        return lineas
+
+
+class RegistroMetricas:
+    """
+    Métricas del proceso en memoria. Con varios workers de gunicorn cada proceso
+    expone las suyas; Prometheus las distingue por la instancia que scrapea.
+    """
+
+    def __init__(self):
+        self._metricas = {}
+        self._recolectores = []
+        self._lock = threading.Lock()
+
+    def _obtener(self, clase, nombre, *args, **kwargs):
+        with self._lock:
+            metrica = self._metricas.get(nombre)
+            if metrica is None:
+                metrica = self._metricas[nombre] = clase(nombre, *args, **kwargs)
+            return metrica
+
+    def histograma(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_DURACION):
+        return self._obtener(Histograma, nombre, ayuda, etiquetas, buckets)
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        return self._obtener(Contador, nombre, ayuda, etiquetas)
+
+    def registrar_recolector(self, funcion):
+        """`funcion()` devuelve líneas de texto ya formateadas (p. ej. gauges calculados al exportar)."""
+        self._recolectores.append(funcion)
+
+    def exportar(self):
+        """Formato de texto de Prometheus (text/plain; version=0.0.4)."""
+        lineas = []
+        with self._lock:
+            metricas = list(self._metricas.values())
+        for metrica in metricas:
+            lineas.extend(metrica.exportar())
+        for recolector in self._recolectores:
+            try:
+                lineas.extend(recolector())
+            except Exception as e:
+                logger.error(f"Error en un recolector de métricas: {e}")
+        return '\n'.join(lineas) + '\n'
+
+
+registro = RegistroMetricas()
+
+duracion_etapas = registro.histograma(
+    'agrobanania_etapa_duracion_segundos',
+    'Duración de cada etapa del análisis de imágenes',
+    etiquetas=('etapa',),
+)
+
+duracion_trazas = registro.histograma(
+    'agrobanania_traza_duracion_segundos',
+    'Duración total de cada petición o trabajo trazado',
+    etiquetas=('traza',),
+)
+
+_traza = threading.local()
+
+
+@contextmanager
+def medir(etapa):
+    """
+    Span de una etapa (subida, decodificacion, preprocesado, inferencia, segmentacion,
+    codificacion, limpieza...). Se acumula en el histograma y, si hay una traza
+    abierta en el hilo, también en ella.
+    """
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - inicio
+        duracion_etapas.observar(duracion, etapa=etapa)
+        tramos = getattr(_traza, 'tramos', None)
+        if tramos is not None:
+            tramos[etapa] = tramos.get(etapa, 0.0) + duracion
+
+
+@contextmanager
+def traza(nombre):
+    """Agrupa los spans de una petición y los registra en una sola línea de log estructurada."""
+    anteriores = getattr(_traza, 'tramos', None)
+    _traza.tramos = tramos = {}
+    inicio = time.perf_counter()
+    try:
+        yield tramos
+    finally:
+        _traza.tramos = anteriores
+        total = time.perf_counter() - inicio
+        duracion_trazas.observar(total, traza=nombre)
+        detalle = ' '.join(f"{etapa}={segundos * 1000:.1f}ms" for etapa, segundos in tramos.items())
+        logger.info(f"{nombre} total={total * 1000:.1f}ms {detalle}")
@@ -0,0 +1,153 @@
+import os
+import time
+import logging
+import threading
+import traceback
+
+import numpy as np
+
+from AgroBananIA.utils.inference import build_predictor
+
+
+logger = logging.getLogger(__name__)
+
+
+ESTADO_SIN_CARGAR = 'sin_cargar'
+ESTADO_CARGANDO = 'cargando'
+ESTADO_LISTO = 'listo'
+ESTADO_ERROR = 'error'
+
+
+class ModelRegistry:
+    """
+    Registro de modelos compartido por todo el proceso.
+
+    Los modelos se registran solo con su ruta; TensorFlow/Keras se importa y el
+    archivo .keras se deserializa la primera vez que alguien pide el modelo
+    (o cuando se llama a warm_up() desde CoreConfig.ready()).
+
+    Cada modelo expone un predictor (batch -> probabilidades) construido según
+    `modo`: 'keras' (model.predict), 'compilado' (tf.function con firma fija)
+    o 'tflite' (artefacto exportado junto al .keras).
+    """
+
+    def __init__(self):
+        self._modelos = {}
+        self._lock = threading.Lock()
+
+    def register(self, nombre, ruta, modo='keras', jit_compile=False):
+        with self._lock:
+            self._modelos[nombre] = {
+                'ruta': ruta,
+                'modo': modo,
+                'jit_compile': jit_compile,
+                'modelo': None,
+                'predictor': None,
+                'estado': ESTADO_SIN_CARGAR,
+                'tiempo_carga': None,
+                'cargado_en': None,
+                'error': None,
+            }
+
+    def _entrada(self, nombre):
+        try:
+            return self._modelos[nombre]
+        except KeyError:
+            raise KeyError(f"Modelo no registrado: {nombre}")
+
+    def registrado(self, nombre):
+        return nombre in self._modelos
+
+    def ruta(self, nombre):
+        return self._entrada(nombre)['ruta']
+
+    def version(self, nombre):
+        """
+        Identificador de la versión del modelo sin cargarlo (archivo + fecha de modificación).
+        Cambia al desplegar un nuevo .keras, lo que invalida los resultados cacheados.
+        """
+        ruta = self._entrada(nombre)['ruta']
+        try:
+            return f"{os.path.basename(ruta)}@{int(os.path.getmtime(ruta))}"
+        except OSError:
+            return os.path.basename(ruta)
+
+    def _cargar(self, entrada):
+        entrada['estado'] = ESTADO_CARGANDO
+        inicio = time.perf_counter()
+        try:
+            # build_predictor importa TensorFlow/Keras de forma diferida: solo se paga al cargar
+            entrada['predictor'], entrada['modelo'] = build_predictor(
+                entrada['ruta'], entrada['modo'], jit_compile=entrada['jit_compile']
+            )
+            entrada['estado'] = ESTADO_LISTO
+            entrada['error'] = None
+            logger.info(f"Modelo cargado correctamente: {entrada['ruta']} (modo {entrada['modo']})")
+        except Exception as e:
+            entrada['modelo'] = None
+            entrada['predictor'] = None
+            entrada['estado'] = ESTADO_ERROR
+            entrada['error'] = str(e)
+            logger.error(f"Error al cargar el modelo {entrada['ruta']}: {e}")
+            logger.debug(traceback.format_exc())
+        finally:
+            entrada['tiempo_carga'] = time.perf_counter() - inicio
+            entrada['cargado_en'] = time.time()
+        if entrada['estado'] == ESTADO_LISTO:
+            logger.info(f"Tiempo de carga del modelo: {entrada['tiempo_carga']:.2f}s")
+
+    def _asegurar_cargado(self, nombre):
+        entrada = self._entrada(nombre)
+        if entrada['estado'] in (ESTADO_SIN_CARGAR, ESTADO_CARGANDO):
+            with self._lock:
+                # Otro hilo pudo haberlo cargado mientras esperábamos el lock
+                if entrada['estado'] in (ESTADO_SIN_CARGAR, ESTADO_CARGANDO):
+                    self._cargar(entrada)
+        return entrada
+
+    def get(self, nombre):
+        """Devuelve el modelo Keras cargándolo bajo demanda (None si la carga falló o en modo tflite)."""
+        return self._asegurar_cargado(nombre)['modelo']
+
+    def predictor(self, nombre):
+        """Devuelve el callable de inferencia del modelo (None si la carga falló)."""
+        return self._asegurar_cargado(nombre)['predictor']
+
+    def reload(self, nombre, modo=None):
+        entrada = self._entrada(nombre)
+        with self._lock:
+            if modo:
+                entrada['modo'] = modo
+            self._cargar(entrada)
+        return entrada['predictor']
+
+    def warm_up(self, nombre):
+        """
+        Carga el modelo de forma explícita (pensado para procesos que sirven peticiones)
+        y ejecuta una predicción de prueba para que el trazado del grafo no lo pague
+        el primer usuario.
+        """
+        predictor = self.predictor(nombre)
+        if predictor is None:
+            return False
+        predictor(np.zeros((1,) + predictor.input_shape, dtype=np.float32))
+        return True
+
+    def estado(self, nombre=None):
+        """Estado y tiempo de carga de uno o de todos los modelos registrados."""
+        nombres = [nombre] if nombre else list(self._modelos)
+        resultado = {}
+        for n in nombres:
+            entrada = self._entrada(n)
+            resultado[n] = {
+                'archivo': os.path.basename(entrada['ruta']),
+                'modo': entrada['modo'],
+                'estado': entrada['estado'],
+                'tiempo_carga': entrada['tiempo_carga'],
+                'cargado_en': entrada['cargado_en'],
+                'error': entrada['error'],
+            }
+        return resultado[nombre] if nombre else resultado
+
+
+model_registry = ModelRegistry()
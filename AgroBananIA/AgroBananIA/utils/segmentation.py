@@ -0,0 +1,353 @@
+import os
+import time
+import uuid
+import logging
+import threading
+
+import numpy as np
+import cv2
+
+from AgroBananIA.utils.metricas import medir
+
+
+logger = logging.getLogger(__name__)
+
+
+# Rojo en BGR: toda la segmentación trabaja en el espacio de color de OpenCV,
+# así cv2.imwrite escribe los buffers directamente sin conversiones.
+COLOR_CONTORNO = (0, 0, 255)
+UMBRAL_OSCURO = 90
+
+# 'umbral': zonas oscuras en escala de grises (rápido, sirve para todas las clases).
+# 'adaptativo': rango HSV y morfología según la enfermedad predicha.
+MODO_UMBRAL = 'umbral'
+MODO_ADAPTATIVO = 'adaptativo'
+MODOS_SEGMENTACION = (MODO_UMBRAL, MODO_ADAPTATIVO)
+
+# Rangos HSV optimizados por enfermedad (OpenCV: H 0-180)
+# Formato: (lower_bound, upper_bound)
+RANGOS_HSV_POR_CLASE = {
+    0: ([0, 0, 0], [180, 255, 100]),           # Black Sigatoka: zonas oscuras/necróticas (marrón-negro)
+    1: ([35, 40, 40], [85, 255, 255]),         # Healthy Leaf: verde saludable (no debería segmentar mucho)
+    2: ([0, 50, 50], [15, 255, 255]),          # Insect Pest: áreas rojizas, marrones claras
+    3: ([15, 60, 60], [35, 255, 230]),         # Moko: amarillo-verdoso con manchas marrones
+    4: ([18, 70, 50], [30, 255, 200]),         # Panama: amarillo-marrón en márgenes de hojas
+    5: ([20, 100, 100], [35, 255, 255]),       # Yellow Sigatoka: amarillo brillante con centro marrón
+}
+# Sin clase predicha se segmentan las zonas oscuras, como en Black Sigatoka
+RANGO_HSV_POR_DEFECTO = RANGOS_HSV_POR_CLASE[0]
+
+# Lesiones con menos píxeles que esto se consideran ruido
+AREA_MINIMA = 100
+PESO_OVERLAY = 0.6
+
+# Histograma de tamaños de lesión, en % del área de la imagen (independiente de la resolución)
+LIMITES_HISTOGRAMA_LESIONES = (0, 0.01, 0.05, 0.25, 1, 5, 100)
+
+# Artefactos que se pueden renderizar a partir de la máscara (sufijo del archivo)
+ARTEFACTOS = {
+    "contorno": "contour",
+    "overlay": "overlay",
+    "damage": "damage",
+}
+SUFIJO_MASCARA = "mask"
+# PNG de 1 bit por píxel: la máscara de una foto de 12MP ocupa unos pocos KB
+_PARAMETROS_PNG = [cv2.IMWRITE_PNG_BILEVEL, 1, cv2.IMWRITE_PNG_COMPRESSION, 3]
+
+# Límites y elementos estructurantes se construyen una sola vez al importar el módulo
+_RANGOS = {
+    clase: (np.array(inferior, dtype=np.uint8), np.array(superior, dtype=np.uint8))
+    for clase, (inferior, superior) in RANGOS_HSV_POR_CLASE.items()
+}
+_RANGO_DEFECTO = _RANGOS[0]
+_KERNEL_LESION_ALARGADA = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))   # Sigatokas
+_KERNEL_MANCHA = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))            # Moko, Panama y resto
+_KERNELS = {0: _KERNEL_LESION_ALARGADA, 5: _KERNEL_LESION_ALARGADA}
+
+_FILAS_POR_BLOQUE = 256
+
+_buffers = threading.local()
+
+_tiempos_lock = threading.Lock()
+_tiempos = {}
+
+
+def _buffer(nombre, shape, dtype=np.uint8):
+    """
+    Buffer reutilizable por hilo. Las fotos de un mismo teléfono tienen
+    siempre el mismo tamaño, así que tras la primera imagen no se reserva memoria.
+    """
+    pool = getattr(_buffers, 'pool', None)
+    if pool is None:
+        pool = _buffers.pool = {}
+    buf = pool.get(nombre)
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+        buf = pool[nombre] = np.empty(shape, dtype=dtype)
+    return buf
+
+
+def _registrar_tiempo(modo, mascara_ms, total_ms):
+    with _tiempos_lock:
+        acumulado = _tiempos.setdefault(modo, {'llamadas': 0, 'mascara_ms': 0.0, 'total_ms': 0.0, 'max_ms': 0.0})
+        acumulado['llamadas'] += 1
+        acumulado['mascara_ms'] += mascara_ms
+        acumulado['total_ms'] += total_ms
+        acumulado['max_ms'] = max(acumulado['max_ms'], total_ms)
+
+
+def metricas():
+    """Tiempos medios por modo de segmentación desde el arranque del proceso."""
+    with _tiempos_lock:
+        return {
+            modo: {
+                'llamadas': datos['llamadas'],
+                'mascara_media_ms': datos['mascara_ms'] / datos['llamadas'],
+                'total_media_ms': datos['total_ms'] / datos['llamadas'],
+                'max_ms': datos['max_ms'],
+            }
+            for modo, datos in _tiempos.items()
+        }
+
+
+def reducir_imagen(img, max_lado=None):
+    """Reduce las fotos muy grandes (12MP de teléfono) antes de segmentar."""
+    if not max_lado:
+        return img
+    alto, ancho = img.shape[:2]
+    escala = max_lado / float(max(alto, ancho))
+    if escala >= 1:
+        return img
+    return cv2.resize(img, (round(ancho * escala), round(alto * escala)), interpolation=cv2.INTER_AREA)
+
+
+def calcular_mascara(img):
+    """Máscara binaria de las zonas oscuras (lesiones) de una imagen BGR."""
+    gris = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=_buffer('gris', img.shape[:2]))
+    _, mascara = cv2.threshold(gris, UMBRAL_OSCURO, 255, cv2.THRESH_BINARY_INV, dst=_buffer('mascara', img.shape[:2]))
+    return mascara
+
+
+def _componentes(mascara):
+    etiquetas = _buffer('etiquetas', mascara.shape, np.int32)
+    _, etiquetas, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(
+        mascara, 8, cv2.CV_32S, cv2.CCL_GRANA, labels=etiquetas
+    )
+    return etiquetas, stats[:, cv2.CC_STAT_AREA]
+
+
+def filtrar_componentes(mascara, area_minima=AREA_MINIMA):
+    """
+    Elimina las regiones más pequeñas que `area_minima`. Las áreas salen de
+    connectedComponentsWithStats y el filtrado es una tabla de búsqueda sobre
+    las etiquetas, sin recorrer los contornos en Python.
+
+    Devuelve la máscara filtrada y las áreas (px) de las regiones conservadas.
+    """
+    etiquetas, areas = _componentes(mascara)
+    conservar = areas > area_minima
+    conservar[0] = False  # fondo
+    if conservar[1:].all():
+        return mascara, areas[1:]
+
+    tabla = np.where(conservar, 255, 0).astype(np.uint8)
+    filtrada = _buffer('mascara_filtrada', mascara.shape)
+    # np.take convierte los índices a intp: por bloques de filas el temporal queda acotado
+    for fila in range(0, mascara.shape[0], _FILAS_POR_BLOQUE):
+        np.take(tabla, etiquetas[fila:fila + _FILAS_POR_BLOQUE], out=filtrada[fila:fila + _FILAS_POR_BLOQUE])
+    return filtrada, areas[conservar]
+
+
+def calcular_metricas(mascara, areas=None):
+    """
+    Severidad a partir de la máscara: porcentaje de la imagen con lesión, número
+    de lesiones (regiones de más de AREA_MINIMA px) e histograma de sus tamaños.
+    `areas` evita repetir el etiquetado cuando el filtrado ya lo calculó.
+    """
+    total = mascara.size
+    if areas is None:
+        _, areas = _componentes(mascara)
+        areas = areas[1:]
+    lesiones = areas[areas > AREA_MINIMA]
+    histograma, _ = np.histogram(lesiones * (100.0 / total), bins=LIMITES_HISTOGRAMA_LESIONES)
+    return {
+        'area_lesion_pct': round(cv2.countNonZero(mascara) * 100.0 / total, 3),
+        'num_lesiones': int(lesiones.size),
+        'histograma_lesiones': histograma.tolist(),
+    }
+
+
+def calcular_mascara_adaptativa(img, clase=None):
+    """
+    Máscara HSV de la enfermedad predicha, con cierre/apertura morfológica y sin
+    regiones pequeñas. Devuelve también las áreas de las regiones conservadas.
+    """
+    inferior, superior = _RANGOS.get(clase, _RANGO_DEFECTO)
+    kernel = _KERNELS.get(clase, _KERNEL_MANCHA)
+
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV, dst=_buffer('hsv', img.shape))
+    mascara = cv2.inRange(hsv, inferior, superior, dst=_buffer('rango', img.shape[:2]))
+    morfologia = _buffer('morfologia', img.shape[:2])
+    cv2.morphologyEx(mascara, cv2.MORPH_CLOSE, kernel, dst=morfologia, iterations=2)
+    cv2.morphologyEx(morfologia, cv2.MORPH_OPEN, kernel, dst=mascara, iterations=1)
+    return filtrar_componentes(mascara)
+
+
+def renderizar_contorno(img, mascara, contornos=None):
+    if contornos is None:
+        contornos, _ = cv2.findContours(mascara, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    contorno = _buffer('contorno', img.shape)
+    np.copyto(contorno, img)
+    cv2.drawContours(contorno, contornos, -1, COLOR_CONTORNO, 2)
+    return contorno
+
+
+def renderizar_overlay(img, mascara, peso=0.6):
+    # Equivale a addWeighted(img, 0.7, heatmap, peso, 0) con el heatmap solo en el
+    # canal rojo, pero sin construir el heatmap de 3 canales
+    overlay = cv2.convertScaleAbs(img, dst=_buffer('overlay', img.shape), alpha=0.7)
+    rojo = cv2.extractChannel(img, 2, dst=_buffer('canal', img.shape[:2]))
+    rojo = cv2.addWeighted(rojo, 0.7, mascara, peso, 0, dst=rojo)
+    cv2.insertChannel(rojo, overlay, 2)
+    return overlay
+
+
+def renderizar_dano(img, mascara):
+    dano = _buffer('dano', img.shape)
+    dano.fill(0)
+    cv2.bitwise_and(img, img, dst=dano, mask=mascara)
+    return dano
+
+
+def nombres_artefactos(uid):
+    """Nombres de archivo de la máscara y de los tres artefactos de una segmentación."""
+    nombres = {clave: f"{uid}_{sufijo}.jpg" for clave, sufijo in ARTEFACTOS.items()}
+    nombres["mascara"] = f"{uid}_{SUFIJO_MASCARA}.png"
+    return nombres
+
+
+def uid_diferido(nombre_original):
+    """
+    Identificador de una segmentación diferida. Incluye el nombre del original
+    para poder renderizar los artefactos más tarde sin consultar la base de datos.
+    """
+    return f"{nombre_original}.{uuid.uuid4().hex[:12]}"
+
+
+def separar_artefacto(nombre):
+    """Devuelve (uid, clave) de un nombre como '<uid>_overlay.jpg', o None si no es un artefacto."""
+    base, _, resto = nombre.rpartition("_")
+    for clave, sufijo in ARTEFACTOS.items():
+        if base and resto == f"{sufijo}.jpg":
+            return base, clave
+    return None
+
+
+def original_de(uid):
+    """Nombre del original de una segmentación diferida (None si el uid es de una segmentación inmediata)."""
+    original, separador, _ = uid.rpartition(".")
+    return original if separador else None
+
+
+def _calcular(image, max_lado, modo, clase):
+    """Imagen reducida, máscara y métricas de lesión."""
+    if modo not in MODOS_SEGMENTACION:
+        raise ValueError(f"Modo de segmentación no soportado: {modo}")
+    with medir('segmentacion'):
+        img = reducir_imagen(image, max_lado)
+        if modo == MODO_ADAPTATIVO:
+            mascara, areas = calcular_mascara_adaptativa(img, clase)
+        else:
+            mascara, areas = calcular_mascara(img), None
+        return img, mascara, calcular_metricas(mascara, areas)
+
+
+def _escribir(ruta, imagen, parametros=()):
+    # Escritura atómica: dos peticiones que renderizan el mismo artefacto no se pisan
+    base, extension = os.path.splitext(ruta)
+    temporal = f"{base}.{uuid.uuid4().hex}.tmp{extension}"
+    with medir('codificacion'):
+        escrito = cv2.imwrite(temporal, imagen, list(parametros))
+    if not escrito:
+        raise IOError(f"No se pudo escribir {ruta}")
+    os.replace(temporal, ruta)
+
+
+def _renderizar(clave, img, mascara):
+    if clave == "contorno":
+        return renderizar_contorno(img, mascara)
+    if clave == "overlay":
+        return renderizar_overlay(img, mascara, PESO_OVERLAY)
+    return renderizar_dano(img, mascara)
+
+
+def segment_and_save(image, output_dir, max_lado=None, modo=MODO_UMBRAL, clase=None):
+    """
+    Segmenta las zonas afectadas y guarda contorno, overlay y región dañada.
+
+    La imagen (BGR) se reduce opcionalmente a `max_lado` píxeles, la máscara se
+    calcula una sola vez según `modo` (en 'adaptativo' con el rango de la `clase`
+    predicha) y los tres artefactos se dibujan sobre buffers preasignados que se
+    escriben tal cual a disco. Junto a las rutas devuelve las métricas de lesión
+    en la clave "metricas".
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    inicio = time.perf_counter()
+    img, mascara, metricas_lesion = _calcular(image, max_lado, modo, clase)
+    mascara_ms = (time.perf_counter() - inicio) * 1000
+
+    nombres = nombres_artefactos(uuid.uuid4().hex)
+    paths = {"metricas": metricas_lesion}
+    for clave in ARTEFACTOS:
+        paths[clave] = os.path.join(output_dir, nombres[clave])
+        artefacto = _renderizar(clave, img, mascara)
+        with medir('codificacion'):
+            cv2.imwrite(paths[clave], artefacto)
+
+    total_ms = (time.perf_counter() - inicio) * 1000
+    _registrar_tiempo(modo, mascara_ms, total_ms)
+    logger.debug(f"Segmentación '{modo}' (clase {clase}): máscara {mascara_ms:.1f} ms, total {total_ms:.1f} ms")
+    return paths
+
+
+def guardar_mascara(image, output_dir, uid, max_lado=None, modo=MODO_UMBRAL, clase=None):
+    """
+    Segmentación diferida: solo guarda la máscara binaria en PNG. Devuelve las
+    rutas de los artefactos (que aún no existen), la de la máscara y las métricas
+    de lesión; cada artefacto se genera con `renderizar_artefacto` la primera vez
+    que se pide.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    inicio = time.perf_counter()
+    _, mascara, metricas_lesion = _calcular(image, max_lado, modo, clase)
+    mascara_ms = (time.perf_counter() - inicio) * 1000
+
+    paths = {clave: os.path.join(output_dir, nombre) for clave, nombre in nombres_artefactos(uid).items()}
+    paths["metricas"] = metricas_lesion
+    _escribir(paths["mascara"], mascara, _PARAMETROS_PNG)
+
+    total_ms = (time.perf_counter() - inicio) * 1000
+    _registrar_tiempo(modo, mascara_ms, total_ms)
+    logger.debug(f"Máscara '{modo}' (clase {clase}): {mascara_ms:.1f} ms, total {total_ms:.1f} ms")
+    return paths
+
+
+def renderizar_artefacto(ruta_original, ruta_mascara, clave, ruta_destino, max_lado=None):
+    """Genera un artefacto (contorno, overlay o damage) a partir del original y de su máscara."""
+    inicio = time.perf_counter()
+    with medir('decodificacion'):
+        img = cv2.imread(ruta_original, cv2.IMREAD_COLOR)
+        mascara = cv2.imread(ruta_mascara, cv2.IMREAD_GRAYSCALE)
+    if img is None or mascara is None:
+        raise ValueError(f"No se pudo cargar el original o la máscara de {os.path.basename(ruta_destino)}")
+
+    img = reducir_imagen(img, max_lado)
+    if img.shape[:2] != mascara.shape:
+        # La máscara manda: se generó con el SEGMENTACION_MAX_LADO vigente en su momento
+        img = cv2.resize(img, (mascara.shape[1], mascara.shape[0]), interpolation=cv2.INTER_AREA)
+
+    _escribir(ruta_destino, _renderizar(clave, img, mascara))
+    total_ms = (time.perf_counter() - inicio) * 1000
+    _registrar_tiempo(f"render_{clave}", total_ms, total_ms)
+    return ruta_destino
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from app.core.models import Plantacion ,ImagenAnalisis,ResultadoAnalisis ,RegistroCampo,PerfilUsuario,AlertaComunitaria
+from app.core.models import Plantacion ,ImagenAnalisis,ResultadoAnalisis ,RegistroCampo,PerfilUsuario,AlertaComunitaria,TrabajoAnalisis,LoteAnalisis,ComparacionModelo,EstadisticaPlantacion,ResumenRegistroCampo
 # Register your models here.
 admin.site.register(Plantacion)
 admin.site.register(ImagenAnalisis)
@@ -7,5 +7,10 @@ admin.site.register(ResultadoAnalisis)
 admin.site.register(RegistroCampo)
 admin.site.register(AlertaComunitaria)
 admin.site.register(PerfilUsuario)
+admin.site.register(TrabajoAnalisis)
+admin.site.register(LoteAnalisis)
+admin.site.register(ComparacionModelo)
+admin.site.register(EstadisticaPlantacion)
+admin.site.register(ResumenRegistroCampo)
 
  
\ No newline at end of file
@@ -0,0 +1,209 @@
+import logging
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from app.core.models import AlertaComunitaria, Plantacion
+from app.core.paginacion import pagina_keyset
+from AgroBananIA.utils.diagnostic import class_mapping, CLASE_SANA
+from AgroBananIA.utils.geo import haversine_km, rangos_celdas
+from AgroBananIA.utils.metricas import medir
+
+
+logger = logging.getLogger(__name__)
+
+
+def filtro_cercania(latitud, longitud, radio_km, campo='celda_geo'):
+    """
+    Q sobre Plantacion.celda_geo (u otro `campo` que llegue a ella, como
+    'plantacion_origen__celda_geo') con las celdas que cubren el radio: un rango por
+    fila de la rejilla.
+    """
+    filtro = Q()
+    for inicio, fin in rangos_celdas(latitud, longitud, radio_km):
+        filtro |= Q(**{f'{campo}__range': (inicio, fin)})
+    return filtro
+
+
+def plantaciones_cercanas(latitud, longitud, radio_km, queryset=None):
+    """
+    Plantaciones a `radio_km` o menos del punto, como [(plantacion, distancia_km)]
+    ordenadas por distancia. El índice de celda_geo reduce la consulta a las celdas
+    vecinas y la distancia exacta se calcula con NumPy sobre esos candidatos.
+    """
+    queryset = Plantacion.objects.all() if queryset is None else queryset
+    candidatas = list(queryset.filter(filtro_cercania(latitud, longitud, radio_km)))
+    if not candidatas:
+        return []
+
+    coordenadas = np.array([(p.latitud, p.longitud) for p in candidatas], dtype=np.float64)
+    distancias = haversine_km(latitud, longitud, coordenadas[:, 0], coordenadas[:, 1])
+    orden = np.argsort(distancias, kind='stable')
+    return [(candidatas[i], float(distancias[i])) for i in orden if distancias[i] <= radio_km]
+
+
+# --------------------- DIFUSIÓN DE ALERTAS ---------------------
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Un solo hilo por proceso: las difusiones salen de la petición y se ejecutan en
+    orden, así dos detecciones seguidas de la misma zona no duplican alertas.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='alertas')
+    return _executor
+
+
+def es_alertable(enfermedad):
+    return bool(enfermedad) and enfermedad in class_mapping.values() and enfermedad != class_mapping[CLASE_SANA]
+
+
+def difundir_alerta(plantacion_id, enfermedad, radio_km=None, ventana=None, batch_size=None):
+    """
+    Crea una AlertaComunitaria para cada productor con plantaciones a `radio_km` o
+    menos del brote. Los destinatarios salen de una sola consulta (celdas vecinas,
+    sin el propio productor ni quienes ya recibieron esta enfermedad en la `ventana`
+    por un brote dentro del mismo radio), la distancia es la de su plantación más
+    cercana y las alertas se insertan con bulk_create por bloques. Devuelve cuántas
+    se crearon.
+    """
+    radio_km = radio_km or getattr(settings, 'ALERTA_RADIO_KM', 15)
+    ventana = ventana or timedelta(hours=getattr(settings, 'ALERTA_VENTANA_HORAS', 24))
+    batch_size = batch_size or getattr(settings, 'ALERTA_BATCH', 1000)
+
+    origen = Plantacion.objects.only('id', 'usuario_id', 'latitud', 'longitud', 'celda_geo').get(pk=plantacion_id)
+    ahora = timezone.now()
+    # Un brote en una finca vecina ya avisó a la zona aunque caiga en otra celda
+    ya_avisados = AlertaComunitaria.objects.filter(
+        filtro_cercania(origen.latitud, origen.longitud, radio_km, campo='plantacion_origen__celda_geo'),
+        enfermedad=enfermedad,
+        fecha_alerta__gte=ahora - ventana,
+    ).values('usuario_destino_id')
+
+    with medir('alertas_destinatarios'):
+        candidatas = list(
+            Plantacion.objects.filter(filtro_cercania(origen.latitud, origen.longitud, radio_km))
+            .exclude(usuario_id=origen.usuario_id)
+            .exclude(usuario_id__in=ya_avisados)
+            .values_list('usuario_id', 'latitud', 'longitud')
+        )
+        if not candidatas:
+            return 0
+        datos = np.array(candidatas, dtype=np.float64)
+        distancias = haversine_km(origen.latitud, origen.longitud, datos[:, 1], datos[:, 2])
+        dentro = distancias <= radio_km
+        usuarios, distancias = datos[dentro, 0].astype(np.int64), distancias[dentro]
+        # Una alerta por productor, con la distancia de su plantación más cercana
+        orden = np.lexsort((distancias, usuarios))
+        usuarios, distancias = usuarios[orden], distancias[orden]
+        primeros = np.r_[True, usuarios[1:] != usuarios[:-1]] if len(usuarios) else np.zeros(0, dtype=bool)
+        usuarios, distancias = usuarios[primeros], distancias[primeros]
+
+    with medir('alertas_escritura'), transaction.atomic():
+        for inicio in range(0, len(usuarios), batch_size):
+            AlertaComunitaria.objects.bulk_create([
+                AlertaComunitaria(
+                    usuario_origen_id=origen.usuario_id,
+                    usuario_destino_id=int(usuario),
+                    plantacion_origen_id=origen.pk,
+                    enfermedad=enfermedad,
+                    distancia=round(float(distancia), 2),
+                    fecha_alerta=ahora,
+                )
+                for usuario, distancia in zip(usuarios[inicio:inicio + batch_size], distancias[inicio:inicio + batch_size])
+            ])
+    invalidar_no_leidas(usuarios.tolist())
+
+    logger.info(f"Alerta de {enfermedad} desde la plantación {plantacion_id}: {len(usuarios)} productores avisados")
+    return len(usuarios)
+
+
+def _difundir(plantacion_id, enfermedad):
+    close_old_connections()
+    try:
+        difundir_alerta(plantacion_id, enfermedad)
+    except Exception as e:
+        logger.exception(f"Error al difundir la alerta de {enfermedad} desde la plantación {plantacion_id}: {e}")
+    finally:
+        close_old_connections()
+
+
+def programar_alertas(detecciones):
+    """
+    Encola la difusión de cada (plantacion_id, enfermedad) distinto cuando la
+    transacción en curso se confirma; los diagnósticos sanos se ignoran.
+    """
+    pendientes = {(plantacion_id, enfermedad) for plantacion_id, enfermedad in detecciones
+                  if plantacion_id and es_alertable(enfermedad)}
+    if not pendientes or not getattr(settings, 'ALERTAS_ACTIVAS', True):
+        return
+    for plantacion_id, enfermedad in pendientes:
+        transaction.on_commit(
+            lambda plantacion_id=plantacion_id, enfermedad=enfermedad:
+                get_executor().submit(_difundir, plantacion_id, enfermedad)
+        )
+
+
+# --------------------- BANDEJA DE ENTRADA ---------------------
+
+def _clave_no_leidas(usuario_id):
+    return f"alertas_no_leidas:{usuario_id}"
+
+
+def contar_no_leidas(usuario_id):
+    """
+    Alertas sin leer del usuario. Se consulta en cada página del dashboard, así que
+    el conteo se guarda en la caché hasta que llega una alerta nueva o se marcan
+    como leídas (ALERTAS_CONTADOR_TTL acota el desfase entre procesos).
+    """
+    clave = _clave_no_leidas(usuario_id)
+    total = cache.get(clave)
+    if total is None:
+        total = AlertaComunitaria.objects.filter(usuario_destino_id=usuario_id, leida=False).count()
+        cache.set(clave, total, getattr(settings, 'ALERTAS_CONTADOR_TTL', 300))
+    return total
+
+
+def invalidar_no_leidas(usuario_ids):
+    cache.delete_many([_clave_no_leidas(usuario_id) for usuario_id in usuario_ids])
+
+
+def marcar_leidas(usuario_id, ids=None):
+    """Marca como leídas las alertas `ids` del usuario (todas si no se indican)."""
+    alertas = AlertaComunitaria.objects.filter(usuario_destino_id=usuario_id, leida=False)
+    if ids is not None:
+        alertas = alertas.filter(pk__in=ids)
+    actualizadas = alertas.update(leida=True)
+    if actualizadas:
+        invalidar_no_leidas([usuario_id])
+    return actualizadas
+
+
+def pagina_alertas(usuario_id, cursor=None, tamano=None):
+    """
+    Una página de la bandeja ordenada por (fecha_alerta, id) descendente, paginada
+    por cursor (ver app/core/paginacion.py). Devuelve (alertas, cursor_siguiente o None).
+    """
+    alertas = (
+        AlertaComunitaria.objects.filter(usuario_destino_id=usuario_id)
+        .select_related('usuario_origen', 'plantacion_origen')
+        .only(
+            'id', 'enfermedad', 'distancia', 'fecha_alerta', 'leida',
+            'usuario_origen__username', 'plantacion_origen__nombre_finca', 'plantacion_origen__ubicacion',
+        )
+    )
+    return pagina_keyset(alertas, 'fecha_alerta', cursor, tamano or getattr(settings, 'ALERTAS_POR_PAGINA', 20))
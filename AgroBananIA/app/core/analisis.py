@@ -0,0 +1,286 @@
+import os
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.urls import reverse
+
+from AgroBananIA.utils.diagnostic import (
+    MODEL_CUSTOM,
+    class_mapping,
+    model_registry,
+    inferir_custom,
+    orientar,
+    predict_tiled_custom,
+    preprocess_image_custom,
+    inferencia_por_teselas,
+    obtener_nombre_enfermedad_custom,
+    obtener_recomendaciones_custom,
+    renderizar_artefacto,
+    segment_and_save,
+)
+from app.core import cache_analisis
+from app.core.alertas import programar_alertas
+from app.core.shadow import shadow
+from app.core.models import ImagenAnalisis, ResultadoAnalisis
+from AgroBananIA.utils.metricas import medir
+
+
+logger = logging.getLogger(__name__)
+
+
+CARPETA_RESULTADOS = 'resultados'
+
+
+def ruta_resultados():
+    carpeta = os.path.join(settings.MEDIA_ROOT, CARPETA_RESULTADOS)
+    os.makedirs(carpeta, exist_ok=True)
+    return carpeta
+
+
+def url_resultado(nombre_archivo):
+    return settings.MEDIA_URL + CARPETA_RESULTADOS + '/' + os.path.basename(nombre_archivo)
+
+
+def url_artefacto(nombre_archivo):
+    # Contorno, overlay y región dañada se sirven desde la vista que los genera bajo demanda
+    return reverse('core:deteccion_artefacto', args=[os.path.basename(nombre_archivo)])
+
+
+def obtener_artefacto(nombre_archivo):
+    """Ruta en disco del artefacto (renderizándolo si hace falta) o None si no existe."""
+    nombre = os.path.basename(nombre_archivo)
+    if not nombre or nombre != nombre_archivo:
+        return None
+    return renderizar_artefacto(ruta_resultados(), nombre)
+
+
+def artefacto_de_usuario(nombre_archivo, usuario):
+    """True si el artefacto pertenece a un análisis registrado en una plantación del usuario."""
+    nombre = nombre_media(nombre_archivo)
+    return ImagenAnalisis.objects.filter(plantacion__usuario=usuario).filter(
+        Q(contorno=nombre) | Q(overlay=nombre) | Q(damage=nombre)
+    ).exists()
+
+
+def nombre_media(nombre_archivo):
+    # Ruta relativa a MEDIA_ROOT, tal como la guardan los ImageField
+    return CARPETA_RESULTADOS + '/' + os.path.basename(nombre_archivo)
+
+
+def guardar_original(datos_imagen, nombre_archivo, hash_imagen=None):
+    """
+    Guarda los bytes subidos (única escritura del original) y devuelve el nombre del archivo.
+    Con el hash del contenido el nombre es único por imagen, de modo que dos subidas
+    distintas con el mismo nombre no se pisan (la caché de resultados apunta a este archivo).
+    """
+    if hash_imagen:
+        extension = os.path.splitext(nombre_archivo)[1].lower() or '.jpg'
+        nombre_original = f"original_{hash_imagen[:32]}{extension}"
+    else:
+        nombre_original = f"original_{nombre_archivo}"
+    ruta = os.path.join(ruta_resultados(), nombre_original)
+    with medir('almacenamiento'), open(ruta, 'wb') as destino:
+        destino.write(datos_imagen)
+    logger.info(f"Imagen original guardada en: {ruta}")
+    return nombre_original
+
+
+def construir_resultado(diagnostico_numero, pred_array, paths_dict, nombre_original):
+    """Contexto de deteccion_form.html a partir de la predicción y de los archivos generados."""
+    diagnostico = obtener_nombre_enfermedad_custom(diagnostico_numero)
+    probabilidad = round(float(np.max(pred_array)) * 100, 2)
+    recomendaciones = obtener_recomendaciones_custom(diagnostico_numero)
+    resultado = {
+        'diagnostico': diagnostico,
+        'diagnostico_numero': diagnostico_numero,
+        'probabilidad': probabilidad,
+        'recomendaciones': recomendaciones,
+        'version_modelo': model_registry.version(MODEL_CUSTOM),
+        'imagen_original': {
+            "nombre": "Imagen Original",
+            "url": url_resultado(nombre_original),
+        },
+        'imagenes': [
+            {
+                "nombre": "Contorno de la Enfermedad",
+                "url": url_artefacto(paths_dict["contorno"]),
+                "descripcion": "Áreas afectadas delimitadas con contornos"
+            },
+            {
+                "nombre": "Mapa de Calor (Overlay)",
+                "url": url_artefacto(paths_dict["overlay"]),
+                "descripcion": "Visualización superpuesta de las zonas afectadas"
+            },
+            {
+                "nombre": "Región Afectada",
+                "url": url_artefacto(paths_dict["damage"]),
+                "descripcion": "Solo las áreas con síntomas de la enfermedad"
+            }
+        ],
+        'archivos': {
+            'original': nombre_media(nombre_original),
+            'contorno': nombre_media(paths_dict["contorno"]),
+            'overlay': nombre_media(paths_dict["overlay"]),
+            'damage': nombre_media(paths_dict["damage"]),
+        },
+    }
+    if "mascara" in paths_dict:
+        resultado['archivos']['mascara'] = nombre_media(paths_dict["mascara"])
+    if "metricas" in paths_dict:
+        resultado['metricas'] = paths_dict["metricas"]
+    return resultado
+
+
+def resultado_registrado(resultado_analisis):
+    """
+    Contexto de deteccion_form.html para un análisis ya guardado (detalle desde el
+    listado). Los artefactos se sirven con la misma vista que los genera bajo demanda.
+    """
+    imagen = resultado_analisis.imagen
+    diagnostico_numero = next(
+        (numero for numero, nombre in class_mapping.items() if nombre == resultado_analisis.enfermedad_detectada),
+        None,
+    )
+    resultado = {
+        'diagnostico': resultado_analisis.enfermedad_detectada,
+        'diagnostico_numero': diagnostico_numero,
+        'probabilidad': resultado_analisis.probabilidad,
+        'recomendaciones': resultado_analisis.recomendaciones,
+        'imagen_original': {
+            "nombre": "Imagen Original",
+            "url": imagen.imagen.url,
+        } if imagen.imagen else None,
+        'imagenes': [
+            {"nombre": nombre, "url": url_artefacto(archivo.name), "descripcion": descripcion}
+            for archivo, nombre, descripcion in (
+                (imagen.contorno, "Contorno de la Enfermedad", "Áreas afectadas delimitadas con contornos"),
+                (imagen.overlay, "Mapa de Calor (Overlay)", "Visualización superpuesta de las zonas afectadas"),
+                (imagen.damage, "Región Afectada", "Solo las áreas con síntomas de la enfermedad"),
+            )
+            if archivo
+        ],
+    }
+    if resultado_analisis.area_lesion_pct is not None:
+        resultado['metricas'] = {
+            'area_lesion_pct': resultado_analisis.area_lesion_pct,
+            'num_lesiones': resultado_analisis.num_lesiones,
+            'histograma_lesiones': resultado_analisis.histograma_lesiones,
+        }
+    return resultado
+
+
+def ejecutar_analisis(imagen_bgr, nombre_original, hash_imagen=None, orientacion=1):
+    """
+    Clasifica y segmenta una imagen ya decodificada.
+
+    Devuelve el contexto que consume deteccion_form.html, de modo que el mismo
+    diccionario sirve para la respuesta síncrona y para el resultado de un
+    trabajo asíncrono. Con `hash_imagen` el resultado queda en la caché por contenido.
+    `imagen_bgr` llega sin girar (decode_image_bytes) y así se clasifica; la
+    `orientacion` EXIF solo se aplica a la imagen que se segmenta.
+    """
+    # ========== PASO 1: PREDICCIÓN CON EL MODELO CNN ==========
+    logger.info("Iniciando predicción con Custom CNN...")
+    mapa_teselas = None
+    if inferencia_por_teselas():
+        # El candidato en sombra se compara con la foto reducida, no por teselas
+        diagnostico_numero, pred_array, mapa_teselas = predict_tiled_custom(imagen_bgr)
+    else:
+        with medir('preprocesado'):
+            entradas = preprocess_image_custom(imagen_bgr)
+        diagnostico_numero, pred_array, latencia_ms = inferir_custom(entradas)
+        # Una fracción del tráfico se compara en segundo plano con el modelo candidato;
+        # la latencia es solo la del modelo, como la que se mide para el candidato
+        shadow.observar(pred_array, latencia_ms, entradas=entradas)
+    logger.info(
+        f"Diagnóstico: {obtener_nombre_enfermedad_custom(diagnostico_numero)} "
+        f"(clase {diagnostico_numero}) - Confianza: {float(np.max(pred_array)) * 100:.2f}%"
+    )
+
+    # ========== PASO 2: SEGMENTACIÓN ==========
+    logger.info("Iniciando segmentación...")
+    paths_dict = segment_and_save(
+        image=orientar(imagen_bgr, orientacion),
+        output_dir=ruta_resultados(),
+        predicted_class=diagnostico_numero,
+        nombre_original=nombre_original,
+    )
+
+    logger.info(f"Segmentación completada. Archivos generados: {len(paths_dict)}")
+
+    # ========== PASO 3: PREPARAR DATOS PARA LA PLANTILLA ==========
+    resultado = construir_resultado(diagnostico_numero, pred_array, paths_dict, nombre_original)
+    if mapa_teselas:
+        resultado['teselas'] = mapa_teselas
+
+    if hash_imagen:
+        cache_analisis.guardar(hash_imagen, resultado, list(resultado['archivos'].values()))
+    return resultado
+
+
+def _construir_registros(plantacion_id, resultado):
+    archivos = resultado['archivos']
+    imagen = ImagenAnalisis(
+        plantacion_id=plantacion_id,
+        imagen=archivos['original'],
+        contorno=archivos['contorno'],
+        overlay=archivos['overlay'],
+        damage=archivos['damage'],
+    )
+    metricas = resultado.get('metricas') or {}
+    resultado_analisis = ResultadoAnalisis(
+        imagen=imagen,
+        enfermedad_detectada=resultado['diagnostico'],
+        probabilidad=resultado['probabilidad'],
+        recomendaciones=resultado['recomendaciones'],
+        version_modelo=resultado.get('version_modelo', ''),
+        area_lesion_pct=metricas.get('area_lesion_pct'),
+        num_lesiones=metricas.get('num_lesiones'),
+        histograma_lesiones=metricas.get('histograma_lesiones', []),
+    )
+    return imagen, resultado_analisis
+
+
+def actualizar_prediccion(resultado_analisis, diagnostico_numero, pred_array, version_modelo):
+    """Aplica una nueva predicción a un ResultadoAnalisis existente (sin guardar)."""
+    resultado_analisis.enfermedad_detectada = obtener_nombre_enfermedad_custom(diagnostico_numero)
+    resultado_analisis.probabilidad = round(float(np.max(pred_array)) * 100, 2)
+    resultado_analisis.recomendaciones = obtener_recomendaciones_custom(diagnostico_numero)
+    resultado_analisis.version_modelo = version_modelo
+    return resultado_analisis
+
+
+CAMPOS_PREDICCION = ['enfermedad_detectada', 'probabilidad', 'recomendaciones', 'version_modelo']
+
+
+def guardar_analisis(plantacion_id, resultado):
+    """Registra la imagen, sus tres segmentaciones y el resultado en una sola transacción."""
+    imagen, resultado_analisis = _construir_registros(plantacion_id, resultado)
+    with medir('persistencia'), transaction.atomic():
+        imagen.save()
+        resultado_analisis.imagen = imagen
+        resultado_analisis.save()
+        programar_alertas([(plantacion_id, resultado_analisis.enfermedad_detectada)])
+    return resultado_analisis
+
+
+def guardar_analisis_bulk(items, batch_size=500):
+    """
+    Versión por lotes para importaciones masivas: `items` es una lista de
+    (plantacion_id, resultado). Son dos INSERT por lote en lugar de dos por imagen.
+    """
+    registros = [_construir_registros(plantacion_id, resultado) for plantacion_id, resultado in items]
+    if not registros:
+        return []
+    with medir('persistencia'), transaction.atomic():
+        imagenes = ImagenAnalisis.objects.bulk_create([imagen for imagen, _ in registros], batch_size=batch_size)
+        resultados = []
+        for imagen, (_, resultado_analisis) in zip(imagenes, registros):
+            resultado_analisis.imagen = imagen
+            resultados.append(resultado_analisis)
+        resultados = ResultadoAnalisis.objects.bulk_create(resultados, batch_size=batch_size)
+        programar_alertas((imagen.plantacion_id, resultado.enfermedad_detectada) for imagen, resultado in registros)
+        return resultados
@@ -1,6 +1,25 @@
+import os
+import sys
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app.core'
+
+    def ready(self):
+        # Señales que invalidan las teselas del mapa al cambiar una plantación y que
+        # mantienen EstadisticaPlantacion al guardar o eliminar registros de campo
+        from app.core import mapa, estadisticas  # noqa: F401
+
+        # Warm-up del modelo solo en procesos que sirven peticiones (gunicorn, runserver).
+        # migrate, shell y demás comandos siguen arrancando sin importar TensorFlow.
+        if not getattr(settings, 'MODELO_PRECARGAR', False):
+            return
+        # Con el autoreloader, runserver levanta un proceso padre que no atiende peticiones
+        if 'runserver' in sys.argv and os.environ.get('RUN_MAIN') != 'true':
+            return
+        from AgroBananIA.utils.diagnostic import model_registry, MODEL_CUSTOM
+        model_registry.warm_up(MODEL_CUSTOM)
@@ -0,0 +1,155 @@
+import os
+import hashlib
+import logging
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from app.core.models import CacheAnalisis, ImagenAnalisis
+from AgroBananIA.utils.diagnostic import model_registry, MODEL_CUSTOM, modo_segmentacion, inferencia_por_teselas
+from AgroBananIA.utils import segmentation
+from AgroBananIA.utils.metricas import medir, registro
+
+
+logger = logging.getLogger(__name__)
+
+
+consultas_cache = registro.contador(
+    'agrobanania_cache_analisis_consultas_total',
+    'Consultas a la caché de análisis por contenido',
+    etiquetas=('resultado',),
+)
+
+
+def hash_contenido(datos_imagen):
+    return hashlib.sha256(datos_imagen).hexdigest()
+
+
+def version_actual():
+    # Los artefactos dependen también del modo de segmentación, y el diagnóstico de si se usan teselas
+    version = f"{model_registry.version(MODEL_CUSTOM)}+{modo_segmentacion()}"
+    return f"{version}+teselas" if inferencia_por_teselas() else version
+
+
+def _ruta_archivo(nombre):
+    return os.path.join(settings.MEDIA_ROOT, 'resultados', os.path.basename(nombre))
+
+
+def _mascara_de(nombre):
+    partes = segmentation.separar_artefacto(os.path.basename(nombre))
+    if partes is None:
+        return None
+    return segmentation.nombres_artefactos(partes[0])['mascara']
+
+
+def _disponible(nombre):
+    """Existe en disco o, si es un artefacto diferido, se puede generar desde su máscara."""
+    if os.path.exists(_ruta_archivo(nombre)):
+        return True
+    mascara = _mascara_de(nombre)
+    return mascara is not None and os.path.exists(_ruta_archivo(mascara))
+
+
+def _archivos_en_historial(archivos):
+    """Artefactos que además referencia algún ImagenAnalisis (no se deben borrar del disco)."""
+    nombres = ['resultados/' + os.path.basename(nombre) for nombre in archivos]
+    referenciados = set()
+    filas = ImagenAnalisis.objects.filter(
+        Q(imagen__in=nombres) | Q(contorno__in=nombres) | Q(overlay__in=nombres) | Q(damage__in=nombres)
+    ).values_list('imagen', 'contorno', 'overlay', 'damage')
+    for fila in filas:
+        referenciados.update(os.path.basename(nombre) for nombre in fila if nombre)
+    # La máscara de un artefacto del historial también se conserva: sin ella no se puede generar
+    referenciados.update(filter(None, [_mascara_de(nombre) for nombre in referenciados]))
+    return referenciados
+
+
+def obtener(hash_imagen):
+    """
+    Devuelve el resultado cacheado para la imagen con la versión actual del modelo
+    (None si no existe o si alguno de sus artefactos ya no está en disco).
+    """
+    version = version_actual()
+    entrada = CacheAnalisis.objects.filter(hash_imagen=hash_imagen, version_modelo=version).first()
+    if entrada is None:
+        consultas_cache.incrementar(resultado='fallo')
+        return None
+
+    if not all(_disponible(nombre) for nombre in entrada.archivos):
+        logger.info(f"Entrada de caché {hash_imagen[:12]} descartada: faltan artefactos en disco")
+        entrada.delete()
+        consultas_cache.incrementar(resultado='invalida')
+        return None
+
+    if 'metricas' not in entrada.resultado:
+        # Entrada anterior a las métricas de lesión: se vuelve a segmentar
+        entrada.delete()
+        consultas_cache.incrementar(resultado='invalida')
+        return None
+
+    CacheAnalisis.objects.filter(pk=entrada.pk).update(
+        ultimo_acceso=timezone.now(),
+        aciertos=F('aciertos') + 1,
+    )
+    consultas_cache.incrementar(resultado='acierto')
+    logger.info(f"Resultado servido desde caché para la imagen {hash_imagen[:12]}")
+    return entrada.resultado
+
+
+def guardar(hash_imagen, resultado, archivos):
+    version = version_actual()
+    tamano = 0
+    for nombre in archivos:
+        try:
+            tamano += os.path.getsize(_ruta_archivo(nombre))
+        except OSError:
+            pass
+
+    try:
+        CacheAnalisis.objects.create(
+            hash_imagen=hash_imagen,
+            version_modelo=version,
+            resultado=resultado,
+            archivos=[os.path.basename(nombre) for nombre in archivos],
+            tamano_bytes=tamano,
+        )
+    except IntegrityError:
+        # Otra petición con la misma imagen terminó antes: se conserva la primera
+        return
+    evictar()
+
+
+def evictar(limite_bytes=None):
+    """
+    Elimina las entradas menos usadas recientemente (y sus artefactos) hasta que
+    el tamaño total de la caché quede por debajo del límite configurado. Los
+    archivos que pertenecen al historial de análisis se conservan en disco.
+    """
+    if limite_bytes is None:
+        limite_bytes = getattr(settings, 'CACHE_ANALISIS_MAX_BYTES', 500 * 1024 * 1024)
+
+    total = CacheAnalisis.objects.aggregate(total=Sum('tamano_bytes'))['total'] or 0
+    if total <= limite_bytes:
+        return 0
+
+    with medir('limpieza'):
+        eliminadas = 0
+        for entrada in CacheAnalisis.objects.order_by('ultimo_acceso').only('pk', 'archivos', 'tamano_bytes').iterator():
+            if total <= limite_bytes:
+                break
+            en_historial = _archivos_en_historial(entrada.archivos)
+            for nombre in entrada.archivos:
+                if os.path.basename(nombre) in en_historial:
+                    continue
+                try:
+                    os.remove(_ruta_archivo(nombre))
+                except OSError:
+                    pass
+            entrada.delete()
+            total -= entrada.tamano_bytes
+            eliminadas += 1
+
+    logger.info(f"Caché de análisis: {eliminadas} entradas eliminadas por LRU")
+    return eliminadas
@@ -0,0 +1,13 @@
+from functools import partial
+
+from app.core.alertas import contar_no_leidas
+
+
+def alertas(request):
+    """
+    Contador de alertas sin leer para el menú del dashboard. Se pasa como callable:
+    solo se consulta (en la caché) si la plantilla lo muestra.
+    """
+    if not getattr(request, 'user', None) or not request.user.is_authenticated:
+        return {}
+    return {'alertas_no_leidas': partial(contar_no_leidas, request.user.pk)}
@@ -0,0 +1,246 @@
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, F, Max, Min, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from app.core.models import EstadisticaPlantacion, Plantacion, RegistroCampo, ResumenRegistroCampo
+
+
+logger = logging.getLogger(__name__)
+
+
+def _fecha(registro):
+    # fecha_registro usa timezone.now como valor por defecto: puede ser un datetime
+    return RegistroCampo._meta.get_field('fecha_registro').to_python(registro.fecha_registro)
+
+
+def _ultimos(plantacion_ref):
+    # Mismo orden que RegistroCampo.Meta.ordering, con el id para desempatar
+    return RegistroCampo.objects.filter(plantacion=plantacion_ref).order_by('-fecha_registro', '-id')
+
+
+def recalcular(plantacion_ids=None):
+    """
+    Reconstruye las estadísticas de las plantaciones indicadas (todas si no se
+    indican) con una sola consulta agregada y un upsert. Devuelve cuántas se actualizaron.
+    """
+    plantaciones = Plantacion.objects.order_by()
+    if plantacion_ids is not None:
+        plantaciones = plantaciones.filter(pk__in=list(plantacion_ids))
+    ultimo = _ultimos(OuterRef('pk'))
+    filas = plantaciones.annotate(
+        total=Count('registros_campo'),
+        suma=Sum('registros_campo__temperatura'),
+        ultimo_id=Subquery(ultimo.values('id')[:1]),
+        ultima=Subquery(ultimo.values('fecha_registro')[:1]),
+    ).values_list('pk', 'total', 'suma', 'ultimo_id', 'ultima')
+
+    estadisticas = [
+        EstadisticaPlantacion(
+            plantacion_id=pk, total_registros=total, suma_temperatura=suma or Decimal('0.0'),
+            ultimo_registro_id=ultimo_id, ultima_fecha=ultima,
+        )
+        for pk, total, suma, ultimo_id, ultima in filas
+    ]
+    EstadisticaPlantacion.objects.bulk_create(
+        estadisticas, batch_size=500, update_conflicts=True, unique_fields=['plantacion'],
+        update_fields=['total_registros', 'suma_temperatura', 'ultimo_registro', 'ultima_fecha', 'fecha_actualizacion'],
+    )
+    return len(estadisticas)
+
+
+def _actualizar_ultimo(plantacion_id):
+    ultimo = _ultimos(plantacion_id).values('id', 'fecha_registro').first()
+    EstadisticaPlantacion.objects.filter(pk=plantacion_id).update(
+        ultimo_registro_id=ultimo['id'] if ultimo else None,
+        ultima_fecha=ultimo['fecha_registro'] if ultimo else None,
+    )
+
+
+def sumar_registro(registro):
+    """Suma un registro nuevo con UPDATE ... SET x = x + n, sin recorrer los demás."""
+    fecha = _fecha(registro)
+    with transaction.atomic(savepoint=False):
+        EstadisticaPlantacion.objects.get_or_create(plantacion_id=registro.plantacion_id)
+        estadistica = EstadisticaPlantacion.objects.filter(pk=registro.plantacion_id)
+        estadistica.update(
+            total_registros=F('total_registros') + 1,
+            suma_temperatura=F('suma_temperatura') + Decimal(str(registro.temperatura)),
+        )
+        # El último registro solo cambia si el nuevo es posterior (misma fecha: el de mayor id)
+        estadistica.filter(
+            Q(ultima_fecha__isnull=True) | Q(ultima_fecha__lt=fecha)
+            | Q(ultima_fecha=fecha, ultimo_registro_id__lt=registro.pk)
+        ).update(ultimo_registro_id=registro.pk, ultima_fecha=fecha)
+
+
+def restar_registro(registro):
+    with transaction.atomic(savepoint=False):
+        estadistica = EstadisticaPlantacion.objects.filter(pk=registro.plantacion_id)
+        # total_registros - 1 sobre un 0 viola el CHECK del PositiveIntegerField: la fila
+        # estaba desincronizada (bulk_create, update()) y se reconstruye desde cero
+        if not estadistica.filter(total_registros__gt=0).update(
+            total_registros=F('total_registros') - 1,
+            suma_temperatura=F('suma_temperatura') - Decimal(str(registro.temperatura)),
+        ):
+            if estadistica.exists():
+                recalcular([registro.plantacion_id])
+            return
+        # Si era el último, SET_NULL ya vació la referencia: se busca el anterior
+        if EstadisticaPlantacion.objects.filter(
+            pk=registro.plantacion_id, ultimo_registro__isnull=True, total_registros__gt=0
+        ).exists():
+            _actualizar_ultimo(registro.plantacion_id)
+
+
+# --------------------- RESÚMENES POR PERIODO ---------------------
+
+VARIABLES = ('temperatura', 'humedad', 'precipitacion', 'ph_suelo', 'humedad_suelo', 'nitrogeno')
+
+Periodo = ResumenRegistroCampo.Periodo
+DIA = 'dia'
+TRUNCADORES = {Periodo.SEMANA: TruncWeek, Periodo.MES: TruncMonth}
+DIAS_PERIODO = {DIA: 1, Periodo.SEMANA: 7, Periodo.MES: 30}
+
+
+def _agregados():
+    return {
+        'cantidad': Count('id'),
+        'temperatura_min': Min('temperatura'),
+        'temperatura_max': Max('temperatura'),
+        'precipitacion_total': Sum('precipitacion'),
+        **{f'promedio_{variable}': Avg(variable) for variable in VARIABLES},
+    }
+
+
+def limites_periodo(periodo, fecha):
+    """[inicio, fin) de la semana (lunes a domingo) o del mes que contiene `fecha`."""
+    if periodo == Periodo.SEMANA:
+        inicio = fecha - timedelta(days=fecha.weekday())
+        return inicio, inicio + timedelta(days=7)
+    inicio = fecha.replace(day=1)
+    return inicio, (inicio + timedelta(days=32)).replace(day=1)
+
+
+def recalcular_resumenes(plantacion_ids=None, fecha=None):
+    """
+    Recalcula los resúmenes semanales y mensuales de las plantaciones indicadas
+    (todas si no se indican). Con `fecha` solo los de la semana y el mes que la
+    contienen: es lo que se hace al guardar o eliminar un registro, unas decenas de
+    filas leídas por el índice (plantacion, fecha_registro).
+    """
+    with transaction.atomic(savepoint=False):
+        for periodo, truncar in TRUNCADORES.items():
+            registros = RegistroCampo.objects.order_by()
+            resumenes = ResumenRegistroCampo.objects.filter(periodo=periodo)
+            if plantacion_ids is not None:
+                registros = registros.filter(plantacion_id__in=list(plantacion_ids))
+                resumenes = resumenes.filter(plantacion_id__in=list(plantacion_ids))
+            if fecha is not None:
+                inicio, fin = limites_periodo(periodo, fecha)
+                registros = registros.filter(fecha_registro__gte=inicio, fecha_registro__lt=fin)
+                resumenes = resumenes.filter(inicio=inicio)
+
+            filas = registros.annotate(inicio=truncar('fecha_registro')).values('plantacion_id', 'inicio').annotate(**_agregados())
+            nuevos = [ResumenRegistroCampo(periodo=periodo, **fila) for fila in filas]
+            # Reemplazar en lugar de actualizar: un periodo que se quedó sin registros desaparece
+            resumenes.delete()
+            ResumenRegistroCampo.objects.bulk_create(nuevos, batch_size=500)
+
+
+def elegir_periodo(desde, hasta):
+    """El periodo más fino con el que la serie no pasa de SERIES_MAX_PUNTOS puntos."""
+    maximo = getattr(settings, 'SERIES_MAX_PUNTOS', 120)
+    dias = (hasta - desde).days + 1
+    for periodo in (DIA, Periodo.SEMANA):
+        if dias / DIAS_PERIODO[periodo] <= maximo:
+            return periodo
+    return Periodo.MES
+
+
+def _redondear(valor):
+    return None if valor is None else round(float(valor), 2)
+
+
+def serie_registros(plantacion_id, desde, hasta, periodo=None, variables=VARIABLES):
+    """
+    Serie de las variables entre `desde` y `hasta` (inclusive) como arrays paralelos
+    para graficar: {'periodo', 'fechas', 'cantidad', 'series': {variable: [...]}}.
+    Por día se agregan los registros crudos; por semana o mes se leen los resúmenes.
+    """
+    periodo = periodo or elegir_periodo(desde, hasta)
+    columnas = [f'promedio_{variable}' for variable in variables]
+    if periodo == DIA:
+        filas = (
+            RegistroCampo.objects.filter(plantacion_id=plantacion_id, fecha_registro__gte=desde, fecha_registro__lte=hasta)
+            .order_by()
+            .values('fecha_registro')
+            .annotate(cantidad=Count('id'), **{columna: Avg(variable) for columna, variable in zip(columnas, variables)})
+            .order_by('fecha_registro')
+            .values_list('fecha_registro', 'cantidad', *columnas)
+        )
+    else:
+        # Desde el inicio del periodo que contiene `desde`
+        filas = (
+            ResumenRegistroCampo.objects.filter(
+                plantacion_id=plantacion_id, periodo=periodo,
+                inicio__gte=limites_periodo(periodo, desde)[0], inicio__lte=hasta,
+            )
+            .order_by('inicio')
+            .values_list('inicio', 'cantidad', *columnas)
+        )
+
+    filas = list(filas)
+    return {
+        'periodo': str(periodo),
+        'fechas': [fila[0].isoformat() for fila in filas],
+        'cantidad': [fila[1] for fila in filas],
+        'series': {
+            variable: [_redondear(fila[2 + indice]) for fila in filas]
+            for indice, variable in enumerate(variables)
+        },
+    }
+
+
+@receiver(pre_save, sender=RegistroCampo)
+def _recordar_anterior(sender, instance, raw=False, **kwargs):
+    # Un registro editado puede haber cambiado de plantación o de fecha: hay que
+    # recalcular también la plantación y los periodos anteriores
+    if not raw and not instance._state.adding and instance.pk:
+        instance._anterior = (
+            RegistroCampo.objects.filter(pk=instance.pk).values_list('plantacion_id', 'fecha_registro').first()
+        )
+
+
+@receiver(post_save, sender=RegistroCampo)
+def registro_guardado(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    actual = (instance.plantacion_id, _fecha(instance))
+    # Estadísticas y resúmenes en una sola transacción
+    with transaction.atomic(savepoint=False):
+        if created:
+            sumar_registro(instance)
+            cambios = {actual}
+        else:
+            # Las ediciones son raras: se recalcula en lugar de llevar los valores anteriores
+            cambios = {actual, getattr(instance, '_anterior', None)} - {None}
+            recalcular({plantacion_id for plantacion_id, _ in cambios})
+        for plantacion_id, fecha in cambios:
+            recalcular_resumenes([plantacion_id], fecha)
+
+
+@receiver(post_delete, sender=RegistroCampo)
+def registro_eliminado(sender, instance, origin=None, **kwargs):
+    # Al eliminar la plantación sus estadísticas y resúmenes se borran en cascada
+    if getattr(origin, 'model', type(origin)) is Plantacion:
+        return
+    with transaction.atomic(savepoint=False):
+        restar_registro(instance)
+        recalcular_resumenes([instance.plantacion_id], _fecha(instance))
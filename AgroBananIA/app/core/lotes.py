@@ -0,0 +1,207 @@
+import os
+import time
+import shutil
+import logging
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.db.models import F
+
+from app.core.models import LoteAnalisis
+from app.core import cache_analisis
+from app.core.shadow import shadow
+from app.core.analisis import (
+    construir_resultado,
+    guardar_analisis_bulk,
+    guardar_original,
+    ruta_resultados,
+)
+from AgroBananIA.utils.diagnostic import (
+    decode_image_bytes,
+    orientacion_exif,
+    orientar,
+    preprocess_image_custom,
+    predict_batch_custom,
+    segment_and_save,
+)
+from AgroBananIA.utils.segmentation import reducir_imagen
+from AgroBananIA.utils.metricas import medir, traza
+
+
+logger = logging.getLogger(__name__)
+
+
+EXTENSIONES_IMAGEN = ('.jpg', '.jpeg', '.png')
+
+
+def ruta_lote(lote_id):
+    return os.path.join(settings.MEDIA_ROOT, 'lotes', str(lote_id))
+
+
+def guardar_archivos_lote(lote, archivos):
+    """
+    Copia los archivos subidos (imágenes sueltas o ZIP) a la carpeta del lote
+    por chunks, sin cargarlos completos en memoria. Los temporales de Django
+    desaparecen al terminar la petición, por eso el worker lee desde aquí.
+    """
+    carpeta = ruta_lote(lote.pk)
+    os.makedirs(carpeta, exist_ok=True)
+    for indice, archivo in enumerate(archivos):
+        nombre = f"{indice:05d}_{os.path.basename(archivo.name)}"
+        with open(os.path.join(carpeta, nombre), 'wb') as destino:
+            for chunk in archivo.chunks():
+                destino.write(chunk)
+    return carpeta
+
+
+def _es_imagen(nombre):
+    return nombre.lower().endswith(EXTENSIONES_IMAGEN)
+
+
+def iterar_entradas(carpeta):
+    """Genera (nombre, bytes) de cada imagen del lote; los ZIP se recorren entrada a entrada."""
+    limite = getattr(settings, 'LOTE_MAX_IMAGEN_BYTES', 25 * 1024 * 1024)
+    for nombre in sorted(os.listdir(carpeta)):
+        ruta = os.path.join(carpeta, nombre)
+        if zipfile.is_zipfile(ruta):
+            with zipfile.ZipFile(ruta) as archivo_zip:
+                for info in archivo_zip.infolist():
+                    if info.is_dir() or not _es_imagen(info.filename):
+                        continue
+                    if info.file_size > limite:
+                        logger.warning(f"Imagen omitida por tamaño en el ZIP: {info.filename}")
+                        yield info.filename, None
+                        continue
+                    yield os.path.basename(info.filename), archivo_zip.read(info)
+        elif _es_imagen(nombre):
+            with open(ruta, 'rb') as origen:
+                yield nombre.split('_', 1)[-1], origen.read()
+
+
+def contar_entradas(carpeta):
+    total = 0
+    for nombre in os.listdir(carpeta):
+        ruta = os.path.join(carpeta, nombre)
+        if zipfile.is_zipfile(ruta):
+            with zipfile.ZipFile(ruta) as archivo_zip:
+                total += sum(
+                    1 for info in archivo_zip.infolist() if not info.is_dir() and _es_imagen(info.filename)
+                )
+        elif _es_imagen(nombre):
+            total += 1
+    return total
+
+
+def _preparar_imagen(nombre, datos, hash_imagen):
+    """
+    Trabajo por imagen que corre en el pool: decodificar, guardar original y preprocesar.
+    Se conserva la imagen ya reducida para segmentar cuando se conozca la clase predicha.
+    """
+    imagen_bgr = decode_image_bytes(datos)
+    nombre_original = guardar_original(datos, nombre, hash_imagen)
+    tensor = preprocess_image_custom(imagen_bgr)
+    # Se clasifica sin girar, como load_img; la segmentación usa la orientación EXIF
+    imagen_bgr = orientar(
+        reducir_imagen(imagen_bgr, getattr(settings, 'SEGMENTACION_MAX_LADO', None)), orientacion_exif(datos),
+    )
+    return nombre_original, tensor, imagen_bgr
+
+
+def _segmentar(imagen_bgr, clase, nombre_original):
+    return segment_and_save(
+        image=imagen_bgr, output_dir=ruta_resultados(), predicted_class=clase, nombre_original=nombre_original
+    )
+
+
+def _procesar_bloque(bloque, plantacion_id, pool):
+    """
+    Procesa un bloque de imágenes: caché, pool de decodificación, una sola
+    inferencia por lotes, segmentación en el pool y bulk_create.
+    """
+    items = []
+    errores = 0
+    pendientes = []
+
+    for nombre, datos in bloque:
+        if datos is None:
+            errores += 1
+            continue
+        hash_imagen = cache_analisis.hash_contenido(datos)
+        resultado_cache = cache_analisis.obtener(hash_imagen)
+        if resultado_cache is not None:
+            items.append((plantacion_id, resultado_cache))
+        else:
+            pendientes.append((nombre, datos, hash_imagen))
+
+    futuros = [(hash_imagen, pool.submit(_preparar_imagen, nombre, datos, hash_imagen))
+               for nombre, datos, hash_imagen in pendientes]
+    preparadas = []
+    for hash_imagen, futuro in futuros:
+        try:
+            preparadas.append((hash_imagen,) + futuro.result())
+        except Exception as e:
+            logger.warning(f"Imagen del lote descartada: {e}")
+            errores += 1
+
+    if preparadas:
+        entradas = np.concatenate([tensor for _, _, tensor, _ in preparadas], axis=0)
+        inicio = time.perf_counter()
+        with medir('inferencia'):
+            predicciones = np.asarray(predict_batch_custom(entradas))
+        shadow.observar(predicciones, (time.perf_counter() - inicio) * 1000, entradas=entradas)
+        clases = [int(np.argmax(pred)) for pred in predicciones]
+        segmentaciones = [pool.submit(_segmentar, imagen_bgr, clase, nombre_original)
+                          for (_, nombre_original, _, imagen_bgr), clase in zip(preparadas, clases)]
+        for (hash_imagen, nombre_original, _, _), pred, clase, futuro in zip(
+                preparadas, predicciones, clases, segmentaciones):
+            try:
+                paths_dict = futuro.result()
+            except Exception as e:
+                logger.warning(f"Segmentación fallida en el lote: {e}")
+                errores += 1
+                continue
+            resultado = construir_resultado(clase, pred, paths_dict, nombre_original)
+            cache_analisis.guardar(hash_imagen, resultado, list(resultado['archivos'].values()))
+            items.append((plantacion_id, resultado))
+
+    guardar_analisis_bulk(items)
+    return len(items), errores
+
+
+def _registrar_avance(lote_id, procesadas, errores):
+    LoteAnalisis.objects.filter(pk=lote_id).update(
+        procesadas=F('procesadas') + procesadas,
+        errores=F('errores') + errores,
+    )
+
+
+def procesar_lote(lote_id):
+    lote = LoteAnalisis.objects.get(pk=lote_id)
+    carpeta = ruta_lote(lote.pk)
+    tamano_bloque = getattr(settings, 'LOTE_TAMANO_BATCH', 32)
+
+    LoteAnalisis.objects.filter(pk=lote.pk).update(
+        estado=LoteAnalisis.Estado.PROCESANDO,
+        total=contar_entradas(carpeta),
+    )
+
+    with ThreadPoolExecutor(
+        max_workers=getattr(settings, 'LOTE_WORKERS_DECODIFICACION', 4),
+        thread_name_prefix='lote-decodificacion',
+    ) as pool:
+        bloque = []
+        for entrada in iterar_entradas(carpeta):
+            bloque.append(entrada)
+            if len(bloque) >= tamano_bloque:
+                with traza('lote_bloque'):
+                    _registrar_avance(lote.pk, *_procesar_bloque(bloque, lote.plantacion_id, pool))
+                bloque = []
+        if bloque:
+            with traza('lote_bloque'):
+                _registrar_avance(lote.pk, *_procesar_bloque(bloque, lote.plantacion_id, pool))
+
+    LoteAnalisis.objects.filter(pk=lote.pk).update(estado=LoteAnalisis.Estado.COMPLETADO)
+    shutil.rmtree(carpeta, ignore_errors=True)
+    logger.info(f"Lote de análisis {lote.pk} completado")
@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import shutil
+import platform
+import resource
+import tempfile
+import threading
+from datetime import datetime
+
+import numpy as np
+import cv2
+from django.core.management.base import BaseCommand, CommandError
+
+from AgroBananIA.utils import diagnostic
+from AgroBananIA.utils.diagnostic import model_registry, MODEL_CUSTOM
+from app.core.management.commands.benchmark_segmentacion import hoja_sintetica
+
+
+def rss_actual_mb():
+    """RSS del proceso en MB (Linux: /proc; en otros sistemas, el máximo de getrusage)."""
+    try:
+        with open('/proc/self/statm') as archivo:
+            return int(archivo.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class MuestreoRSS:
+    """Muestrea el RSS en un hilo mientras dura una etapa para obtener su pico."""
+
+    def __init__(self, intervalo=0.005):
+        self.intervalo = intervalo
+        self.pico = 0.0
+        self._parar = threading.Event()
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            self.pico = max(self.pico, rss_actual_mb())
+            self._parar.wait(self.intervalo)
+
+    def __enter__(self):
+        self.inicial = self.pico = rss_actual_mb()
+        self._hilo = threading.Thread(target=self._bucle, daemon=True)
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._hilo.join()
+        self.pico = max(self.pico, rss_actual_mb())
+
+
+def crear_modelo_sustituto(ruta, clases=6, lado=128):
+    """Red mínima con la misma entrada/salida que el Custom CNN, para medir sin el modelo real."""
+    import keras
+
+    keras.utils.set_random_seed(0)
+    modelo = keras.Sequential([
+        keras.Input((lado, lado, 3)),
+        keras.layers.Conv2D(8, 3, strides=2, activation='relu'),
+        keras.layers.Conv2D(16, 3, strides=2, activation='relu'),
+        keras.layers.GlobalAveragePooling2D(),
+        keras.layers.Dense(clases, activation='softmax'),
+    ])
+    modelo.save(ruta)
+    return ruta
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide latencia (p50/p95), throughput y RSS pico de cada etapa de la detección "
+        "(decodificación, preprocess_image_custom, predict_with_custom, inferencia por lotes y "
+        "segment_and_save) con hojas sintéticas de varios tamaños. Guarda el resultado en JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanos', nargs='+', default=['640x480', '1920x1080', '4000x3000'],
+                            help="Tamaños de imagen ANCHOxALTO")
+        parser.add_argument('--batches', nargs='+', type=int, default=[1, 8, 32],
+                            help="Tamaños de batch para la inferencia por lotes")
+        parser.add_argument('--iteraciones', type=int, default=20)
+        parser.add_argument('--calentamiento', type=int, default=3)
+        parser.add_argument('--modelo-real', action='store_true',
+                            help="Usa el modelo desplegado en lugar del sustituto generado")
+        parser.add_argument('--salida', default=None, help="Archivo JSON de resultados")
+        parser.add_argument('--comparar', default=None, help="JSON de una ejecución anterior para detectar regresiones")
+        parser.add_argument('--tolerancia', type=float, default=10.0, help="Aumento de p50 (%%) considerado regresión")
+
+    def _medir(self, etapa, tamano, funcion, iteraciones, calentamiento, imagenes_por_llamada=1):
+        for _ in range(calentamiento):
+            funcion()
+        tiempos = []
+        with MuestreoRSS() as rss:
+            for _ in range(iteraciones):
+                inicio = time.perf_counter()
+                funcion()
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+        tiempos = np.array(tiempos)
+        resultado = {
+            'etapa': etapa,
+            'tamano': tamano,
+            'imagenes_por_llamada': imagenes_por_llamada,
+            'iteraciones': iteraciones,
+            'p50_ms': round(float(np.percentile(tiempos, 50)), 3),
+            'p95_ms': round(float(np.percentile(tiempos, 95)), 3),
+            'media_ms': round(float(tiempos.mean()), 3),
+            'imagenes_por_segundo': round(imagenes_por_llamada * 1000 / float(tiempos.mean()), 2),
+            'rss_pico_mb': round(rss.pico, 1),
+            'rss_incremento_mb': round(rss.pico - rss.inicial, 1),
+        }
+        self.stdout.write(
+            f"{etapa:<24} {tamano:<11} {resultado['p50_ms']:>9.2f} {resultado['p95_ms']:>9.2f} "
+            f"{resultado['imagenes_por_segundo']:>9.1f} {resultado['rss_pico_mb']:>9.1f} "
+            f"{resultado['rss_incremento_mb']:>8.1f}"
+        )
+        return resultado
+
+    def _comparar(self, resultados, ruta, tolerancia):
+        with open(ruta) as archivo:
+            anteriores = {(r['etapa'], r['tamano']): r for r in json.load(archivo)['resultados']}
+        regresiones = 0
+        for actual in resultados:
+            anterior = anteriores.get((actual['etapa'], actual['tamano']))
+            if not anterior or not anterior['p50_ms']:
+                continue
+            cambio = (actual['p50_ms'] - anterior['p50_ms']) * 100 / anterior['p50_ms']
+            if cambio > tolerancia:
+                regresiones += 1
+                self.stdout.write(self.style.WARNING(
+                    f"Regresión {actual['etapa']} {actual['tamano']}: p50 {anterior['p50_ms']:.2f} -> "
+                    f"{actual['p50_ms']:.2f} ms (+{cambio:.1f}%)"
+                ))
+        if not regresiones:
+            self.stdout.write(self.style.SUCCESS(f"Sin regresiones respecto a {ruta}"))
+        return regresiones
+
+    def handle(self, *args, **options):
+        try:
+            tamanos = [tuple(int(v) for v in tamano.lower().split('x')) for tamano in options['tamanos']]
+        except ValueError:
+            raise CommandError("Los tamaños deben tener la forma ANCHOxALTO, p. ej. 1920x1080")
+
+        temporal = tempfile.mkdtemp(prefix='benchmark_deteccion_')
+        ruta_original = model_registry.ruta(MODEL_CUSTOM)
+        try:
+            if not options['modelo_real']:
+                ruta_sustituto = crear_modelo_sustituto(os.path.join(temporal, 'modelo_sustituto.keras'))
+                model_registry.register(MODEL_CUSTOM, ruta_sustituto, modo=model_registry.estado(MODEL_CUSTOM)['modo'])
+            if not model_registry.warm_up(MODEL_CUSTOM):
+                raise CommandError(f"No se pudo cargar el modelo: {model_registry.estado(MODEL_CUSTOM)['error']}")
+
+            estado = model_registry.estado(MODEL_CUSTOM)
+            self.stdout.write(f"Modelo: {estado['archivo']} (modo {estado['modo']})")
+            self.stdout.write(
+                f"{'etapa':<24} {'tamaño':<11} {'p50 ms':>9} {'p95 ms':>9} {'img/s':>9} "
+                f"{'RSS MB':>9} {'Δ RSS':>8}"
+            )
+
+            iteraciones, calentamiento = options['iteraciones'], options['calentamiento']
+            carpeta_segmentacion = os.path.join(temporal, 'resultados')
+            resultados = []
+            for ancho, alto in tamanos:
+                etiqueta = f"{ancho}x{alto}"
+                imagen = hoja_sintetica(ancho, alto)
+                datos = cv2.imencode('.jpg', imagen)[1].tobytes()
+                resultados.append(self._medir(
+                    'decodificacion', etiqueta, lambda: diagnostic.decode_image_bytes(datos),
+                    iteraciones, calentamiento,
+                ))
+                resultados.append(self._medir(
+                    'preprocesado', etiqueta, lambda: diagnostic.preprocess_image_custom(imagen),
+                    iteraciones, calentamiento,
+                ))
+                resultados.append(self._medir(
+                    'prediccion', etiqueta, lambda: diagnostic.predict_with_custom(imagen),
+                    iteraciones, calentamiento,
+                ))
+                for modo in ('umbral', 'adaptativo'):
+                    resultados.append(self._medir(
+                        f'segmentacion_{modo}', etiqueta,
+                        lambda: diagnostic.segment_and_save(imagen, carpeta_segmentacion, predicted_class=0, modo=modo),
+                        iteraciones, calentamiento,
+                    ))
+                    shutil.rmtree(carpeta_segmentacion, ignore_errors=True)
+
+            # La inferencia por lotes no depende del tamaño de la foto (entrada fija de 128x128)
+            tensor = diagnostic.preprocess_image_custom(hoja_sintetica(640, 480))
+            for batch in options['batches']:
+                entradas = np.repeat(tensor, batch, axis=0)
+                resultados.append(self._medir(
+                    'inferencia_lote', f"batch{batch}", lambda: diagnostic.predict_batch_custom(entradas),
+                    iteraciones, calentamiento, imagenes_por_llamada=batch,
+                ))
+        finally:
+            if not options['modelo_real']:
+                model_registry.register(MODEL_CUSTOM, ruta_original, modo=model_registry.estado(MODEL_CUSTOM)['modo'])
+            shutil.rmtree(temporal, ignore_errors=True)
+
+        informe = {
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'modelo': estado['archivo'],
+            'modo_inferencia': estado['modo'],
+            'entorno': {
+                'python': platform.python_version(),
+                'plataforma': platform.platform(),
+                'cpus': os.cpu_count(),
+                'numpy': np.__version__,
+                'opencv': cv2.__version__,
+            },
+            'resultados': resultados,
+        }
+        if options['salida']:
+            with open(options['salida'], 'w') as archivo:
+                json.dump(informe, archivo, indent=2, ensure_ascii=False)
+            self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {options['salida']}"))
+        if options['comparar']:
+            self._comparar(resultados, options['comparar'], options['tolerancia'])
@@ -0,0 +1,65 @@
+import os
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from AgroBananIA.utils.diagnostic import model_registry, MODEL_CUSTOM
+from AgroBananIA.utils.inference import MODOS_INFERENCIA, build_predictor, ruta_tflite
+
+
+class Command(BaseCommand):
+    help = "Compara la latencia por imagen de las rutas de inferencia (keras, compilado, tflite) en CPU."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iteraciones', type=int, default=50)
+        parser.add_argument('--calentamiento', type=int, default=5)
+        parser.add_argument('--modos', nargs='+', choices=MODOS_INFERENCIA, default=list(MODOS_INFERENCIA))
+        parser.add_argument('--gpu', action='store_true', help="No ocultar la GPU a TensorFlow")
+
+    def handle(self, *args, **options):
+        # Debe fijarse antes de importar TensorFlow (la carga del modelo es diferida)
+        if not options['gpu']:
+            os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+
+        from keras import models
+
+        ruta_modelo = model_registry.ruta(MODEL_CUSTOM)
+        if not os.path.exists(ruta_modelo):
+            raise CommandError(f"No existe el modelo: {ruta_modelo}")
+        modelo = models.load_model(ruta_modelo, compile=False)
+
+        rng = np.random.default_rng(0)
+        imagen = rng.random((1,) + tuple(modelo.input_shape[1:]), dtype=np.float32)
+
+        referencia = None
+        self.stdout.write(f"{'modo':<10} {'media ms':>10} {'p50 ms':>10} {'p95 ms':>10} {'img/s':>10}")
+        for modo in options['modos']:
+            if modo == 'tflite' and not os.path.exists(ruta_tflite(ruta_modelo)):
+                self.stdout.write(self.style.WARNING(
+                    "tflite: no hay artefacto exportado (ejecute `manage.py exportar_modelo_tflite`)"
+                ))
+                continue
+
+            predictor, _ = build_predictor(ruta_modelo, modo, modelo=modelo)
+            for _ in range(options['calentamiento']):
+                salida = predictor(imagen)
+
+            tiempos = []
+            for _ in range(options['iteraciones']):
+                inicio = time.perf_counter()
+                salida = predictor(imagen)
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+
+            # Todas las rutas deben devolver las mismas probabilidades (salvo cuantización)
+            salida = np.asarray(salida)
+            if referencia is None:
+                referencia = salida
+            elif int(np.argmax(salida)) != int(np.argmax(referencia)):
+                self.stdout.write(self.style.WARNING(f"{modo}: la clase predicha difiere de la ruta de referencia"))
+
+            tiempos = np.array(tiempos)
+            self.stdout.write(
+                f"{modo:<10} {tiempos.mean():>10.2f} {np.percentile(tiempos, 50):>10.2f} "
+                f"{np.percentile(tiempos, 95):>10.2f} {1000 / tiempos.mean():>10.1f}"
+            )
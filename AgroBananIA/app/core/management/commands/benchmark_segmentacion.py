@@ -0,0 +1,153 @@
+import os
+import time
+import uuid
+import shutil
+import tempfile
+import tracemalloc
+
+import numpy as np
+import cv2
+from django.core.management.base import BaseCommand
+
+from AgroBananIA.utils import segmentation
+
+
+def segment_and_save_anterior(img, output_dir):
+    """Implementación previa (RGB + conversiones por artefacto), conservada como referencia."""
+    os.makedirs(output_dir, exist_ok=True)
+    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    _, mask = cv2.threshold(gray, 90, 255, cv2.THRESH_BINARY_INV)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    contoured = img_rgb.copy()
+    cv2.drawContours(contoured, contours, -1, (255, 0, 0), 2)
+
+    heatmap = np.zeros_like(img_rgb)
+    heatmap[:, :, 0] = mask
+    overlay = cv2.addWeighted(img_rgb, 0.7, heatmap, 0.6, 0)
+    only_damage = cv2.bitwise_and(img_rgb, img_rgb, mask=mask)
+
+    uid = uuid.uuid4().hex
+    paths = {
+        "contorno": os.path.join(output_dir, f"{uid}_contour.jpg"),
+        "overlay": os.path.join(output_dir, f"{uid}_overlay.jpg"),
+        "damage": os.path.join(output_dir, f"{uid}_damage.jpg"),
+    }
+    cv2.imwrite(paths["contorno"], cv2.cvtColor(contoured, cv2.COLOR_RGB2BGR))
+    cv2.imwrite(paths["overlay"], cv2.cvtColor(overlay, cv2.COLOR_RGB2BGR))
+    cv2.imwrite(paths["damage"], cv2.cvtColor(only_damage, cv2.COLOR_RGB2BGR))
+    return paths
+
+
+def segment_and_save_adaptativo_anterior(img, output_dir, predicted_class=None):
+    """Versión previa del modo adaptativo (rangos HSV por clase y filtrado con un bucle sobre contornos)."""
+    os.makedirs(output_dir, exist_ok=True)
+    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    img_hsv = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2HSV)
+    lower, upper = segmentation.RANGOS_HSV_POR_CLASE.get(predicted_class, segmentation.RANGO_HSV_POR_DEFECTO)
+    mask = cv2.inRange(img_hsv, np.array(lower), np.array(upper))
+
+    tamano = 7 if predicted_class in [0, 5] else 5
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (tamano, tamano))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=1)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    mask_filtered = np.zeros_like(mask)
+    for contour in contours:
+        if cv2.contourArea(contour) > 100:
+            cv2.drawContours(mask_filtered, [contour], -1, 255, -1)
+
+    contoured = img_rgb.copy()
+    cv2.drawContours(contoured, contours, -1, (255, 0, 0), 2)
+    heatmap = np.zeros_like(img_rgb)
+    heatmap[:, :, 0] = mask_filtered
+    overlay = cv2.addWeighted(img_rgb, 0.7, heatmap, 0.5, 0)
+    only_damage = cv2.bitwise_and(img_rgb, img_rgb, mask=mask_filtered)
+
+    uid = uuid.uuid4().hex
+    paths = {
+        "contorno": os.path.join(output_dir, f"{uid}_contour.jpg"),
+        "overlay": os.path.join(output_dir, f"{uid}_overlay.jpg"),
+        "damage": os.path.join(output_dir, f"{uid}_damage.jpg"),
+    }
+    cv2.imwrite(paths["contorno"], cv2.cvtColor(contoured, cv2.COLOR_RGB2BGR))
+    cv2.imwrite(paths["overlay"], cv2.cvtColor(overlay, cv2.COLOR_RGB2BGR))
+    cv2.imwrite(paths["damage"], cv2.cvtColor(only_damage, cv2.COLOR_RGB2BGR))
+    return paths
+
+
+def hoja_sintetica(ancho, alto, semilla=0):
+    """Hoja verde con manchas oscuras, suficiente para ejercitar la segmentación."""
+    rng = np.random.default_rng(semilla)
+    img = np.empty((alto, ancho, 3), dtype=np.uint8)
+    img[:] = (40, 150, 60)
+    ruido = rng.integers(0, 40, size=(alto, ancho, 1), dtype=np.uint8)
+    cv2.add(img, np.repeat(ruido, 3, axis=2), dst=img)
+    for _ in range(200):
+        centro = (int(rng.integers(0, ancho)), int(rng.integers(0, alto)))
+        radio = int(rng.integers(5, max(6, ancho // 60)))
+        cv2.circle(img, centro, radio, (20, 30, 35), -1)
+    return img
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara latencia y memoria pico de los modos de segmentación ('umbral' y 'adaptativo') "
+        "frente a sus versiones anteriores (por defecto 12MP)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ancho', type=int, default=4000)
+        parser.add_argument('--alto', type=int, default=3000)
+        parser.add_argument('--iteraciones', type=int, default=10)
+        parser.add_argument('--max-lado', type=int, default=2048, help="Lado máximo para las variantes con reducción")
+        parser.add_argument('--clase', type=int, default=0, help="Clase predicha para el modo adaptativo")
+
+    def _medir(self, funcion, img, carpeta, iteraciones):
+        funcion(img, carpeta)  # calentamiento (incluye la reserva de buffers)
+        tiempos = []
+        for _ in range(iteraciones):
+            inicio = time.perf_counter()
+            funcion(img, carpeta)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+
+        # Memoria pico de una llamada en régimen (los buffers ya están reservados)
+        tracemalloc.start()
+        funcion(img, carpeta)
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return np.array(tiempos), pico
+
+    def handle(self, *args, **options):
+        img = hoja_sintetica(options['ancho'], options['alto'])
+        carpeta = tempfile.mkdtemp(prefix='benchmark_segmentacion_')
+        max_lado = options['max_lado']
+        clase = options['clase']
+        adaptativo = segmentation.MODO_ADAPTATIVO
+        variantes = [
+            ('umbral anterior', segment_and_save_anterior),
+            ('umbral', lambda im, out: segmentation.segment_and_save(im, out)),
+            (f'umbral ({max_lado}px)', lambda im, out: segmentation.segment_and_save(im, out, max_lado=max_lado)),
+            (f'diferida ({max_lado}px)', lambda im, out: segmentation.guardar_mascara(
+                im, out, uuid.uuid4().hex, max_lado=max_lado)),
+            ('adaptativo anterior', lambda im, out: segment_and_save_adaptativo_anterior(im, out, clase)),
+            ('adaptativo', lambda im, out: segmentation.segment_and_save(im, out, modo=adaptativo, clase=clase)),
+            (f'adaptativo ({max_lado}px)', lambda im, out: segmentation.segment_and_save(
+                im, out, max_lado=max_lado, modo=adaptativo, clase=clase)),
+        ]
+
+        megapixeles = options['ancho'] * options['alto'] / 1e6
+        self.stdout.write(f"Imagen sintética de {options['ancho']}x{options['alto']} ({megapixeles:.1f} MP)")
+        self.stdout.write(f"{'variante':<26} {'media ms':>10} {'p95 ms':>10} {'pico MB':>10}")
+        try:
+            for nombre, funcion in variantes:
+                tiempos, pico = self._medir(funcion, img, carpeta, options['iteraciones'])
+                self.stdout.write(
+                    f"{nombre:<26} {tiempos.mean():>10.1f} {np.percentile(tiempos, 95):>10.1f} "
+                    f"{pico / (1024 * 1024):>10.1f}"
+                )
+            self.stdout.write("pico MB: memoria reservada por una llamada en régimen (tracemalloc)")
+        finally:
+            shutil.rmtree(carpeta, ignore_errors=True)
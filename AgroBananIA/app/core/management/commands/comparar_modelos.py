@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from app.core.models import ComparacionModelo
+from app.core.shadow import shadow
+from AgroBananIA.utils.diagnostic import MODEL_CUSTOM, model_registry, versiones_disponibles
+
+
+class Command(BaseCommand):
+    help = (
+        "Muestra las versiones del modelo disponibles y las estadísticas de la inferencia en sombra "
+        "(acuerdo y latencia del candidato frente al modelo en producción)."
+    )
+
+    def handle(self, *args, **options):
+        shadow.volcar()
+        activa = model_registry.version(MODEL_CUSTOM)
+        self.stdout.write("Versiones en static/models:")
+        for archivo in versiones_disponibles():
+            marca = " (producción)" if activa.startswith(f"{archivo}@") else ""
+            self.stdout.write(f"  {archivo}{marca}")
+
+        comparaciones = ComparacionModelo.objects.all()
+        if not comparaciones:
+            self.stdout.write("Sin estadísticas de inferencia en sombra (configure AGROBANANIA_MODELO_SHADOW).")
+            return
+
+        self.stdout.write(
+            f"\n{'candidato':<45} {'principal':<45} {'muestras':>9} {'acuerdo %':>10} "
+            f"{'ms principal':>13} {'ms candidato':>13} {'ms máx':>8} {'Δ conf.':>8} {'descart.':>9}"
+        )
+        for c in comparaciones:
+            self.stdout.write(
+                f"{c.version_candidata:<45} {c.version_principal:<45} {c.muestras:>9} "
+                f"{c.tasa_acuerdo or 0:>10.2f} {c.latencia_principal_media_ms or 0:>13.2f} "
+                f"{c.latencia_candidata_media_ms or 0:>13.2f} {c.latencia_candidata_max_ms:>8.2f} "
+                f"{(c.diferencia_confianza / c.muestras if c.muestras else 0):>8.3f} {c.descartadas:>9}"
+            )
@@ -0,0 +1,36 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from AgroBananIA.utils.diagnostic import model_registry, MODEL_CUSTOM
+from AgroBananIA.utils.inference import ruta_tflite
+
+
+class Command(BaseCommand):
+    help = "Exporta el modelo Custom CNN a TFLite (static/models/<modelo>.tflite) para INFERENCIA_MODO='tflite'."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--salida', help="Ruta del .tflite (por defecto junto al .keras)")
+        parser.add_argument(
+            '--optimizar', action='store_true',
+            help="Aplica la cuantización dinámica por defecto de TFLite (pesos en int8)",
+        )
+
+    def handle(self, *args, **options):
+        import tensorflow as tf
+        from keras import models
+
+        ruta_modelo = model_registry.ruta(MODEL_CUSTOM)
+        if not os.path.exists(ruta_modelo):
+            raise CommandError(f"No existe el modelo: {ruta_modelo}")
+
+        modelo = models.load_model(ruta_modelo, compile=False)
+        convertidor = tf.lite.TFLiteConverter.from_keras_model(modelo)
+        if options['optimizar']:
+            convertidor.optimizations = [tf.lite.Optimize.DEFAULT]
+        contenido = convertidor.convert()
+
+        salida = options['salida'] or ruta_tflite(ruta_modelo)
+        with open(salida, 'wb') as destino:
+            destino.write(contenido)
+        self.stdout.write(self.style.SUCCESS(f"Modelo exportado: {salida} ({len(contenido) / 1024:.1f} KB)"))
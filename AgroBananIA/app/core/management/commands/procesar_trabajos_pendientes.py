@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from app.core.tasks import reanudar_pendientes, get_executor
+
+
+class Command(BaseCommand):
+    help = "Procesa los trabajos de análisis que quedaron pendientes (p. ej. tras reiniciar el servidor)."
+
+    def handle(self, *args, **options):
+        total = reanudar_pendientes()
+        get_executor().shutdown(wait=True)
+        self.stdout.write(self.style.SUCCESS(f"Trabajos procesados: {total}"))
@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from app.core.models import ImagenAnalisis, ResultadoAnalisis
+from app.core.analisis import actualizar_prediccion, CAMPOS_PREDICCION
+from AgroBananIA.utils.diagnostic import (
+    MODEL_CUSTOM,
+    model_registry,
+    predict_batch_custom,
+    preprocess_image_custom,
+)
+
+
+def leer_checkpoint(ruta, version):
+    """
+    (último ImagenAnalisis recorrido, ids que fallaron) con esta versión del modelo,
+    o (0, []) si no hay checkpoint válido.
+    """
+    try:
+        with open(ruta) as archivo:
+            datos = json.load(archivo)
+    except (OSError, ValueError):
+        return 0, []
+    if datos.get('version') != version:
+        return 0, []
+    return datos.get('ultimo_id', 0), datos.get('fallidas', [])
+
+
+def escribir_checkpoint(ruta, version, ultimo_id, procesadas, fallidas=()):
+    temporal = f"{ruta}.tmp"
+    with open(temporal, 'w') as archivo:
+        json.dump({
+            'version': version, 'ultimo_id': ultimo_id, 'procesadas': procesadas, 'fallidas': sorted(fallidas),
+        }, archivo)
+    os.replace(temporal, ruta)
+
+
+def agrupar(iterable, tamano):
+    bloque = []
+    for elemento in iterable:
+        bloque.append(elemento)
+        if len(bloque) >= tamano:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+
+class Command(BaseCommand):
+    help = (
+        "Vuelve a clasificar las imágenes del historial cuyo resultado se generó con otra versión "
+        "del modelo. Reanudable: guarda un checkpoint tras cada bloque; las imágenes que fallan "
+        "quedan anotadas en él y se reintentan en la siguiente ejecución."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=64, help="Imágenes por inferencia")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Procesos de decodificación")
+        parser.add_argument(
+            '--checkpoint',
+            default=os.path.join(settings.MEDIA_ROOT, 'reanalisis_checkpoint.json'),
+            help="Archivo donde se guarda el avance",
+        )
+        parser.add_argument('--reiniciar', action='store_true', help="Ignora el checkpoint y empieza desde el principio")
+        parser.add_argument('--todos', action='store_true', help="Incluye los resultados que ya tienen la versión actual")
+        parser.add_argument('--limite', type=int, default=None, help="Procesa como máximo N imágenes")
+
+    def _preparar(self, pool, bloque):
+        rutas = [os.path.join(settings.MEDIA_ROOT, imagen.imagen.name) for imagen in bloque]
+        return bloque, [pool.submit(preprocess_image_custom, ruta) for ruta in rutas]
+
+    def handle(self, *args, **options):
+        version = model_registry.version(MODEL_CUSTOM)
+        checkpoint = options['checkpoint']
+        desde, fallidas = (0, []) if options['reiniciar'] else leer_checkpoint(checkpoint, version)
+        fallidas = set(fallidas)
+
+        # Las que fallaron quedan por debajo del checkpoint: se vuelven a pedir por id
+        imagenes = (
+            ImagenAnalisis.objects.filter(resultado__isnull=False)
+            .filter(Q(pk__gt=desde) | Q(pk__in=fallidas))
+            .select_related('resultado')
+            .only('id', 'imagen', *[f'resultado__{campo}' for campo in ['id', 'imagen_id'] + CAMPOS_PREDICCION])
+            .order_by('pk')
+        )
+        if not options['todos']:
+            imagenes = imagenes.exclude(resultado__version_modelo=version)
+        if fallidas:
+            # Las eliminadas o ya actualizadas por otra vía dejan de reintentarse
+            fallidas = set(imagenes.filter(pk__in=fallidas).values_list('pk', flat=True))
+        total = imagenes.count()
+        if options['limite']:
+            total = min(total, options['limite'])
+            imagenes = imagenes[:options['limite']]
+
+        self.stdout.write(
+            f"Modelo {version}: {total} imágenes por reanalizar (desde id {desde}, {len(fallidas)} por reintentar)"
+        )
+        if not total:
+            return
+
+        # Los procesos se crean con 'spawn': un fork después de cargar TensorFlow puede bloquearse
+        model_registry.warm_up(MODEL_CUSTOM)
+        procesadas = errores = 0
+        ultimo_id = desde
+        inicio = time.perf_counter()
+        with ProcessPoolExecutor(
+            max_workers=max(1, options['workers']),
+            mp_context=multiprocessing.get_context('spawn'),
+        ) as pool:
+            bloques = agrupar(imagenes.iterator(chunk_size=options['batch_size'] * 4), options['batch_size'])
+            siguiente = next(bloques, None)
+            pendiente = self._preparar(pool, siguiente) if siguiente else None
+
+            while pendiente is not None:
+                bloque, futuros = pendiente
+                # Mientras este bloque pasa por el modelo, el pool ya decodifica el siguiente
+                siguiente = next(bloques, None)
+                pendiente = self._preparar(pool, siguiente) if siguiente else None
+
+                validas, tensores = [], []
+                for imagen, futuro in zip(bloque, futuros):
+                    try:
+                        tensores.append(futuro.result())
+                        validas.append(imagen)
+                    except Exception as e:
+                        errores += 1
+                        fallidas.add(imagen.pk)
+                        self.stderr.write(f"Imagen {imagen.pk} omitida: {e}")
+
+                if validas:
+                    predicciones = np.asarray(predict_batch_custom(np.concatenate(tensores, axis=0)))
+                    resultados = [
+                        actualizar_prediccion(imagen.resultado, int(np.argmax(pred)), pred, version)
+                        for imagen, pred in zip(validas, predicciones)
+                    ]
+                    ResultadoAnalisis.objects.bulk_update(resultados, CAMPOS_PREDICCION, batch_size=500)
+                    fallidas.difference_update(imagen.pk for imagen in validas)
+
+                # El checkpoint avanza sobre todo el bloque, pero solo las correctas salen de `fallidas`
+                procesadas += len(bloque)
+                ultimo_id = max(ultimo_id, bloque[-1].pk)
+                escribir_checkpoint(checkpoint, version, ultimo_id, procesadas, fallidas)
+
+                transcurrido = time.perf_counter() - inicio
+                ritmo = procesadas / transcurrido if transcurrido else 0
+                restante = (total - procesadas) / ritmo if ritmo else 0
+                self.stdout.write(
+                    f"{procesadas}/{total} imágenes ({errores} con errores) - "
+                    f"{ritmo:.1f} img/s - faltan ~{restante:.0f} s"
+                )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Reanálisis completado: {procesadas - errores} actualizadas, {errores} con errores "
+            f"en {time.perf_counter() - inicio:.1f} s"
+        ))
+        if fallidas:
+            self.stdout.write(self.style.WARNING(
+                f"{len(fallidas)} imágenes sin reanalizar (se reintentan en la próxima ejecución): "
+                f"{', '.join(str(pk) for pk in sorted(fallidas))}"
+            ))
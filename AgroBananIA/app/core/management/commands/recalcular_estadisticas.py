@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from app.core.estadisticas import recalcular, recalcular_resumenes
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstruye EstadisticaPlantacion y los resúmenes semanales y mensuales a partir "
+        "de los registros de campo "
+        "(necesario tras cargas con bulk_create o update(), que no emiten señales)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('plantaciones', nargs='*', type=int, help="IDs de plantación (todas si se omite)")
+
+    def handle(self, *args, **options):
+        plantaciones = options['plantaciones'] or None
+        total = recalcular(plantaciones)
+        recalcular_resumenes(plantaciones)
+        self.stdout.write(self.style.SUCCESS(f"Plantaciones recalculadas: {total}"))
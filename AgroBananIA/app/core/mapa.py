@@ -0,0 +1,142 @@
+import time
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, FloatField, Max, Min
+from django.db.models.functions import Cast, Floor
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from app.core.models import Plantacion
+from AgroBananIA.utils.geo import limites_tesela, teselas_bbox
+from AgroBananIA.utils.metricas import medir
+
+
+logger = logging.getLogger(__name__)
+
+
+# Cada tesela se divide en CELDAS_POR_LADO x CELDAS_POR_LADO celdas (64 px con teselas
+# de 256 px). Los grupos no cruzan el borde de la tesela, así cada una se calcula y se
+# guarda en la caché por separado.
+CELDAS_POR_LADO = 4
+
+_CLAVE_VERSION = 'mapa_plantaciones:version'
+
+
+def _version():
+    version = cache.get(_CLAVE_VERSION)
+    if version is None:
+        cache.add(_CLAVE_VERSION, time.time_ns(), None)
+        version = cache.get(_CLAVE_VERSION)
+    return version
+
+
+@receiver(post_save, sender=Plantacion)
+@receiver(post_delete, sender=Plantacion)
+def invalidar_teselas(**kwargs):
+    """
+    Una plantación nueva, movida o eliminada invalida todas las teselas: cambia la
+    versión que forma parte de la clave. Con varios procesos MAPA_CACHE_TTL acota
+    cuánto tarda el cambio en verse en los demás.
+    """
+    cache.set(_CLAVE_VERSION, time.time_ns(), None)
+
+
+def _en_tesela(sur, oeste, norte, este):
+    # Rango sobre el índice (latitud, longitud); el borde norte/este es de la tesela vecina
+    return Plantacion.objects.filter(
+        latitud__gte=sur, latitud__lt=norte, longitud__gte=oeste, longitud__lt=este,
+    ).order_by()
+
+
+def _grupos(sur, oeste, norte, este):
+    """Conteo, centroide y extensión por celda, agregados en la base de datos."""
+    alto = (norte - sur) / CELDAS_POR_LADO
+    ancho = (este - oeste) / CELDAS_POR_LADO
+    latitud, longitud = Cast('latitud', FloatField()), Cast('longitud', FloatField())
+    celdas = (
+        _en_tesela(sur, oeste, norte, este)
+        .values(fila=Floor((latitud - sur) / alto), columna=Floor((longitud - oeste) / ancho))
+        .annotate(
+            cantidad=Count('id'),
+            latitud_media=Avg(latitud), longitud_media=Avg(longitud),
+            latitud_min=Min(latitud), latitud_max=Max(latitud),
+            longitud_min=Min(longitud), longitud_max=Max(longitud),
+        )
+    )
+    return [
+        {
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Point',
+                'coordinates': [round(celda['longitud_media'], 6), round(celda['latitud_media'], 6)],
+            },
+            'bbox': [celda['longitud_min'], celda['latitud_min'], celda['longitud_max'], celda['latitud_max']],
+            'properties': {'grupo': True, 'cantidad': celda['cantidad']},
+        }
+        for celda in celdas
+    ]
+
+
+def _puntos(plantaciones):
+    return [
+        {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [float(longitud), float(latitud)]},
+            'properties': {
+                'id': pk,
+                'nombre': nombre,
+                'ubicacion': ubicacion,
+                'extension_hectareas': float(extension),
+                'fecha_registro': fecha.strftime('%d/%m/%Y') if fecha else None,
+            },
+        }
+        for pk, nombre, ubicacion, extension, fecha, latitud, longitud in plantaciones
+    ]
+
+
+def calcular_tesela(zoom, x, y):
+    """
+    Features GeoJSON de la tesela z/x/y. Desde MAPA_ZOOM_DETALLE se devuelven las
+    plantaciones una a una (si no pasan de MAPA_MAX_PUNTOS_TESELA); por debajo, o si
+    hay más, grupos con su cantidad. No incluye datos del propietario: la misma
+    tesela se sirve a todos los usuarios.
+    """
+    limites = limites_tesela(zoom, x, y)
+    with medir('mapa_tesela'):
+        if zoom >= getattr(settings, 'MAPA_ZOOM_DETALLE', 12):
+            maximo = getattr(settings, 'MAPA_MAX_PUNTOS_TESELA', 200)
+            plantaciones = list(
+                _en_tesela(*limites).order_by('id').values_list(
+                    'id', 'nombre_finca', 'ubicacion', 'extension_hectareas', 'fecha_registro', 'latitud', 'longitud',
+                )[:maximo + 1]
+            )
+            if len(plantaciones) <= maximo:
+                return _puntos(plantaciones)
+        return _grupos(*limites)
+
+
+def plantaciones_bbox(sur, oeste, norte, este, zoom):
+    """
+    FeatureCollection con las plantaciones del recuadro al zoom dado. El recuadro se
+    cubre con teselas XYZ y cada una se lee de la caché (MAPA_CACHE_TTL) o se calcula,
+    así mover el mapa solo consulta la base de datos por las teselas nuevas.
+    Devuelve None si el recuadro necesita más de MAPA_MAX_TESELAS.
+    """
+    teselas = teselas_bbox(sur, oeste, norte, este, zoom)
+    if len(teselas) > getattr(settings, 'MAPA_MAX_TESELAS', 64):
+        return None
+
+    version = _version()
+    claves = {f"mapa_plantaciones:{version}:{zoom}:{x}:{y}": (x, y) for x, y in teselas}
+    guardadas = cache.get_many(list(claves))
+    nuevas = {clave: calcular_tesela(zoom, *claves[clave]) for clave in claves if clave not in guardadas}
+    if nuevas:
+        cache.set_many(nuevas, getattr(settings, 'MAPA_CACHE_TTL', 300))
+    logger.debug(f"Mapa z={zoom}: {len(teselas)} teselas, {len(nuevas)} calculadas")
+
+    features = []
+    for clave in claves:
+        features.extend(guardadas.get(clave) if clave in guardadas else nuevas[clave])
+    return {'type': 'FeatureCollection', 'features': features}
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.2 on 2026-10-18 12:52
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_trabajoanalisis'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheAnalisis',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash_imagen', models.CharField(max_length=64)),
+                ('version_modelo', models.CharField(max_length=150)),
+                ('resultado', models.JSONField()),
+                ('archivos', models.JSONField(default=list, help_text='Artefactos de segmentación en media/resultados')),
+                ('tamano_bytes', models.PositiveBigIntegerField(default=0)),
+                ('aciertos', models.PositiveIntegerField(default=0)),
+                ('ultimo_acceso', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Caché de Análisis',
+                'verbose_name_plural': 'Caché de Análisis',
+                'constraints': [models.UniqueConstraint(fields=('hash_imagen', 'version_modelo'), name='cache_analisis_hash_version_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.2 on 2026-10-18 12:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_cacheanalisis'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trabajoanalisis',
+            name='plantacion',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='trabajos_analisis', to='core.plantacion'),
+        ),
+    ]
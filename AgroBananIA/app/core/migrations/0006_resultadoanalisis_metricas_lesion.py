@@ -0,0 +1,28 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_loteanalisis'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resultadoanalisis',
+            name='area_lesion_pct',
+            field=models.FloatField(blank=True, db_index=True, help_text='Área con lesión en % de la imagen', null=True),
+        ),
+        migrations.AddField(
+            model_name='resultadoanalisis',
+            name='histograma_lesiones',
+            field=models.JSONField(blank=True, default=list, help_text='Lesiones por tamaño (% de la imagen): <0.01, 0.01-0.05, 0.05-0.25, 0.25-1, 1-5, >5'),
+        ),
+        migrations.AddField(
+            model_name='resultadoanalisis',
+            name='num_lesiones',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_resultadoanalisis_metricas_lesion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resultadoanalisis',
+            name='version_modelo',
+            field=models.CharField(blank=True, db_index=True, max_length=150),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_resultadoanalisis_version_modelo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ComparacionModelo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version_principal', models.CharField(max_length=150)),
+                ('version_candidata', models.CharField(max_length=150)),
+                ('muestras', models.PositiveIntegerField(default=0)),
+                ('coincidencias', models.PositiveIntegerField(default=0, help_text='Muestras con la misma clase predicha')),
+                ('latencia_principal_ms', models.FloatField(default=0, help_text='Suma de latencias por imagen')),
+                ('latencia_candidata_ms', models.FloatField(default=0, help_text='Suma de latencias por imagen')),
+                ('latencia_candidata_max_ms', models.FloatField(default=0)),
+                ('diferencia_confianza', models.FloatField(default=0, help_text='Suma de |p_principal - p_candidata| de la clase principal')),
+                ('descartadas', models.PositiveIntegerField(default=0, help_text='Muestras no evaluadas por cola llena')),
+                ('fecha_inicio', models.DateTimeField(auto_now_add=True)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Comparación de Modelos',
+                'verbose_name_plural': 'Comparaciones de Modelos',
+                'ordering': ['-fecha_actualizacion'],
+                'constraints': [models.UniqueConstraint(fields=('version_principal', 'version_candidata'), name='comparacion_modelo_versiones_unico')],
+            },
+        ),
+    ]
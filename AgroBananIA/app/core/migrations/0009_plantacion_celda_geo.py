@@ -0,0 +1,42 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:17
+
+import math
+
+from django.db import migrations, models
+
+
+# Copia de AgroBananIA.utils.geo.celda tal como estaba al crear esta migración: la
+# migración no debe cambiar si la rejilla del código cambia más adelante
+CELDA_GRADOS = 0.1
+FILAS = round(180 / CELDA_GRADOS)
+COLUMNAS = round(360 / CELDA_GRADOS)
+
+
+def celda(latitud, longitud):
+    fila = min(max(math.floor((float(latitud) + 90) / CELDA_GRADOS), 0), FILAS - 1)
+    columna = math.floor((float(longitud) + 180) / CELDA_GRADOS) % COLUMNAS
+    return fila * COLUMNAS + columna
+
+
+def calcular_celdas(apps, schema_editor):
+    Plantacion = apps.get_model('core', 'Plantacion')
+    plantaciones = list(Plantacion.objects.only('id', 'latitud', 'longitud'))
+    for plantacion in plantaciones:
+        plantacion.celda_geo = celda(plantacion.latitud, plantacion.longitud)
+    Plantacion.objects.bulk_update(plantaciones, ['celda_geo'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_comparacionmodelo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plantacion',
+            name='celda_geo',
+            field=models.BigIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(calcular_celdas, migrations.RunPython.noop),
+    ]
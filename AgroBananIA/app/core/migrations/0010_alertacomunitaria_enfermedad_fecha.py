@@ -0,0 +1,19 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_plantacion_celda_geo'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alertacomunitaria',
+            index=models.Index(fields=['enfermedad', 'fecha_alerta'], name='alerta_enfermedad_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_alertacomunitaria_enfermedad_fecha'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='alertacomunitaria',
+            options={'ordering': ['-fecha_alerta', '-id'], 'verbose_name': 'Alerta Comunitaria', 'verbose_name_plural': 'Alertas Comunitarias'},
+        ),
+        migrations.AddField(
+            model_name='alertacomunitaria',
+            name='leida',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='alertacomunitaria',
+            index=models.Index(fields=['usuario_destino', '-fecha_alerta', '-id'], name='alerta_bandeja_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alertacomunitaria',
+            index=models.Index(fields=['usuario_destino', 'leida'], name='alerta_no_leidas_idx'),
+        ),
+    ]
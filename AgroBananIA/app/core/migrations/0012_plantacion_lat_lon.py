@@ -0,0 +1,19 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_alertacomunitaria_bandeja'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='plantacion',
+            index=models.Index(fields=['latitud', 'longitud'], name='plantacion_lat_lon_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_plantacion_lat_lon'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='imagenanalisis',
+            index=models.Index(fields=['plantacion', '-fecha_envio', '-id'], name='imagen_plantacion_fecha_idx'),
+        ),
+    ]
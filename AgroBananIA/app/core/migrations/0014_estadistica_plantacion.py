@@ -0,0 +1,51 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:30
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def calcular_estadisticas(apps, schema_editor):
+    Plantacion = apps.get_model('core', 'Plantacion')
+    RegistroCampo = apps.get_model('core', 'RegistroCampo')
+    EstadisticaPlantacion = apps.get_model('core', 'EstadisticaPlantacion')
+    ultimo = RegistroCampo.objects.filter(plantacion=models.OuterRef('pk')).order_by('-fecha_registro', '-id')
+    filas = Plantacion.objects.order_by().annotate(
+        total=models.Count('registros_campo'),
+        suma=models.Sum('registros_campo__temperatura'),
+        ultimo_id=models.Subquery(ultimo.values('id')[:1]),
+        ultima=models.Subquery(ultimo.values('fecha_registro')[:1]),
+    ).values_list('pk', 'total', 'suma', 'ultimo_id', 'ultima')
+    EstadisticaPlantacion.objects.bulk_create([
+        EstadisticaPlantacion(
+            plantacion_id=pk, total_registros=total, suma_temperatura=suma or Decimal('0.0'),
+            ultimo_registro_id=ultimo_id, ultima_fecha=ultima,
+        )
+        for pk, total, suma, ultimo_id, ultima in filas
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_imagen_plantacion_fecha'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadisticaPlantacion',
+            fields=[
+                ('plantacion', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='estadistica', serialize=False, to='core.plantacion')),
+                ('total_registros', models.PositiveIntegerField(default=0)),
+                ('suma_temperatura', models.DecimalField(decimal_places=1, default=Decimal('0.0'), max_digits=12)),
+                ('ultima_fecha', models.DateField(blank=True, null=True)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+                ('ultimo_registro', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.registrocampo')),
+            ],
+            options={
+                'verbose_name': 'Estadística de Plantación',
+                'verbose_name_plural': 'Estadísticas de Plantación',
+            },
+        ),
+        migrations.RunPython(calcular_estadisticas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models.functions import TruncMonth, TruncWeek
+
+
+VARIABLES = ('temperatura', 'humedad', 'precipitacion', 'ph_suelo', 'humedad_suelo', 'nitrogeno')
+
+
+def calcular_resumenes(apps, schema_editor):
+    RegistroCampo = apps.get_model('core', 'RegistroCampo')
+    ResumenRegistroCampo = apps.get_model('core', 'ResumenRegistroCampo')
+    for periodo, truncar in (('semana', TruncWeek), ('mes', TruncMonth)):
+        filas = (
+            RegistroCampo.objects.order_by()
+            .annotate(inicio=truncar('fecha_registro'))
+            .values('plantacion_id', 'inicio')
+            .annotate(
+                cantidad=models.Count('id'),
+                temperatura_min=models.Min('temperatura'),
+                temperatura_max=models.Max('temperatura'),
+                precipitacion_total=models.Sum('precipitacion'),
+                **{f'promedio_{variable}': models.Avg(variable) for variable in VARIABLES},
+            )
+        )
+        ResumenRegistroCampo.objects.bulk_create(
+            [ResumenRegistroCampo(periodo=periodo, **fila) for fila in filas], batch_size=500
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_estadistica_plantacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenRegistroCampo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('periodo', models.CharField(choices=[('semana', 'Semana'), ('mes', 'Mes')], max_length=10)),
+                ('inicio', models.DateField()),
+                ('cantidad', models.PositiveIntegerField(default=0)),
+                ('promedio_temperatura', models.FloatField(blank=True, null=True)),
+                ('temperatura_min', models.FloatField(blank=True, null=True)),
+                ('temperatura_max', models.FloatField(blank=True, null=True)),
+                ('promedio_humedad', models.FloatField(blank=True, null=True)),
+                ('promedio_precipitacion', models.FloatField(blank=True, null=True)),
+                ('precipitacion_total', models.FloatField(blank=True, null=True)),
+                ('promedio_ph_suelo', models.FloatField(blank=True, null=True)),
+                ('promedio_humedad_suelo', models.FloatField(blank=True, null=True)),
+                ('promedio_nitrogeno', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Resumen de Registros de Campo',
+                'verbose_name_plural': 'Resúmenes de Registros de Campo',
+                'ordering': ['plantacion', 'periodo', 'inicio'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='registrocampo',
+            index=models.Index(fields=['plantacion', 'fecha_registro'], name='registro_plantacion_fecha_idx'),
+        ),
+        migrations.AddField(
+            model_name='resumenregistrocampo',
+            name='plantacion',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes_campo', to='core.plantacion'),
+        ),
+        migrations.AddConstraint(
+            model_name='resumenregistrocampo',
+            constraint=models.UniqueConstraint(fields=('plantacion', 'periodo', 'inicio'), name='resumen_plantacion_periodo_inicio'),
+        ),
+        migrations.RunPython(calcular_resumenes, migrations.RunPython.noop),
+    ]
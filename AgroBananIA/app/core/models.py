@@ -2,8 +2,9 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db.models import Avg
 from decimal import Decimal
+from AgroBananIA.utils import geo
+import uuid
 
 # Definición de actividades agrícolas reutilizable
 class ActividadAgricola(models.TextChoices):
@@ -40,6 +41,12 @@ class PerfilUsuario(models.Model):
     def __str__(self):
         return f"Perfil de {self.user.username}"
 
+class PlantacionQuerySet(models.QuerySet):
+    def con_estadisticas(self):
+        """Trae las estadísticas y el último registro de cada plantación en la misma consulta."""
+        return self.select_related('estadistica', 'estadistica__ultimo_registro')
+
+
 class Plantacion(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='plantaciones')
     nombre_finca = models.CharField(max_length=100)
@@ -47,23 +54,52 @@ class Plantacion(models.Model):
     extension_hectareas = models.DecimalField(max_digits=6, decimal_places=2)
     latitud = models.DecimalField(max_digits=9, decimal_places=6)
     longitud = models.DecimalField(max_digits=9, decimal_places=6)
+    # Celda de la rejilla geográfica (AgroBananIA/utils/geo.py) para buscar plantaciones cercanas por índice
+    celda_geo = models.BigIntegerField(null=True, blank=True, editable=False, db_index=True)
     fecha_registro = models.DateField(auto_now_add=True)
 
+    objects = PlantacionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Consultas por recuadro del mapa del dashboard (rango de latitud y longitud)
+            models.Index(fields=['latitud', 'longitud'], name='plantacion_lat_lon_idx'),
+        ]
+
     def __str__(self):
         return f"{self.nombre_finca} ({self.usuario.username})"
 
+    def save(self, *args, **kwargs):
+        if self.latitud is not None and self.longitud is not None:
+            self.celda_geo = geo.celda(self.latitud, self.longitud)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitud', 'longitud'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'celda_geo'}
+        super().save(*args, **kwargs)
+
+    # Leídos de EstadisticaPlantacion (mantenida por app/core/estadisticas.py). Con
+    # Plantacion.objects.con_estadisticas() no hacen ninguna consulta adicional.
+    @property
+    def _estadistica(self):
+        try:
+            return self.estadistica
+        except EstadisticaPlantacion.DoesNotExist:
+            return None
+
     @property
     def registros_activos(self):
-        return self.registros_campo.count()
+        estadistica = self._estadistica
+        return estadistica.total_registros if estadistica else 0
 
     @property
     def ultimo_registro(self):
-        return self.registros_campo.order_by('-fecha_registro').first()
+        estadistica = self._estadistica
+        return estadistica.ultimo_registro if estadistica else None
 
     @property
     def temperatura_promedio(self):
-        # Uso eficiente de aggregate para evitar cargar todos los registros
-        return self.registros_campo.aggregate(avg=Avg('temperatura'))['avg'] or Decimal('0.0')
+        estadistica = self._estadistica
+        return estadistica.temperatura_promedio if estadistica else Decimal('0.0')
 
 class RegistroCampo(models.Model):
     plantacion = models.ForeignKey(Plantacion, on_delete=models.CASCADE, related_name='registros_campo')
@@ -116,10 +152,82 @@ class RegistroCampo(models.Model):
         ordering = ['-fecha_registro']
         verbose_name = "Registro de Campo"
         verbose_name_plural = "Registros de Campo"
+        indexes = [
+            # Series por plantación y rango de fechas (gráficas y resúmenes por periodo)
+            models.Index(fields=['plantacion', 'fecha_registro'], name='registro_plantacion_fecha_idx'),
+        ]
 
     def __str__(self):
         return f"Registro {self.plantacion.nombre_finca} - {self.fecha_registro}"
 
+class EstadisticaPlantacion(models.Model):
+    """
+    Resumen de los registros de campo de una plantación, actualizado al guardar o
+    eliminar cada RegistroCampo. `manage.py recalcular_estadisticas` lo reconstruye
+    si se cargaron registros con bulk_create o update().
+    """
+    plantacion = models.OneToOneField(
+        Plantacion, on_delete=models.CASCADE, primary_key=True, related_name='estadistica'
+    )
+    total_registros = models.PositiveIntegerField(default=0)
+    suma_temperatura = models.DecimalField(max_digits=12, decimal_places=1, default=Decimal('0.0'))
+    ultimo_registro = models.ForeignKey(
+        RegistroCampo, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    ultima_fecha = models.DateField(null=True, blank=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Estadística de Plantación'
+        verbose_name_plural = 'Estadísticas de Plantación'
+
+    def __str__(self):
+        return f"Estadísticas de {self.plantacion_id} ({self.total_registros} registros)"
+
+    @property
+    def temperatura_promedio(self):
+        if not self.total_registros:
+            return Decimal('0.0')
+        return self.suma_temperatura / self.total_registros
+
+
+class ResumenRegistroCampo(models.Model):
+    """
+    Promedios de los registros de campo de una plantación por semana (desde el lunes)
+    o por mes. Cada periodo se recalcula al guardar o eliminar uno de sus registros,
+    así las gráficas de un año leen decenas de filas en lugar de cientos.
+    """
+    class Periodo(models.TextChoices):
+        SEMANA = 'semana', 'Semana'
+        MES = 'mes', 'Mes'
+
+    plantacion = models.ForeignKey(Plantacion, on_delete=models.CASCADE, related_name='resumenes_campo')
+    periodo = models.CharField(max_length=10, choices=Periodo.choices)
+    inicio = models.DateField()
+    cantidad = models.PositiveIntegerField(default=0)
+    promedio_temperatura = models.FloatField(null=True, blank=True)
+    temperatura_min = models.FloatField(null=True, blank=True)
+    temperatura_max = models.FloatField(null=True, blank=True)
+    promedio_humedad = models.FloatField(null=True, blank=True)
+    promedio_precipitacion = models.FloatField(null=True, blank=True)
+    precipitacion_total = models.FloatField(null=True, blank=True)
+    promedio_ph_suelo = models.FloatField(null=True, blank=True)
+    promedio_humedad_suelo = models.FloatField(null=True, blank=True)
+    promedio_nitrogeno = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['plantacion', 'periodo', 'inicio']
+        verbose_name = 'Resumen de Registros de Campo'
+        verbose_name_plural = 'Resúmenes de Registros de Campo'
+        constraints = [
+            # También es el índice de las series: plantación + periodo + rango de inicio
+            models.UniqueConstraint(fields=['plantacion', 'periodo', 'inicio'], name='resumen_plantacion_periodo_inicio'),
+        ]
+
+    def __str__(self):
+        return f"Resumen {self.periodo} {self.inicio} - plantación {self.plantacion_id}"
+
+
 class ImagenAnalisis(models.Model):
     plantacion = models.ForeignKey(Plantacion, on_delete=models.CASCADE, related_name='imagenes')
     imagen = models.ImageField(upload_to='imagenes_analisis/')
@@ -128,6 +236,15 @@ class ImagenAnalisis(models.Model):
     damage = models.ImageField(upload_to='imagenes_analisis/dano/', null=True, blank=True)
     fecha_envio = models.DateTimeField(auto_now_add=True, db_index=True)  # Índice para consultas frecuentes
 
+    class Meta:
+        indexes = [
+            # Listado de análisis: las imágenes de cada plantación salen del índice (sin
+            # leer la tabla) ya en orden (fecha_envio, id). Con ?plantacion= la página se
+            # lee en ese orden sin ordenar; sin él, SQLite busca en cada plantación del
+            # usuario y ordena solo sus filas. El filtro por enfermedad no está indexado.
+            models.Index(fields=['plantacion', '-fecha_envio', '-id'], name='imagen_plantacion_fecha_idx'),
+        ]
+
     def __str__(self):
         return f"Imagen {self.id} - {self.plantacion.nombre_finca}"
 
@@ -138,6 +255,15 @@ class ResultadoAnalisis(models.Model):
     recomendaciones = models.TextField()
     informe_pdf = models.FileField(upload_to='informes/', null=True, blank=True)
     fecha_analisis = models.DateTimeField(auto_now_add=True)
+    # Modelo que produjo el diagnóstico (archivo@mtime); `manage.py reanalizar` actualiza los desactualizados
+    version_modelo = models.CharField(max_length=150, blank=True, db_index=True)
+    # Severidad calculada sobre la máscara de segmentación (null en análisis anteriores)
+    area_lesion_pct = models.FloatField(null=True, blank=True, db_index=True, help_text="Área con lesión en % de la imagen")
+    num_lesiones = models.PositiveIntegerField(null=True, blank=True)
+    histograma_lesiones = models.JSONField(
+        default=list, blank=True,
+        help_text="Lesiones por tamaño (% de la imagen): <0.01, 0.01-0.05, 0.05-0.25, 0.25-1, 1-5, >5"
+    )
 
     def __str__(self):
         return f"Resultado - {self.enfermedad_detectada} ({self.probabilidad:.2f}%)"
@@ -149,11 +275,148 @@ class AlertaComunitaria(models.Model):
     enfermedad = models.CharField(max_length=100)
     distancia = models.FloatField(help_text='Distancia en km')
     fecha_alerta = models.DateTimeField(default=timezone.now, db_index=True)
+    leida = models.BooleanField(default=False)
 
     class Meta:
-        ordering = ['-fecha_alerta']
+        ordering = ['-fecha_alerta', '-id']
         verbose_name = 'Alerta Comunitaria'
         verbose_name_plural = 'Alertas Comunitarias'
+        indexes = [
+            # Deduplicación de la difusión: misma enfermedad en la ventana de tiempo
+            models.Index(fields=['enfermedad', 'fecha_alerta'], name='alerta_enfermedad_fecha_idx'),
+            # Bandeja de entrada: paginación por cursor (fecha_alerta, id) de cada destinatario
+            models.Index(fields=['usuario_destino', '-fecha_alerta', '-id'], name='alerta_bandeja_idx'),
+            # Conteo de no leídas sin recorrer las ya leídas
+            models.Index(fields=['usuario_destino', 'leida'], name='alerta_no_leidas_idx'),
+        ]
 
     def __str__(self):
         return f"Alerta de {self.enfermedad} de {self.usuario_origen} a {self.usuario_destino} ({self.distancia} km)"
+
+class TrabajoAnalisis(models.Model):
+    """Análisis encolado desde /deteccion/analizar/ y procesado por el pool de workers"""
+
+    class Estado(models.TextChoices):
+        PENDIENTE = 'pendiente', 'Pendiente'
+        PROCESANDO = 'procesando', 'Procesando'
+        COMPLETADO = 'completado', 'Completado'
+        ERROR = 'error', 'Error'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    usuario = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name='trabajos_analisis'
+    )
+    plantacion = models.ForeignKey(
+        Plantacion, on_delete=models.SET_NULL, null=True, blank=True, related_name='trabajos_analisis'
+    )
+    estado = models.CharField(max_length=20, choices=Estado.choices, default=Estado.PENDIENTE, db_index=True)
+    imagen_original = models.CharField(max_length=255, help_text="Archivo original dentro de media/resultados")
+    resultado = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-fecha_creacion']
+        verbose_name = 'Trabajo de Análisis'
+        verbose_name_plural = 'Trabajos de Análisis'
+
+    def __str__(self):
+        return f"Trabajo {self.id} ({self.estado})"
+
+
+class CacheAnalisis(models.Model):
+    """Resultado de análisis reutilizable para imágenes idénticas (hash del contenido + versión del modelo)"""
+    hash_imagen = models.CharField(max_length=64)
+    version_modelo = models.CharField(max_length=150)
+    resultado = models.JSONField()
+    archivos = models.JSONField(default=list, help_text="Artefactos de segmentación en media/resultados")
+    tamano_bytes = models.PositiveBigIntegerField(default=0)
+    aciertos = models.PositiveIntegerField(default=0)
+    ultimo_acceso = models.DateTimeField(default=timezone.now, db_index=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Caché de Análisis'
+        verbose_name_plural = 'Caché de Análisis'
+        constraints = [
+            models.UniqueConstraint(fields=['hash_imagen', 'version_modelo'], name='cache_analisis_hash_version_unico'),
+        ]
+
+    def __str__(self):
+        return f"Caché {self.hash_imagen[:12]} ({self.version_modelo})"
+
+
+class LoteAnalisis(models.Model):
+    """Carga masiva de imágenes (varios archivos o un ZIP) de una plantación"""
+
+    class Estado(models.TextChoices):
+        PENDIENTE = 'pendiente', 'Pendiente'
+        PROCESANDO = 'procesando', 'Procesando'
+        COMPLETADO = 'completado', 'Completado'
+        ERROR = 'error', 'Error'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='lotes_analisis')
+    plantacion = models.ForeignKey(Plantacion, on_delete=models.CASCADE, related_name='lotes_analisis')
+    estado = models.CharField(max_length=20, choices=Estado.choices, default=Estado.PENDIENTE, db_index=True)
+    total = models.PositiveIntegerField(default=0)
+    procesadas = models.PositiveIntegerField(default=0)
+    errores = models.PositiveIntegerField(default=0)
+    mensaje_error = models.TextField(blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-fecha_creacion']
+        verbose_name = 'Lote de Análisis'
+        verbose_name_plural = 'Lotes de Análisis'
+
+    def __str__(self):
+        return f"Lote {self.id} - {self.plantacion.nombre_finca} ({self.procesadas}/{self.total})"
+
+    @property
+    def porcentaje(self):
+        if not self.total:
+            return 0
+        return round((self.procesadas + self.errores) * 100 / self.total, 1)
+
+
+class ComparacionModelo(models.Model):
+    """Estadísticas acumuladas de la inferencia en sombra: modelo en producción frente al candidato"""
+    version_principal = models.CharField(max_length=150)
+    version_candidata = models.CharField(max_length=150)
+    muestras = models.PositiveIntegerField(default=0)
+    coincidencias = models.PositiveIntegerField(default=0, help_text="Muestras con la misma clase predicha")
+    latencia_principal_ms = models.FloatField(default=0, help_text="Suma de latencias por imagen")
+    latencia_candidata_ms = models.FloatField(default=0, help_text="Suma de latencias por imagen")
+    latencia_candidata_max_ms = models.FloatField(default=0)
+    diferencia_confianza = models.FloatField(default=0, help_text="Suma de |p_principal - p_candidata| de la clase principal")
+    descartadas = models.PositiveIntegerField(default=0, help_text="Muestras no evaluadas por cola llena")
+    fecha_inicio = models.DateTimeField(auto_now_add=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-fecha_actualizacion']
+        verbose_name = 'Comparación de Modelos'
+        verbose_name_plural = 'Comparaciones de Modelos'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['version_principal', 'version_candidata'], name='comparacion_modelo_versiones_unico'
+            ),
+        ]
+
+    @property
+    def tasa_acuerdo(self):
+        return round(self.coincidencias * 100 / self.muestras, 2) if self.muestras else None
+
+    @property
+    def latencia_principal_media_ms(self):
+        return self.latencia_principal_ms / self.muestras if self.muestras else None
+
+    @property
+    def latencia_candidata_media_ms(self):
+        return self.latencia_candidata_ms / self.muestras if self.muestras else None
+
+    def __str__(self):
+        return f"{self.version_candidata} vs {self.version_principal} ({self.muestras} muestras)"
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from operator import attrgetter
+
+
+# Paginación por cursor (keyset) sobre (fecha, id) descendente. En lugar de OFFSET se
+# continúa desde la última fila de la página anterior, así el costo no crece con la
+# profundidad y las filas que llegan mientras tanto no desplazan la página.
+
+_EPOCA = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+# Límites de un cursor válido: fechas representables por datetime e ids que caben en
+# un entero de 64 bits de la base de datos
+_MAX_MICROSEGUNDOS = (datetime.max.replace(tzinfo=dt_timezone.utc) - _EPOCA) // timedelta(microseconds=1)
+_MAX_ID = 2 ** 63 - 1
+
+
+def codificar_cursor(fecha, pk):
+    """Posición (fecha, id) de la última fila de una página, como texto para la URL."""
+    microsegundos = (fecha - _EPOCA) // timedelta(microseconds=1)
+    return f"{microsegundos}-{pk}"
+
+
+def decodificar_cursor(cursor):
+    """(fecha, id) del cursor, o None si no es válido o está fuera de rango (se muestra la primera página)."""
+    try:
+        microsegundos, pk = (int(valor) for valor in cursor.split('-'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if not (0 <= microsegundos <= _MAX_MICROSEGUNDOS and 0 < pk <= _MAX_ID):
+        return None
+    try:
+        return _EPOCA + timedelta(microseconds=microsegundos), pk
+    except OverflowError:
+        return None
+
+
+def pagina_keyset(queryset, campo_fecha, cursor=None, tamano=20, campo_id='id'):
+    """
+    Una página de `queryset` ordenada por (campo_fecha, campo_id) descendente,
+    continuando desde `cursor`: se piden tamano + 1 filas para saber si hay otra
+    página. Los campos pueden cruzar relaciones ('imagen__fecha_envio').
+    Devuelve (filas, cursor_siguiente o None).
+    """
+    clave = attrgetter(campo_fecha.replace('__', '.'), campo_id.replace('__', '.'))
+    queryset = queryset.order_by(f'-{campo_fecha}', f'-{campo_id}')
+    posicion = decodificar_cursor(cursor) if cursor else None
+    if posicion is not None:
+        fecha, pk = posicion
+        # (fecha, id) < (fecha_cursor, pk): el rango sobre la fecha usa el índice
+        queryset = queryset.filter(**{f'{campo_fecha}__lte': fecha}).exclude(
+            **{campo_fecha: fecha, f'{campo_id}__gte': pk}
+        )
+    filas = list(queryset[:tamano + 1])
+    siguiente = codificar_cursor(*clave(filas[tamano - 1])) if len(filas) > tamano else None
+    return filas[:tamano], siguiente
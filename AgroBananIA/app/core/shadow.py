@@ -0,0 +1,161 @@
+import time
+import queue
+import random
+import logging
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from app.core.models import ComparacionModelo
+from AgroBananIA.utils.diagnostic import (
+    MODEL_CUSTOM,
+    MODEL_SHADOW,
+    model_registry,
+    preprocess_image_custom,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+# Las estadísticas se acumulan en memoria y se vuelcan a la base de datos cada
+# VOLCAR_CADA muestras o VOLCAR_SEGUNDOS, así el hilo en sombra no escribe por imagen
+VOLCAR_CADA = 20
+VOLCAR_SEGUNDOS = 30
+
+
+class InferenciaShadow:
+    """
+    Ejecuta el modelo candidato (MODELO_SHADOW_ARCHIVO) sobre una fracción del
+    tráfico en un hilo propio. En la petición solo se sortea la muestra y, si sale,
+    su tensor se deja en una cola acotada: con la cola llena se descarta, nunca se espera.
+    """
+
+    def __init__(self):
+        self._cola = queue.Queue(maxsize=getattr(settings, 'MODELO_SHADOW_MAX_PENDIENTES', 32))
+        self._hilo = None
+        self._lock = threading.Lock()
+        self._acumulado = self._vacio()
+        self._ultimo_volcado = time.monotonic()
+
+    @staticmethod
+    def _vacio():
+        return {
+            'muestras': 0,
+            'coincidencias': 0,
+            'latencia_principal_ms': 0.0,
+            'latencia_candidata_ms': 0.0,
+            'latencia_candidata_max_ms': 0.0,
+            'diferencia_confianza': 0.0,
+            'descartadas': 0,
+        }
+
+    def activo(self):
+        return model_registry.registrado(MODEL_SHADOW)
+
+    def _asegurar_hilo(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            with self._lock:
+                if self._hilo is None or not self._hilo.is_alive():
+                    self._hilo = threading.Thread(target=self._bucle, name='inferencia-shadow', daemon=True)
+                    self._hilo.start()
+
+    def observar(self, predicciones, latencia_ms, entradas=None, imagen=None):
+        """
+        Registra una inferencia del modelo principal para compararla en sombra.
+        `entradas` es el batch ya preprocesado; con `imagen` (BGR) solo se
+        preprocesa si sale sorteada, y a la cola va el tensor de 128x128, nunca
+        la foto completa. `latencia_ms` es la del batch completo.
+        """
+        if not self.activo() or random.random() >= getattr(settings, 'MODELO_SHADOW_FRACCION', 0.1):
+            return False
+        self._asegurar_hilo()
+        if entradas is None:
+            entradas = preprocess_image_custom(imagen)
+        try:
+            self._cola.put_nowait((entradas, np.asarray(predicciones), latencia_ms))
+            return True
+        except queue.Full:
+            with self._lock:
+                self._acumulado['descartadas'] += 1
+            return False
+
+    def _bucle(self):
+        while True:
+            try:
+                entradas, principal, latencia_principal_ms = self._cola.get(timeout=VOLCAR_SEGUNDOS)
+            except queue.Empty:
+                self._volcar()
+                continue
+            try:
+                self._comparar(entradas, principal, latencia_principal_ms)
+            except Exception as e:
+                logger.error(f"Error en la inferencia en sombra: {e}")
+            if self._acumulado['muestras'] >= VOLCAR_CADA or time.monotonic() - self._ultimo_volcado >= VOLCAR_SEGUNDOS:
+                self._volcar()
+
+    def _comparar(self, entradas, principal, latencia_principal_ms):
+        predictor = model_registry.predictor(MODEL_SHADOW)
+        if predictor is None:
+            return
+        principal = principal.reshape(len(entradas), -1)
+
+        inicio = time.perf_counter()
+        candidata = np.asarray(predictor(entradas)).reshape(len(entradas), -1)
+        latencia_candidata_ms = (time.perf_counter() - inicio) * 1000
+
+        clases = principal.argmax(axis=1)
+        filas = np.arange(len(clases))
+        n = len(clases)
+        with self._lock:
+            acumulado = self._acumulado
+            acumulado['muestras'] += n
+            acumulado['coincidencias'] += int((candidata.argmax(axis=1) == clases).sum())
+            acumulado['latencia_principal_ms'] += latencia_principal_ms
+            acumulado['latencia_candidata_ms'] += latencia_candidata_ms
+            acumulado['latencia_candidata_max_ms'] = max(
+                acumulado['latencia_candidata_max_ms'], latencia_candidata_ms / n
+            )
+            acumulado['diferencia_confianza'] += float(
+                np.abs(principal[filas, clases] - candidata[filas, clases]).sum()
+            )
+
+    def _volcar(self):
+        with self._lock:
+            acumulado, self._acumulado = self._acumulado, self._vacio()
+            self._ultimo_volcado = time.monotonic()
+        if not acumulado['muestras'] and not acumulado['descartadas']:
+            return
+
+        close_old_connections()
+        try:
+            comparacion, _ = ComparacionModelo.objects.get_or_create(
+                version_principal=model_registry.version(MODEL_CUSTOM),
+                version_candidata=model_registry.version(MODEL_SHADOW),
+            )
+            ComparacionModelo.objects.filter(pk=comparacion.pk).update(
+                muestras=F('muestras') + acumulado['muestras'],
+                coincidencias=F('coincidencias') + acumulado['coincidencias'],
+                latencia_principal_ms=F('latencia_principal_ms') + acumulado['latencia_principal_ms'],
+                latencia_candidata_ms=F('latencia_candidata_ms') + acumulado['latencia_candidata_ms'],
+                latencia_candidata_max_ms=Greatest('latencia_candidata_max_ms', Value(acumulado['latencia_candidata_max_ms'])),
+                diferencia_confianza=F('diferencia_confianza') + acumulado['diferencia_confianza'],
+                descartadas=F('descartadas') + acumulado['descartadas'],
+                fecha_actualizacion=timezone.now(),
+            )
+        except Exception as e:
+            logger.error(f"No se pudieron guardar las estadísticas de la inferencia en sombra: {e}")
+        finally:
+            close_old_connections()
+
+    def volcar(self):
+        """Escribe en la base de datos lo acumulado hasta ahora (p. ej. al terminar un comando)."""
+        self._volcar()
+
+
+shadow = InferenciaShadow()
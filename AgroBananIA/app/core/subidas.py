@@ -0,0 +1,140 @@
+import io
+import uuid
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopFutureHandlers
+
+
+logger = logging.getLogger(__name__)
+
+
+# Firmas (magic bytes) de los formatos aceptados: la extensión y el content-type
+# que envía el navegador no se usan para decidir si el archivo es una imagen
+FIRMAS_IMAGEN = (
+    (b'\xff\xd8\xff', '.jpg', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', '.png', 'image/png'),
+)
+BYTES_FIRMA = max(len(firma) for firma, _, _ in FIRMAS_IMAGEN)
+
+# Margen para los campos del formulario (token CSRF, plantación) sobre el tamaño del archivo
+MARGEN_FORMULARIO = 64 * 1024
+
+
+def max_bytes():
+    return getattr(settings, 'SUBIDA_MAX_BYTES', 10 * 1024 * 1024)
+
+
+def mensaje_tamano():
+    return f"La imagen supera el tamaño máximo de {max_bytes() // (1024 * 1024)} MB."
+
+
+MENSAJE_FORMATO = "El archivo no es una imagen JPG o PNG válida."
+
+
+def identificar_imagen(cabecera):
+    """(extensión, content_type) según los primeros bytes, o None si no es un formato aceptado."""
+    for firma, extension, content_type in FIRMAS_IMAGEN:
+        if cabecera.startswith(firma):
+            return extension, content_type
+    return None
+
+
+def excede_limite(request):
+    """True si el Content-Length ya anuncia un cuerpo mayor que el permitido (se rechaza sin leerlo)."""
+    try:
+        longitud = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return False
+    return longitud > max_bytes() + MARGEN_FORMULARIO
+
+
+class ImagenUploadHandler(FileUploadHandler):
+    """
+    Recibe la imagen por bloques: comprueba la firma en el primer bloque y el tamaño
+    en cada uno, de modo que un archivo que no es imagen o que excede SUBIDA_MAX_BYTES
+    se descarta sin terminar de escribirse. Hasta SUBIDA_MEMORIA_BYTES queda en memoria;
+    por encima pasa a un temporal. El archivo resultante tiene un nombre único (el del
+    cliente no se usa) y el SHA-256 del contenido, calculado al vuelo, en `hash_contenido`.
+
+    Si la subida se rechaza, el motivo queda en `request.subida_rechazada` como (estado, mensaje).
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.max_bytes = max_bytes()
+        self.max_memoria = getattr(settings, 'SUBIDA_MEMORIA_BYTES', 5 * 1024 * 1024)
+
+    def _rechazar(self, estado, mensaje):
+        logger.warning(f"Subida rechazada ({self.file_name}): {mensaje}")
+        if self.request is not None:
+            self.request.subida_rechazada = (estado, mensaje)
+        raise SkipFile
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if self.content_length and self.content_length > self.max_bytes:
+            self._rechazar(413, mensaje_tamano())
+        self.file = io.BytesIO()
+        self.cabecera = b''
+        self.formato = None
+        self.hash = hashlib.sha256()
+        self.recibidos = 0
+        self.nombre = uuid.uuid4().hex
+        raise StopFutureHandlers
+
+    def receive_data_chunk(self, raw_data, start):
+        self.recibidos += len(raw_data)
+        if self.recibidos > self.max_bytes:
+            self._rechazar(413, mensaje_tamano())
+        if self.formato is None:
+            self.cabecera += raw_data[:BYTES_FIRMA - len(self.cabecera)]
+            if len(self.cabecera) >= BYTES_FIRMA:
+                self.formato = identificar_imagen(self.cabecera)
+                if self.formato is None:
+                    self._rechazar(400, MENSAJE_FORMATO)
+
+        if isinstance(self.file, io.BytesIO) and self.recibidos > self.max_memoria:
+            temporal = TemporaryUploadedFile(
+                self.nombre, self.formato[1], 0, self.charset, self.content_type_extra
+            )
+            temporal.write(self.file.getvalue())
+            self.file = temporal
+        self.file.write(raw_data)
+        self.hash.update(raw_data)
+
+    def file_complete(self, file_size):
+        if self.formato is None:
+            # Archivo más corto que la firma más larga
+            self.formato = identificar_imagen(self.cabecera)
+            if self.formato is None:
+                self.file.close()
+                if self.request is not None:
+                    self.request.subida_rechazada = (400, MENSAJE_FORMATO)
+                return None
+
+        self.nombre = f"{self.nombre}{self.formato[0]}"
+        self.file.seek(0)
+        if isinstance(self.file, io.BytesIO):
+            archivo = InMemoryUploadedFile(
+                file=self.file,
+                field_name=self.field_name,
+                name=self.nombre,
+                content_type=self.formato[1],
+                size=file_size,
+                charset=self.charset,
+                content_type_extra=self.content_type_extra,
+            )
+        else:
+            archivo = self.file
+            archivo.name = self.nombre
+            archivo.content_type = self.formato[1]
+            archivo.size = file_size
+        archivo.hash_contenido = self.hash.hexdigest()
+        return archivo
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self.file.close()
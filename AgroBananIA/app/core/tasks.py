@@ -0,0 +1,104 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from app.core.models import TrabajoAnalisis, LoteAnalisis
+from app.core.analisis import ejecutar_analisis, guardar_analisis, ruta_resultados
+from app.core.cache_analisis import hash_contenido
+from app.core.lotes import procesar_lote
+from AgroBananIA.utils.diagnostic import decode_image_bytes, orientacion_exif
+from AgroBananIA.utils.metricas import traza
+
+
+logger = logging.getLogger(__name__)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Pool de workers local del proceso: no requiere broker externo."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'ANALISIS_WORKERS', 2),
+                    thread_name_prefix='analisis',
+                )
+    return _executor
+
+
+def _procesar_trabajo(trabajo_id, imagen_bgr=None, hash_imagen=None, orientacion=1):
+    close_old_connections()
+    try:
+        trabajo = TrabajoAnalisis.objects.get(pk=trabajo_id)
+        TrabajoAnalisis.objects.filter(pk=trabajo_id).update(estado=TrabajoAnalisis.Estado.PROCESANDO)
+
+        if imagen_bgr is None:
+            # Trabajo recuperado tras un reinicio: se decodifica el original ya guardado
+            with open(os.path.join(ruta_resultados(), trabajo.imagen_original), 'rb') as origen:
+                datos_imagen = origen.read()
+            imagen_bgr = decode_image_bytes(datos_imagen)
+            orientacion = orientacion_exif(datos_imagen)
+            hash_imagen = hash_contenido(datos_imagen)
+
+        with traza('trabajo_analisis'):
+            resultado = ejecutar_analisis(
+                imagen_bgr, trabajo.imagen_original, hash_imagen=hash_imagen, orientacion=orientacion,
+            )
+            if trabajo.plantacion_id:
+                guardar_analisis(trabajo.plantacion_id, resultado)
+        TrabajoAnalisis.objects.filter(pk=trabajo_id).update(
+            estado=TrabajoAnalisis.Estado.COMPLETADO,
+            resultado=resultado,
+        )
+        logger.info(f"Trabajo de análisis {trabajo_id} completado")
+    except Exception as e:
+        logger.exception(f"Error en el trabajo de análisis {trabajo_id}: {e}")
+        TrabajoAnalisis.objects.filter(pk=trabajo_id).update(
+            estado=TrabajoAnalisis.Estado.ERROR,
+            error=str(e),
+        )
+    finally:
+        close_old_connections()
+
+
+def encolar_analisis(trabajo, imagen_bgr=None, hash_imagen=None, orientacion=1):
+    """Envía el trabajo al pool; la imagen ya decodificada viaja en memoria."""
+    return get_executor().submit(_procesar_trabajo, trabajo.pk, imagen_bgr, hash_imagen, orientacion)
+
+
+def _procesar_lote(lote_id):
+    close_old_connections()
+    try:
+        procesar_lote(lote_id)
+    except Exception as e:
+        logger.exception(f"Error en el lote de análisis {lote_id}: {e}")
+        LoteAnalisis.objects.filter(pk=lote_id).update(
+            estado=LoteAnalisis.Estado.ERROR,
+            mensaje_error=str(e),
+        )
+    finally:
+        close_old_connections()
+
+
+def encolar_lote(lote):
+    return get_executor().submit(_procesar_lote, lote.pk)
+
+
+def reanudar_pendientes():
+    """Vuelve a encolar los trabajos que quedaron sin terminar (p. ej. tras reiniciar el servidor)."""
+    pendientes = TrabajoAnalisis.objects.filter(
+        estado__in=[TrabajoAnalisis.Estado.PENDIENTE, TrabajoAnalisis.Estado.PROCESANDO]
+    )
+    total = 0
+    for trabajo in pendientes.iterator():
+        encolar_analisis(trabajo)
+        total += 1
+    return total
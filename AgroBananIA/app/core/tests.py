@@ -1,3 +1,949 @@
-from django.test import TestCase
+import io
+import hashlib
+import os
+import json
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from PIL import Image
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
+from django.core.files.uploadhandler import SkipFile, StopFutureHandlers
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from app.core import analisis, cache_analisis, estadisticas, subidas
+from app.core.alertas import difundir_alerta
+from app.core.mapa import plantaciones_bbox
+from app.core.models import (
+    AlertaComunitaria, CacheAnalisis, EstadisticaPlantacion, ImagenAnalisis, Plantacion, RegistroCampo,
+    ResultadoAnalisis, ResumenRegistroCampo, TrabajoAnalisis,
+)
+from app.core.analisis import guardar_analisis, guardar_analisis_bulk, nombre_media, ruta_resultados
+from app.core.management.commands import reanalizar
+from app.core.paginacion import codificar_cursor, decodificar_cursor
+from AgroBananIA.utils import diagnostic, segmentation
+
+
+# Cursores manipulados: no numéricos, fechas fuera del rango de datetime e ids que no
+# caben en un entero de 64 bits
+CURSORES_INVALIDOS = [
+    'abc',
+    '1-2-3',
+    '99999999999999999999-1',
+    '253402300800000000-1',
+    '1700000000000000-99999999999999999999',
+    '1700000000000000-0',
+]
+
+
+def crear_plantacion(usuario, nombre='Finca A', latitud=-2.17, longitud=-79.92):
+    return Plantacion.objects.create(
+        usuario=usuario, nombre_finca=nombre, ubicacion='Guayas',
+        extension_hectareas=10, latitud=latitud, longitud=longitud,
+    )
+
+
+def crear_analisis(plantacion, cantidad, enfermedad='Sigatoka'):
+    """Análisis sin archivos en disco, con fechas de envío escalonadas (dos por minuto)"""
+    imagenes = ImagenAnalisis.objects.bulk_create([
+        ImagenAnalisis(plantacion=plantacion, imagen=f'imagenes_analisis/{plantacion.pk}_{i}.jpg')
+        for i in range(cantidad)
+    ])
+    ahora = timezone.now()
+    for i, imagen in enumerate(imagenes):
+        imagen.fecha_envio = ahora - timedelta(minutes=i // 2)
+    ImagenAnalisis.objects.bulk_update(imagenes, ['fecha_envio'])
+    ResultadoAnalisis.objects.bulk_create([
+        ResultadoAnalisis(imagen=imagen, enfermedad_detectada=enfermedad, probabilidad=90.0, recomendaciones='')
+        for imagen in imagenes
+    ])
+    return imagenes
+
+
+class CursorTests(TestCase):
+
+    def test_ida_y_vuelta(self):
+        fecha = timezone.now()
+        self.assertEqual(decodificar_cursor(codificar_cursor(fecha, 42)), (fecha, 42))
+
+    def test_cursor_invalido(self):
+        for cursor in CURSORES_INVALIDOS + [None, '']:
+            with self.subTest(cursor=cursor):
+                self.assertIsNone(decodificar_cursor(cursor))
+
+
+class AlertaComunitariaViewTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('destino', password='x')
+        origen = User.objects.create_user('origen', password='x')
+        plantacion = crear_plantacion(origen)
+        ahora = timezone.now()
+        AlertaComunitaria.objects.bulk_create([
+            AlertaComunitaria(
+                usuario_origen=origen, usuario_destino=cls.usuario, plantacion_origen=plantacion,
+                enfermedad='Sigatoka', distancia=3.5, fecha_alerta=ahora - timedelta(minutes=i // 2),
+            )
+            for i in range(25)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.usuario)
+
+    def test_recorre_todas_las_paginas_en_orden(self):
+        with self.settings(ALERTAS_POR_PAGINA=10):
+            ids, cursor = [], None
+            while True:
+                respuesta = self.client.get(reverse('core:alertas'), {'cursor': cursor} if cursor else {})
+                self.assertEqual(respuesta.status_code, 200)
+                ids += [alerta.id for alerta in respuesta.context['alertas']]
+                cursor = respuesta.context['cursor_siguiente']
+                if not cursor:
+                    break
+        esperados = list(
+            AlertaComunitaria.objects.filter(usuario_destino=self.usuario)
+            .order_by('-fecha_alerta', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, esperados)
+
+    def test_cursor_invalido_muestra_la_primera_pagina(self):
+        primera = self.client.get(reverse('core:alertas'))
+        for cursor in CURSORES_INVALIDOS:
+            with self.subTest(cursor=cursor):
+                respuesta = self.client.get(reverse('core:alertas'), {'cursor': cursor})
+                self.assertEqual(respuesta.status_code, 200)
+                self.assertEqual(
+                    [alerta.id for alerta in respuesta.context['alertas']],
+                    [alerta.id for alerta in primera.context['alertas']],
+                )
+
+
+class DeteccionListViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = User.objects.create_user('tecnico', password='x')
+        self.client.force_login(self.usuario)
+
+    def _recorrer(self, parametros=None):
+        ids, cursor = [], None
+        while True:
+            respuesta = self.client.get(reverse('core:deteccion_list'), {**(parametros or {}), **({'cursor': cursor} if cursor else {})})
+            self.assertEqual(respuesta.status_code, 200)
+            ids += [resultado.imagen_id for resultado in respuesta.context['detecciones']]
+            if not respuesta.context['url_siguiente']:
+                return ids
+            cursor = respuesta.context['url_siguiente'].split('cursor=')[1]
+
+    def test_consultas_no_dependen_de_las_plantaciones(self):
+        # Sesión, usuario, plantaciones del filtro, página y total (solo en la primera)
+        plantacion = crear_plantacion(self.usuario)
+        crear_analisis(plantacion, 30)
+        # La primera petición deja en la caché el contador de alertas del menú
+        segunda = self.client.get(reverse('core:deteccion_list')).context['url_siguiente']
+        with self.assertNumQueries(5):
+            self.client.get(reverse('core:deteccion_list'))
+        with self.assertNumQueries(4):
+            self.client.get(reverse('core:deteccion_list') + segunda)
+
+        for i in range(15):
+            crear_analisis(crear_plantacion(self.usuario, nombre=f'Finca {i}'), 2)
+        # La primera petición deja en la caché el contador de alertas del menú
+        segunda = self.client.get(reverse('core:deteccion_list')).context['url_siguiente']
+        with self.assertNumQueries(5):
+            self.client.get(reverse('core:deteccion_list'))
+        with self.assertNumQueries(4):
+            self.client.get(reverse('core:deteccion_list') + segunda)
+
+    def test_recorre_todas_las_paginas_en_orden(self):
+        for i in range(3):
+            crear_analisis(crear_plantacion(self.usuario, nombre=f'Finca {i}'), 10)
+        ajena = crear_plantacion(User.objects.create_user('otro', password='x'))
+        crear_analisis(ajena, 5)
+
+        esperados = list(
+            ImagenAnalisis.objects.filter(plantacion__usuario=self.usuario)
+            .order_by('-fecha_envio', '-id').values_list('id', flat=True)
+        )
+        with self.settings(DETECCIONES_POR_PAGINA=7):
+            self.assertEqual(self._recorrer(), esperados)
+            plantacion = Plantacion.objects.filter(usuario=self.usuario).first()
+            self.assertEqual(
+                self._recorrer({'plantacion': plantacion.pk}),
+                [pk for pk in esperados if ImagenAnalisis.objects.get(pk=pk).plantacion_id == plantacion.pk],
+            )
+            # Una plantación ajena no muestra nada
+            self.assertEqual(self._recorrer({'plantacion': ajena.pk}), [])
+
+    def test_cursor_invalido_muestra_la_primera_pagina(self):
+        crear_analisis(crear_plantacion(self.usuario), 20)
+        primera = self.client.get(reverse('core:deteccion_list'))
+        for cursor in CURSORES_INVALIDOS:
+            with self.subTest(cursor=cursor):
+                respuesta = self.client.get(reverse('core:deteccion_list'), {'cursor': cursor})
+                self.assertEqual(respuesta.status_code, 200)
+                self.assertEqual(
+                    [resultado.pk for resultado in respuesta.context['detecciones']],
+                    [resultado.pk for resultado in primera.context['detecciones']],
+                )
+
+
+class InferenciaTeselasTests(SimpleTestCase):
+    """predict_tiled_custom con el modelo sustituido: solo se comprueba el teselado"""
+
+    def setUp(self):
+        self.entradas = []
+
+        def predecir_lote(lote):
+            self.entradas.append(lote.shape)
+            probabilidades = np.zeros((len(lote), len(diagnostic.class_mapping)), dtype=np.float32)
+            probabilidades[:, diagnostic.CLASE_SANA] = 1
+            return probabilidades
+
+        for parche in (
+            mock.patch.object(diagnostic.model_registry, 'predictor', return_value=object()),
+            mock.patch.object(diagnostic, 'predict_batch_custom', side_effect=predecir_lote),
+            mock.patch.object(diagnostic, 'predict_with_custom', return_value=(diagnostic.CLASE_SANA, np.eye(6)[[1]])),
+        ):
+            parche.start()
+            self.addCleanup(parche.stop)
+
+    def _imagen(self, alto, ancho):
+        return np.random.default_rng(0).integers(0, 256, (alto, ancho, 3), dtype=np.uint8)
+
+    def test_lado_corto_menor_que_una_tesela_usa_la_imagen_completa(self):
+        for alto, ancho in ((100, 1000), (1000, 100), (127, 4000)):
+            with self.subTest(alto=alto, ancho=ancho):
+                clase, pred, mapa = diagnostic.predict_tiled_custom(self._imagen(alto, ancho))
+                self.assertEqual(clase, diagnostic.CLASE_SANA)
+                self.assertIsNone(mapa)
+        self.assertEqual(self.entradas, [])
+
+    def test_teselas_cubren_la_imagen(self):
+        clase, pred, mapa = diagnostic.predict_tiled_custom(self._imagen(600, 800), solape=0.25, batch=8)
+        self.assertEqual(clase, diagnostic.CLASE_SANA)
+        # Paso de 96 px: 6 filas y 8 columnas, la última ajustada al borde
+        self.assertEqual((mapa['filas'], mapa['columnas']), (6, 8))
+        self.assertEqual(sum(forma[0] for forma in self.entradas), 48)
+        self.assertTrue(all(forma[1:] == (128, 128, 3) for forma in self.entradas))
+
+    def test_imagen_grande_respeta_el_maximo_de_teselas(self):
+        _, _, mapa = diagnostic.predict_tiled_custom(self._imagen(3000, 4000), max_teselas=64)
+        self.assertLessEqual(mapa['filas'] * mapa['columnas'], 64)
+        self.assertLess(mapa['escala'], 1)
+
+    def test_tira_estrecha_no_baja_de_una_tesela(self):
+        # Reducir para cumplir el máximo dejaría el lado corto por debajo de 128 px
+        _, _, mapa = diagnostic.predict_tiled_custom(self._imagen(130, 4000), max_teselas=4)
+        self.assertEqual(mapa['filas'], 1)
+        self.assertTrue(all(forma[1:] == (128, 128, 3) for forma in self.entradas))
+
+
+class LatenciaShadowTests(SimpleTestCase):
+    """La latencia del modelo principal que recibe la inferencia en sombra"""
+
+    def test_solo_mide_el_modelo(self):
+        def preprocesar(imagen):
+            time.sleep(0.2)
+            return np.zeros((1, 128, 128, 3), dtype=np.float32)
+
+        def predictor(lote):
+            time.sleep(0.02)
+            return np.eye(len(diagnostic.class_mapping), dtype=np.float32)[[diagnostic.CLASE_SANA]]
+
+        archivos = {clave: f'hoja_{clave}.jpg' for clave in ('contorno', 'overlay', 'damage')}
+        for batching in (True, False):
+            with (
+                self.subTest(batching=batching),
+                override_settings(INFERENCIA_BATCHING=batching),
+                mock.patch.object(analisis, 'preprocess_image_custom', side_effect=preprocesar),
+                mock.patch.object(diagnostic.model_registry, 'predictor', return_value=predictor),
+                mock.patch.object(analisis, 'segment_and_save', return_value=archivos),
+                mock.patch.object(analisis.shadow, 'observar') as observar,
+            ):
+                resultado = analisis.ejecutar_analisis(np.zeros((200, 300, 3), dtype=np.uint8), 'hoja.jpg')
+                self.assertEqual(resultado['diagnostico_numero'], diagnostic.CLASE_SANA)
+                latencia_ms = observar.call_args.args[1]
+                # Sin los 200 ms del preprocesado ni la espera del batcher
+                self.assertGreaterEqual(latencia_ms, 20)
+                self.assertLess(latencia_ms, 200)
+                self.assertEqual(observar.call_args.kwargs['entradas'].shape, (1, 128, 128, 3))
+
+
+class ArtefactoSegmentacionTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        configuracion = override_settings(MEDIA_ROOT=media)
+        configuracion.enable()
+        self.addCleanup(configuracion.disable)
+
+        # Original y máscara de una segmentación diferida, como los deja el análisis
+        self.original = 'original_prueba.jpg'
+        hoja = np.full((200, 300, 3), (40, 160, 60), dtype=np.uint8)
+        cv2.circle(hoja, (150, 100), 30, (20, 60, 120), -1)
+        cv2.imwrite(os.path.join(ruta_resultados(), self.original), hoja)
+        rutas = segmentation.guardar_mascara(hoja, ruta_resultados(), segmentation.uid_diferido(self.original))
+        self.nombres = {clave: os.path.basename(rutas[clave]) for clave in ('contorno', 'overlay', 'damage', 'mascara')}
+
+        self.usuario = User.objects.create_user('duenio', password='x')
+        ImagenAnalisis.objects.create(
+            plantacion=crear_plantacion(self.usuario), imagen=nombre_media(self.original),
+            **{clave: nombre_media(self.nombres[clave]) for clave in ('contorno', 'overlay', 'damage')},
+        )
+
+    def _url(self, nombre):
+        return reverse('core:deteccion_artefacto', args=[nombre])
+
+    def test_anonimo_sin_permiso_en_la_sesion(self):
+        self.assertEqual(self.client.get(self._url(self.nombres['overlay'])).status_code, 404)
+
+    def test_analisis_anonimo_muestra_sus_artefactos(self):
+        # analizar_imagen no exige iniciar sesión: el resultado se autoriza en la sesión
+        ImagenAnalisis.objects.all().delete()
+        probabilidades = np.eye(len(diagnostic.class_mapping), dtype=np.float32)[[0]]
+        hoja = np.full((200, 300, 3), (40, 160, 60), dtype=np.uint8)
+        cv2.circle(hoja, (150, 100), 30, (20, 60, 120), -1)
+        subida = io.BytesIO(cv2.imencode('.jpg', hoja)[1].tobytes())
+        subida.name = 'hoja.jpg'
+        with mock.patch.object(
+            diagnostic.model_registry, 'predictor', return_value=lambda lote: np.repeat(probabilidades, len(lote), axis=0),
+        ):
+            respuesta = self.client.post(reverse('core:deteccion_analizar'), {'imagen': subida})
+        self.assertEqual(respuesta.status_code, 200)
+        urls = [imagen['url'] for imagen in respuesta.context['imagenes']]
+        self.assertEqual(len(urls), 3)
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+        # Otro visitante (otra sesión) no los ve
+        self.client.cookies.clear()
+        self.assertEqual(self.client.get(urls[0]).status_code, 404)
+
+    def test_duenio_recibe_el_artefacto_renderizado(self):
+        self.client.force_login(self.usuario)
+        for clave in ('contorno', 'overlay', 'damage'):
+            with self.subTest(clave=clave):
+                respuesta = self.client.get(self._url(self.nombres[clave]))
+                self.assertEqual(respuesta.status_code, 200)
+                self.assertEqual(respuesta['Content-Type'], 'image/jpeg')
+                self.assertIn('private', respuesta['Cache-Control'])
+                self.assertTrue(b''.join(respuesta.streaming_content).startswith(b'\xff\xd8'))
+
+    def test_otro_usuario_no_accede(self):
+        self.client.force_login(User.objects.create_user('vecino', password='x'))
+        self.assertEqual(self.client.get(self._url(self.nombres['overlay'])).status_code, 404)
+
+    def test_solo_sufijos_de_artefacto(self):
+        self.client.force_login(self.usuario)
+        for nombre in (self.nombres['mascara'], self.original, 'original_prueba_overlay.png'):
+            with self.subTest(nombre=nombre):
+                self.assertEqual(self.client.get(self._url(nombre)).status_code, 404)
+
+    def test_resultado_mostrado_en_la_sesion(self):
+        # Análisis sin plantación: no hay ImagenAnalisis, lo autoriza la sesión
+        ImagenAnalisis.objects.all().delete()
+        otro = User.objects.create_user('sin_finca', password='x')
+        self.client.force_login(otro)
+        self.assertEqual(self.client.get(self._url(self.nombres['damage'])).status_code, 404)
+        sesion = self.client.session
+        sesion['artefactos_permitidos'] = [self.nombres['damage']]
+        sesion.save()
+        self.assertEqual(self.client.get(self._url(self.nombres['damage'])).status_code, 200)
+
+
+class ConsultasPorPlantacionTests(TestCase):
+    """Páginas que listan las plantaciones del usuario en un <select>"""
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = User.objects.create_user('productor', password='x')
+        self.client.force_login(self.usuario)
+        self.plantacion = crear_plantacion(self.usuario)
+        self.resultado = crear_analisis(self.plantacion, 1)[0].resultado
+
+    def _comprobar(self, url, consultas):
+        # La primera petición deja en la caché el contador de alertas del menú
+        self.client.get(url)
+        with self.assertNumQueries(consultas):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        for i in range(10):
+            crear_plantacion(self.usuario, nombre=f'Finca {i}')
+        with self.assertNumQueries(consultas):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_formulario_de_analisis(self):
+        # Sesión, usuario y plantaciones
+        self._comprobar(reverse('core:deteccion_analizar'), 3)
+
+    def test_detalle_de_analisis(self):
+        # Sesión, usuario, resultado con su imagen y plantaciones
+        self._comprobar(reverse('core:detalle_analisis', args=[self.resultado.pk]), 4)
+
+    def test_carga_por_lotes(self):
+        # Sesión, usuario, plantaciones y últimos lotes
+        self._comprobar(reverse('core:deteccion_lote'), 4)
+
+
+class PoolEnElProceso(ThreadPoolExecutor):
+    """Sustituye al ProcessPoolExecutor de reanalizar para que los mocks sigan activos"""
+
+    def __init__(self, max_workers=None, mp_context=None):
+        super().__init__(max_workers=max_workers)
+
+
+class ReanalizarTests(TestCase):
+
+    def setUp(self):
+        carpeta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, carpeta, ignore_errors=True)
+        self.checkpoint = os.path.join(carpeta, 'checkpoint.json')
+        self.imagenes = crear_analisis(crear_plantacion(User.objects.create_user('historial', password='x')), 5)
+        ResultadoAnalisis.objects.update(version_modelo='anterior')
+        self.defectuosas = {self.imagenes[1].imagen.name}
+
+        def preprocesar(ruta):
+            if any(ruta.endswith(nombre) for nombre in self.defectuosas):
+                raise ValueError("imagen dañada")
+            return np.zeros((1, 128, 128, 3), dtype=np.float32)
+
+        def predecir(lote):
+            return np.tile(np.eye(len(diagnostic.class_mapping))[[0]], (len(lote), 1))
+
+        for parche in (
+            mock.patch.object(reanalizar, 'ProcessPoolExecutor', PoolEnElProceso),
+            mock.patch.object(reanalizar, 'preprocess_image_custom', side_effect=preprocesar),
+            mock.patch.object(reanalizar, 'predict_batch_custom', side_effect=predecir),
+            mock.patch.object(reanalizar.model_registry, 'version', return_value='nueva'),
+            mock.patch.object(reanalizar.model_registry, 'warm_up', return_value=True),
+        ):
+            parche.start()
+            self.addCleanup(parche.stop)
+
+    def _ejecutar(self):
+        salida = io.StringIO()
+        call_command('reanalizar', checkpoint=self.checkpoint, batch_size=2, workers=1, stdout=salida, stderr=io.StringIO())
+        with open(self.checkpoint) as archivo:
+            return json.load(archivo), salida.getvalue()
+
+    def _versiones(self):
+        return dict(ResultadoAnalisis.objects.values_list('imagen_id', 'version_modelo'))
+
+    def test_las_fallidas_no_se_dan_por_procesadas(self):
+        fallida = self.imagenes[1].pk
+        checkpoint, salida = self._ejecutar()
+        self.assertEqual(checkpoint['ultimo_id'], self.imagenes[-1].pk)
+        self.assertEqual(checkpoint['fallidas'], [fallida])
+        self.assertIn(str(fallida), salida)
+        self.assertEqual(
+            self._versiones(), {imagen.pk: 'anterior' if imagen.pk == fallida else 'nueva' for imagen in self.imagenes}
+        )
+
+        # Sigue fallando: continúa anotada
+        checkpoint, _ = self._ejecutar()
+        self.assertEqual(checkpoint['fallidas'], [fallida])
+
+        # Se reintenta aunque esté por debajo del checkpoint
+        self.defectuosas = set()
+        checkpoint, _ = self._ejecutar()
+        self.assertEqual(checkpoint['fallidas'], [])
+        self.assertEqual(set(self._versiones().values()), {'nueva'})
+
+
+class PreprocesadoTests(SimpleTestCase):
+
+    def test_reduccion_igual_que_keras_load_img(self):
+        hoja = cv2.GaussianBlur(np.random.default_rng(0).integers(0, 256, (600, 800, 3), dtype=np.uint8), (0, 0), 3)
+        with tempfile.NamedTemporaryFile(suffix='.png') as archivo:
+            cv2.imwrite(archivo.name, hoja)
+            # load_img(target_size=...) de Keras: PIL con vecino más cercano
+            esperado = np.asarray(Image.open(archivo.name).convert('RGB').resize((128, 128), Image.NEAREST))
+            obtenido = diagnostic.preprocess_image_custom(archivo.name)
+        self.assertEqual(obtenido.shape, (1, 128, 128, 3))
+        np.testing.assert_array_equal(np.rint(obtenido[0] * 255).astype(np.uint8), esperado)
+
+    def _jpeg(self, imagen, orientacion):
+        exif = Image.Exif()
+        exif[0x0112] = orientacion
+        salida = io.BytesIO()
+        Image.fromarray(imagen).save(salida, 'JPEG', quality=95, exif=exif.tobytes())
+        return salida.getvalue()
+
+    def test_orientacion_exif(self):
+        # Se decodifica sin girar (como load_img) y orientar() da lo que muestra OpenCV al aplicarla
+        imagen = np.random.default_rng(0).integers(0, 256, (20, 30, 3), dtype=np.uint8)
+        for orientacion in range(1, 9):
+            with self.subTest(orientacion=orientacion):
+                datos = self._jpeg(imagen, orientacion)
+                decodificada = diagnostic.decode_image_bytes(datos)
+                self.assertEqual(decodificada.shape, (20, 30, 3))
+                self.assertEqual(diagnostic.orientacion_exif(datos), orientacion)
+                girada = cv2.imdecode(np.frombuffer(datos, dtype=np.uint8), cv2.IMREAD_COLOR)
+                np.testing.assert_array_equal(diagnostic.orientar(decodificada, orientacion), girada)
+        self.assertEqual(diagnostic.orientacion_exif(b'no es una imagen'), 1)
+
+    def test_clasifica_sin_girar_y_segmenta_girada(self):
+        hoja = cv2.GaussianBlur(np.random.default_rng(1).integers(0, 256, (200, 300, 3), dtype=np.uint8), (0, 0), 3)
+        datos = self._jpeg(hoja, 6)
+        clasificadas, segmentadas = [], []
+
+        def segmentar(image, **kwargs):
+            segmentadas.append(image.shape)
+            return {clave: f'hoja_{clave}.jpg' for clave in ('contorno', 'overlay', 'damage')}
+
+        with (
+            override_settings(INFERENCIA_BATCHING=False),
+            mock.patch.object(
+                diagnostic.model_registry, 'predictor',
+                return_value=lambda lote: clasificadas.append(lote) or np.eye(6, dtype=np.float32)[[1]],
+            ),
+            mock.patch.object(analisis, 'segment_and_save', side_effect=segmentar),
+        ):
+            analisis.ejecutar_analisis(
+                diagnostic.decode_image_bytes(datos), 'hoja.jpg', orientacion=diagnostic.orientacion_exif(datos),
+            )
+        # El tensor es el de load_img de Keras: la foto tal como está guardada
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as archivo:
+            archivo.write(datos)
+            archivo.flush()
+            esperado = np.asarray(Image.open(archivo.name).convert('RGB').resize((128, 128), Image.NEAREST))
+        np.testing.assert_array_equal(np.rint(clasificadas[0][0] * 255).astype(np.uint8), esperado)
+        self.assertEqual(segmentadas, [(300, 200, 3)])
+
+
+class ExplotaAlLeer(io.RawIOBase):
+    """wsgi.input que falla si la vista intenta leer el cuerpo"""
+
+    def read(self, *args):
+        raise AssertionError("Se leyó el cuerpo de una subida que debía rechazarse antes")
+
+
+@override_settings(SUBIDA_MAX_BYTES=100 * 1024, SUBIDA_MEMORIA_BYTES=32 * 1024)
+class SubidaImagenTests(TestCase):
+    """ImagenUploadHandler: firma, límites de tamaño y archivo resultante"""
+
+    def _png(self, tamano):
+        return b'\x89PNG\r\n\x1a\n' + np.random.default_rng(0).bytes(tamano - 8)
+
+    def _recibir(self, datos, bloque=8 * 1024, content_length=None):
+        # Lo que hace MultiPartParser con un archivo: new_file, bloques y file_complete
+        request = RequestFactory().post('/')
+        manejador = subidas.ImagenUploadHandler(request)
+        try:
+            manejador.new_file('imagen', 'foto del cliente.png', 'image/png', content_length)
+        except StopFutureHandlers:
+            pass
+        for inicio in range(0, len(datos), bloque):
+            manejador.receive_data_chunk(datos[inicio:inicio + bloque], inicio)
+        return manejador.file_complete(len(datos)), request
+
+    def _subir(self, nombre, datos):
+        archivo = io.BytesIO(datos)
+        archivo.name = nombre
+        return self.client.post(
+            reverse('core:deteccion_analizar'), {'imagen': archivo}, HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+
+    def test_rechaza_lo_que_no_es_imagen(self):
+        respuesta = self._subir('hoja.jpg', b'GIF89a' + b'\x00' * 2048)
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(respuesta.json()['error'], subidas.MENSAJE_FORMATO)
+
+    def test_content_length_excesivo_se_rechaza_sin_leer_el_cuerpo(self):
+        respuesta = self.client.post(
+            reverse('core:deteccion_analizar'), content_type='multipart/form-data; boundary=limite',
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+            CONTENT_LENGTH=str(100 * 1024 + subidas.MARGEN_FORMULARIO + 1), **{'wsgi.input': ExplotaAlLeer()},
+        )
+        self.assertEqual(respuesta.status_code, 413)
+        self.assertEqual(respuesta.json()['error'], subidas.mensaje_tamano())
+
+    def test_excede_el_limite_mientras_llega(self):
+        # Sin Content-Length del archivo: se descarta en el bloque que cruza el límite
+        datos = self._png(100 * 1024 + 1)
+        request = RequestFactory().post('/')
+        manejador = subidas.ImagenUploadHandler(request)
+        with self.assertRaises(StopFutureHandlers):
+            manejador.new_file('imagen', 'hoja.png', 'image/png', None)
+        bloques = [datos[inicio:inicio + 8 * 1024] for inicio in range(0, len(datos), 8 * 1024)]
+        for inicio, bloque in enumerate(bloques[:-1]):
+            manejador.receive_data_chunk(bloque, inicio * 8 * 1024)
+        with self.assertRaises(SkipFile):
+            manejador.receive_data_chunk(bloques[-1], len(datos) - len(bloques[-1]))
+        self.assertEqual(request.subida_rechazada, (413, subidas.mensaje_tamano()))
+
+        # Por la vista, el cuerpo completo cabe en el margen del Content-Length pero el archivo no
+        respuesta = self._subir('hoja.png', datos)
+        self.assertEqual(respuesta.status_code, 413)
+
+    def test_en_memoria_hasta_el_umbral_y_temporal_por_encima(self):
+        for tamano, clase in ((32 * 1024, InMemoryUploadedFile), (80 * 1024, TemporaryUploadedFile)):
+            with self.subTest(tamano=tamano):
+                datos = self._png(tamano)
+                archivo, request = self._recibir(datos)
+                self.assertIsInstance(archivo, clase)
+                self.assertEqual(archivo.size, tamano)
+                self.assertEqual(archivo.read(), datos)
+                self.assertFalse(hasattr(request, 'subida_rechazada'))
+                archivo.close()
+
+    def test_nombre_unico_y_hash_al_vuelo(self):
+        datos = self._png(50 * 1024)
+        archivo, _ = self._recibir(datos, bloque=3000)
+        self.assertRegex(archivo.name, r'^[0-9a-f]{32}\.png$')
+        self.assertEqual(archivo.content_type, 'image/png')
+        self.assertEqual(archivo.hash_contenido, hashlib.sha256(datos).hexdigest())
+        archivo.close()
+
+
+def resultado_analisis(uid='prueba', diagnostico='Banana Black Sigatoka Disease'):
+    """Resultado de ejecutar_analisis con los campos que se persisten"""
+    return {
+        'diagnostico': diagnostico,
+        'probabilidad': 91.5,
+        'recomendaciones': 'Aplicar fungicida.',
+        'version_modelo': 'modelo@1',
+        'metricas': {'area_lesion_pct': 2.5, 'num_lesiones': 3, 'histograma_lesiones': [0, 1, 2, 0, 0, 0]},
+        'archivos': {
+            'original': f'resultados/original_{uid}.jpg',
+            'contorno': f'resultados/{uid}_contour.jpg',
+            'overlay': f'resultados/{uid}_overlay.jpg',
+            'damage': f'resultados/{uid}_damage.jpg',
+        },
+    }
+
+
+class PersistenciaAnalisisTests(TestCase):
+
+    def setUp(self):
+        self.plantacion = crear_plantacion(User.objects.create_user('persistencia', password='x'))
+
+    def test_guardar_analisis(self):
+        with self.captureOnCommitCallbacks() as difusiones:
+            resultado = guardar_analisis(self.plantacion.pk, resultado_analisis())
+        resultado.refresh_from_db()
+        self.assertEqual(resultado.imagen.plantacion_id, self.plantacion.pk)
+        self.assertEqual(resultado.imagen.overlay.name, 'resultados/prueba_overlay.jpg')
+        self.assertEqual((resultado.area_lesion_pct, resultado.num_lesiones), (2.5, 3))
+        # Una enfermedad programa la difusión de la alerta al confirmar la transacción
+        self.assertEqual(len(difusiones), 1)
+
+    def test_diagnostico_sano_no_programa_alertas(self):
+        with self.captureOnCommitCallbacks() as difusiones:
+            guardar_analisis(self.plantacion.pk, resultado_analisis(diagnostico='Banana Healthy Leaf'))
+        self.assertEqual(difusiones, [])
+
+    def test_guardar_analisis_bulk_un_insert_por_tabla(self):
+        items = [(self.plantacion.pk, resultado_analisis(uid=f'lote{i}')) for i in range(20)]
+        with CaptureQueriesContext(connection) as consultas:
+            resultados = guardar_analisis_bulk(items)
+        inserts = [consulta['sql'] for consulta in consultas.captured_queries if consulta['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 2)
+        self.assertEqual(len(resultados), 20)
+        self.assertEqual(ResultadoAnalisis.objects.filter(imagen__plantacion=self.plantacion).count(), 20)
+
+
+class CacheAnalisisTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        configuracion = override_settings(MEDIA_ROOT=media)
+        configuracion.enable()
+        self.addCleanup(configuracion.disable)
+        parche = mock.patch.object(cache_analisis, 'version_actual', return_value='modelo@1+umbral')
+        self.version = parche.start()
+        self.addCleanup(parche.stop)
+
+        self.resultado = resultado_analisis()
+        self.archivos = list(self.resultado['archivos'].values())
+        for nombre in self.archivos:
+            with open(os.path.join(ruta_resultados(), os.path.basename(nombre)), 'wb') as archivo:
+                archivo.write(b'\xff\xd8\xff')
+        self.hash = cache_analisis.hash_contenido(b'hoja')
+        cache_analisis.guardar(self.hash, self.resultado, self.archivos)
+
+    def test_acierto(self):
+        self.assertEqual(cache_analisis.obtener(self.hash), self.resultado)
+        self.assertEqual(CacheAnalisis.objects.get().aciertos, 1)
+
+    def test_otra_version_del_modelo(self):
+        self.version.return_value = 'modelo@2+umbral'
+        self.assertIsNone(cache_analisis.obtener(self.hash))
+
+    def test_artefacto_borrado_invalida_la_entrada(self):
+        os.remove(os.path.join(ruta_resultados(), 'prueba_overlay.jpg'))
+        self.assertIsNone(cache_analisis.obtener(self.hash))
+        self.assertFalse(CacheAnalisis.objects.exists())
+
+    def test_evictar_conserva_los_archivos_del_historial(self):
+        guardar_analisis(crear_plantacion(User.objects.create_user('cache', password='x')).pk, self.resultado)
+        self.assertEqual(cache_analisis.evictar(limite_bytes=0), 1)
+        self.assertFalse(CacheAnalisis.objects.exists())
+        self.assertTrue(os.path.exists(os.path.join(ruta_resultados(), 'prueba_overlay.jpg')))
+
+
+class EstadoTrabajoTests(TestCase):
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('trabajos', password='x')
+        self.trabajo = TrabajoAnalisis.objects.create(
+            usuario=self.usuario, imagen_original='original_prueba.jpg',
+            estado=TrabajoAnalisis.Estado.COMPLETADO, resultado=resultado_analisis(),
+        )
+        self.url = reverse('core:deteccion_trabajo_estado', args=[self.trabajo.pk])
+
+    def test_duenio_consulta_el_estado(self):
+        self.client.force_login(self.usuario)
+        datos = self.client.get(self.url).json()
+        self.assertEqual(datos['estado'], 'completado')
+        self.assertEqual(datos['probabilidad'], 91.5)
+        self.assertIn(f'trabajo={self.trabajo.pk}', datos['resultado_url'])
+
+    def test_otro_usuario_no_lo_ve(self):
+        self.client.force_login(User.objects.create_user('ajeno', password='x'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+def crear_registro(plantacion, fecha, temperatura, **valores):
+    return RegistroCampo.objects.create(
+        plantacion=plantacion, fecha_registro=fecha, temperatura=Decimal(str(temperatura)),
+        humedad=valores.get('humedad', 80), precipitacion=valores.get('precipitacion', 5),
+        ph_suelo=6, humedad_suelo=40, nitrogeno=20,
+    )
+
+
+def crear_registros(plantacion, cantidad=40):
+    """Un registro cada tres días desde el 1 de enero de 2026"""
+    return [
+        crear_registro(plantacion, date(2026, 1, 1) + timedelta(days=i * 3), 20 + i % 7, precipitacion=i % 4)
+        for i in range(cantidad)
+    ]
+
+
+class EstadisticasPlantacionTests(TestCase):
+    """Estadísticas mantenidas por señales frente a reconstruirlas desde cero"""
+
+    def setUp(self):
+        self.plantacion = crear_plantacion(User.objects.create_user('campo', password='x'))
+        self.registros = crear_registros(self.plantacion)
+
+    def _estadistica(self):
+        return EstadisticaPlantacion.objects.filter(pk=self.plantacion.pk).values(
+            'total_registros', 'suma_temperatura', 'ultimo_registro_id', 'ultima_fecha',
+        ).get()
+
+    def _comprobar_contra_recalculo(self):
+        estadistica = self._estadistica()
+        estadisticas.recalcular([self.plantacion.pk])
+        self.assertEqual(estadistica, self._estadistica())
+
+    def test_altas(self):
+        self.assertEqual(self._estadistica()['total_registros'], 40)
+        self.assertEqual(self._estadistica()['ultimo_registro_id'], self.registros[-1].pk)
+        self._comprobar_contra_recalculo()
+
+    def test_cambio_de_fecha(self):
+        registro = self.registros[0]
+        registro.fecha_registro = date(2026, 6, 15)
+        registro.temperatura = Decimal('35.0')
+        registro.save()
+        self.assertEqual(self._estadistica()['ultimo_registro_id'], registro.pk)
+        self._comprobar_contra_recalculo()
+
+    def test_bajas(self):
+        self.registros[-1].delete()
+        self.registros[5].delete()
+        self.assertEqual(self._estadistica()['ultimo_registro_id'], self.registros[-2].pk)
+        self._comprobar_contra_recalculo()
+
+    def test_baja_con_estadistica_desincronizada(self):
+        # Como tras un update() masivo: el contador ya está en 0 y restar violaría el CHECK
+        EstadisticaPlantacion.objects.filter(pk=self.plantacion.pk).update(total_registros=0)
+        self.registros[3].delete()
+        self.assertEqual(self._estadistica()['total_registros'], 39)
+        self._comprobar_contra_recalculo()
+
+    def test_baja_al_eliminar_la_plantacion(self):
+        self.plantacion.delete()
+        self.assertFalse(EstadisticaPlantacion.objects.exists())
+
+
+class ResumenesRegistroCampoTests(TestCase):
+    """Resúmenes por semana y mes mantenidos por señales, y la API de series"""
+
+    def setUp(self):
+        self.plantacion = crear_plantacion(User.objects.create_user('campo', password='x'))
+        self.registros = crear_registros(self.plantacion)
+
+    def _resumenes(self):
+        return sorted(
+            ResumenRegistroCampo.objects.filter(plantacion=self.plantacion)
+            .values_list('periodo', 'inicio', 'cantidad', 'promedio_temperatura', 'temperatura_max', 'precipitacion_total')
+        )
+
+    def test_cambios_igual_que_recalcular(self):
+        # Mover un registro de periodo y eliminar otros solo toca sus semanas y meses
+        registro = self.registros[0]
+        registro.fecha_registro = date(2026, 6, 15)
+        registro.temperatura = Decimal('35.0')
+        registro.save()
+        self.registros[-1].delete()
+        self.registros[5].delete()
+        resumenes = self._resumenes()
+        estadisticas.recalcular_resumenes([self.plantacion.pk])
+        self.assertEqual(resumenes, self._resumenes())
+
+    def test_resumen_mensual(self):
+        enero = [r for r in self.registros if r.fecha_registro.month == 1]
+        resumen = ResumenRegistroCampo.objects.get(
+            plantacion=self.plantacion, periodo=ResumenRegistroCampo.Periodo.MES, inicio=date(2026, 1, 1),
+        )
+        self.assertEqual(resumen.cantidad, len(enero))
+        self.assertAlmostEqual(float(resumen.promedio_temperatura), sum(float(r.temperatura) for r in enero) / len(enero))
+        self.assertEqual(float(resumen.precipitacion_total), sum(float(r.precipitacion) for r in enero))
+
+    def test_series(self):
+        url = reverse('core:plantacion_series', args=[self.plantacion.pk])
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+        self.client.force_login(User.objects.create_user('vecino', password='x'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        self.client.force_login(self.plantacion.usuario)
+        for parametros in ({'desde': '2026-13-01'}, {'desde': '2026-03-01', 'hasta': '2026-01-01'},
+                           {'periodo': 'anio'}, {'variables': 'temperatura,viento'}):
+            with self.subTest(parametros=parametros):
+                self.assertEqual(self.client.get(url, parametros).status_code, 400)
+
+        datos = self.client.get(url, {'desde': '2026-01-01', 'hasta': '2026-04-30', 'variables': 'temperatura'}).json()
+        # 120 días caben en SERIES_MAX_PUNTOS: un punto por día con registros
+        self.assertEqual(datos['periodo'], 'dia')
+        self.assertEqual(sum(datos['cantidad']), 40)
+        self.assertEqual(list(datos['series']), ['temperatura'])
+
+        datos = self.client.get(url, {'desde': '2026-01-01', 'hasta': '2026-04-30', 'periodo': 'mes'}).json()
+        self.assertEqual(datos['fechas'], ['2026-01-01', '2026-02-01', '2026-03-01', '2026-04-01'])
+        self.assertEqual(sum(datos['cantidad']), 40)
+
+
+class MapaPlantacionesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        usuario = User.objects.create_user('mapa', password='x')
+        rng = np.random.default_rng(0)
+        for i, (latitud, longitud) in enumerate(zip(rng.uniform(-2.5, -1.5, 60), rng.uniform(-80.5, -79.5, 60))):
+            crear_plantacion(usuario, nombre=f'Finca {i}', latitud=round(latitud, 6), longitud=round(longitud, 6))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_grupos_suman_todas_las_plantaciones(self):
+        mapa = plantaciones_bbox(-3, -81, -1, -79, 6)
+        self.assertTrue(all(feature['properties']['grupo'] for feature in mapa['features']))
+        self.assertEqual(sum(feature['properties']['cantidad'] for feature in mapa['features']), 60)
+
+    def test_plantaciones_individuales_al_acercarse(self):
+        with self.settings(MAPA_ZOOM_DETALLE=8):
+            mapa = plantaciones_bbox(-3, -81, -1, -79, 9)
+        ids = [feature['properties']['id'] for feature in mapa['features']]
+        self.assertEqual(sorted(ids), sorted(Plantacion.objects.values_list('id', flat=True)))
+
+    def test_teselas_en_cache_hasta_que_cambia_una_plantacion(self):
+        plantaciones_bbox(-3, -81, -1, -79, 6)
+        with self.assertNumQueries(0):
+            plantaciones_bbox(-3, -81, -1, -79, 6)
+        crear_plantacion(User.objects.get(username='mapa'), nombre='Nueva', latitud=-2, longitud=-80)
+        mapa = plantaciones_bbox(-3, -81, -1, -79, 6)
+        self.assertEqual(sum(feature['properties']['cantidad'] for feature in mapa['features']), 61)
+
+
+class DifusionAlertasTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.productor = User.objects.create_user('brote', password='x')
+        self.origen = crear_plantacion(self.productor, latitud=-2.17, longitud=-79.92)
+        crear_plantacion(self.productor, nombre='Propia', latitud=-2.18, longitud=-79.92)
+        self.vecinos = [User.objects.create_user(f'vecino{i}', password='x') for i in range(3)]
+        # ~3 km y ~8 km (dos fincas del mismo productor), y ~110 km (fuera del radio)
+        crear_plantacion(self.vecinos[0], latitud=-2.19, longitud=-79.90)
+        crear_plantacion(self.vecinos[1], latitud=-2.24, longitud=-79.92)
+        crear_plantacion(self.vecinos[1], nombre='Finca B', latitud=-2.20, longitud=-79.93)
+        crear_plantacion(self.vecinos[2], latitud=-3.17, longitud=-79.92)
+
+    def test_una_alerta_por_productor_en_el_radio(self):
+        self.assertEqual(difundir_alerta(self.origen.pk, 'Banana Moko Disease', radio_km=15), 2)
+        alertas = dict(AlertaComunitaria.objects.values_list('usuario_destino__username', 'distancia'))
+        self.assertEqual(set(alertas), {'vecino0', 'vecino1'})
+        # La distancia es la de su plantación más cercana
+        self.assertLess(alertas['vecino1'], 5)
+
+    def test_no_repite_la_alerta_en_la_ventana(self):
+        difundir_alerta(self.origen.pk, 'Banana Moko Disease', radio_km=15)
+        self.assertEqual(difundir_alerta(self.origen.pk, 'Banana Moko Disease', radio_km=15), 0)
+        self.assertEqual(difundir_alerta(self.origen.pk, 'Banana Panama Disease', radio_km=15), 2)
+
+    def test_brote_vecino_en_otra_celda_no_repite(self):
+        # ~4 km del origen pero en la celda de la rejilla de al lado
+        vecina = crear_plantacion(User.objects.create_user('brote2', password='x'), latitud=-2.21, longitud=-79.92)
+        self.assertNotEqual(vecina.celda_geo, self.origen.celda_geo)
+        self.assertEqual(difundir_alerta(self.origen.pk, 'Banana Moko Disease', radio_km=15), 3)
+        # Solo falta por avisar el productor del primer brote
+        self.assertEqual(difundir_alerta(vecina.pk, 'Banana Moko Disease', radio_km=15), 1)
+        self.assertEqual(
+            AlertaComunitaria.objects.filter(usuario_destino__username__in=['vecino0', 'vecino1']).count(), 2,
+        )
+
+
+class BenchmarkDeteccionTests(TestCase):
+    """El harness completo con el modelo sustituto generado (unos segundos)"""
+
+    def test_informe_y_comparacion(self):
+        carpeta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, carpeta, ignore_errors=True)
+        ruta = os.path.join(carpeta, 'benchmark.json')
+        ruta_modelo = diagnostic.model_registry.ruta(diagnostic.MODEL_CUSTOM)
+
+        call_command(
+            'benchmark_deteccion', tamanos=['320x240'], batches=[1, 2], iteraciones=2, calentamiento=0,
+            salida=ruta, stdout=io.StringIO(),
+        )
+        with open(ruta) as archivo:
+            informe = json.load(archivo)
+        etapas = {resultado['etapa'] for resultado in informe['resultados']}
+        self.assertTrue({'decodificacion', 'preprocesado', 'prediccion', 'segmentacion_umbral', 'inferencia_lote'} <= etapas)
+        for resultado in informe['resultados']:
+            self.assertLessEqual(resultado['p50_ms'], resultado['p95_ms'])
+            self.assertGreater(resultado['rss_pico_mb'], 0)
+        # El modelo desplegado vuelve a quedar registrado
+        self.assertEqual(diagnostic.model_registry.ruta(diagnostic.MODEL_CUSTOM), ruta_modelo)
+
+        # Una ejecución anterior 1000 veces más rápida se informa como regresión
+        for resultado in informe['resultados']:
+            resultado['p50_ms'] /= 1000
+        with open(ruta, 'w') as archivo:
+            json.dump(informe, archivo)
+        salida = io.StringIO()
+        call_command(
+            'benchmark_deteccion', tamanos=['320x240'], batches=[1], iteraciones=2, calentamiento=0,
+            comparar=ruta, stdout=salida,
+        )
+        self.assertIn('Regresión', salida.getvalue())
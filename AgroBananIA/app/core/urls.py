@@ -1,17 +1,26 @@
 from django.urls import path
 from django.conf import settings
 from django.conf.urls.static import static
-from app.core.views import HomeView, DashboardView
-from app.core.view.Modulo_deteccion_Enfermedades.Deteccion_enfermedad_view import DeteccionListView,analizar_imagen
+from app.core.views import HomeView, DashboardView, mapa_plantaciones, series_plantacion, metricas_prometheus
+from app.core.view.Modulo_deteccion_Enfermedades.Deteccion_enfermedad_view import DeteccionListView,DeteccionDetalleView,analizar_imagen,estado_trabajo,artefacto_segmentacion
+from app.core.view.Modulo_deteccion_Enfermedades.Lote_analisis_view import LoteAnalisisView, LoteAnalisisDetalleView
 from app.core.view.Modulo_Alerta_Comunitaria.Alerta_comunitaria_view import AlertaComunitariaView
 app_name = 'core'
 
 urlpatterns = [
     path('', HomeView.as_view(), name='home'),
     path('dashboard/', DashboardView.as_view(), name='dashboard'),
+    path('dashboard/mapa/', mapa_plantaciones, name='dashboard_mapa'),
+    path('plantaciones/<int:plantacion_id>/series/', series_plantacion, name='plantacion_series'),
     path('deteccion/', DeteccionListView.as_view(), name='deteccion_list'),
+    path('deteccion/<int:pk>/', DeteccionDetalleView.as_view(), name='detalle_analisis'),
     path('deteccion/analizar/', analizar_imagen, name='deteccion_analizar'),
+    path('deteccion/trabajos/<uuid:trabajo_id>/', estado_trabajo, name='deteccion_trabajo_estado'),
+    path('deteccion/artefactos/<str:nombre>', artefacto_segmentacion, name='deteccion_artefacto'),
+    path('deteccion/lote/', LoteAnalisisView.as_view(), name='deteccion_lote'),
+    path('deteccion/lote/<uuid:lote_id>/', LoteAnalisisDetalleView.as_view(), name='deteccion_lote_detalle'),
     path('alertas/', AlertaComunitariaView.as_view(), name='alertas'),
+    path('metrics', metricas_prometheus, name='metricas'),
 ]
 
 if settings.DEBUG:
@@ -1,8 +1,30 @@
-from django.shortcuts import render
+from django.shortcuts import render, redirect
 from django.views import View
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.utils.http import urlencode
+from app.core.alertas import pagina_alertas, contar_no_leidas, marcar_leidas
 
 
 
-class AlertaComunitariaView(View):
+class AlertaComunitariaView(LoginRequiredMixin, View):
+    """Bandeja de alertas recibidas, paginada por cursor (?cursor=...)"""
+    template_name = 'core/Dashboard/Modulo Alertas Comunitaria/alert_list.html'
+
     def get(self, request):
-        return render(request, 'core/Dashboard/Modulo Alertas Comunitaria/alert_list.html')
+        cursor = request.GET.get('cursor')
+        alertas, siguiente = pagina_alertas(request.user.pk, cursor)
+        return render(request, self.template_name, {
+            'alertas': alertas,
+            'cursor_siguiente': siguiente,
+            'es_primera_pagina': not cursor,
+            'no_leidas': contar_no_leidas(request.user.pk),
+        })
+
+    def post(self, request):
+        """Marca como leídas las alertas seleccionadas (o todas)"""
+        ids = None if request.POST.get('todas') else [
+            int(pk) for pk in request.POST.getlist('alerta') if pk.isdigit()
+        ]
+        marcar_leidas(request.user.pk, ids)
+        cursor = request.POST.get('cursor')
+        return redirect(f"{request.path}?{urlencode({'cursor': cursor})}" if cursor else request.path)
@@ -1,155 +1,353 @@
-from django.shortcuts import render
-from django.views.generic import ListView
+from datetime import datetime, timedelta
+from django.shortcuts import render, redirect, get_object_or_404
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import JsonResponse, Http404, FileResponse
+from django.utils.cache import patch_cache_control
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.http import urlencode
 from django.conf import settings
 from django.contrib import messages
-from app.core.models import ResultadoAnalisis
-from AgroBananIA.utils.diagnostic import (
-    predict_with_custom,
-    obtener_nombre_enfermedad_custom,
-    obtener_recomendaciones_custom,
-    segment_and_save
-)
+from django.core.exceptions import ValidationError
+from app.core.models import ImagenAnalisis, ResultadoAnalisis, TrabajoAnalisis, Plantacion
+from app.core.analisis import guardar_original, ejecutar_analisis, guardar_analisis, obtener_artefacto, artefacto_de_usuario, resultado_registrado
+from app.core.paginacion import pagina_keyset
+from app.core.tasks import encolar_analisis
+from app.core import cache_analisis
+from app.core.subidas import ImagenUploadHandler, excede_limite, mensaje_tamano
+from AgroBananIA.utils.diagnostic import decode_image_bytes, orientacion_exif, class_mapping
+from AgroBananIA.utils.metricas import medir, traza
 import os
-import shutil
 import logging
-import numpy as np
+import mimetypes
 
 
 logger = logging.getLogger(__name__)
 
 
 
-class DeteccionListView(ListView):
-    """Vista principal para el listado del módulo de detección"""
-    model = ResultadoAnalisis
+def _filtros_deteccion(request):
+    """Filtros válidos de ?enfermedad=&plantacion=&desde=&hasta= (los valores inválidos se ignoran)"""
+    filtros = {}
+    enfermedad = request.GET.get('enfermedad')
+    if enfermedad in class_mapping.values():
+        filtros['enfermedad'] = enfermedad
+    plantacion = request.GET.get('plantacion', '')
+    if plantacion.isdigit():
+        filtros['plantacion'] = int(plantacion)
+    for campo in ('desde', 'hasta'):
+        try:
+            fecha = parse_date(request.GET.get(campo) or '')
+        except ValueError:
+            fecha = None
+        if fecha:
+            filtros[campo] = fecha
+    return filtros
+
+
+def _inicio_del_dia(fecha):
+    return timezone.make_aware(datetime.combine(fecha, datetime.min.time()))
+
+
+class DeteccionListView(LoginRequiredMixin, View):
+    """
+    Listado de análisis del usuario, paginado por cursor (?cursor=...) y filtrable
+    por enfermedad, plantación y rango de fechas. Se recorre ImagenAnalisis en el
+    orden de envío (fecha_envio, id) con una sola consulta por página, con el
+    resultado y la plantación en el mismo JOIN: el número de consultas no depende
+    de cuántas plantaciones tenga el usuario.
+    """
     template_name = 'core/Dashboard/Modulo Deteccion Enfermedades/deteccion_list.html'
-    context_object_name = 'detecciones'
 
-    def get_queryset(self):
-        return ResultadoAnalisis.objects.filter(imagen__plantacion__usuario=self.request.user)
-    
-    
+    def get_queryset(self, filtros):
+        imagenes = ImagenAnalisis.objects.filter(resultado__isnull=False).select_related('resultado', 'plantacion').only(
+            'id', 'fecha_envio', 'plantacion_id', 'plantacion__nombre_finca',
+            'resultado__id', 'resultado__imagen_id', 'resultado__enfermedad_detectada',
+            'resultado__probabilidad', 'resultado__fecha_analisis',
+        )
+        if 'enfermedad' in filtros:
+            imagenes = imagenes.filter(resultado__enfermedad_detectada=filtros['enfermedad'])
+        # Rangos sobre la columna (no __date) para que se use el índice
+        if 'desde' in filtros:
+            imagenes = imagenes.filter(fecha_envio__gte=_inicio_del_dia(filtros['desde']))
+        if 'hasta' in filtros:
+            imagenes = imagenes.filter(fecha_envio__lt=_inicio_del_dia(filtros['hasta'] + timedelta(days=1)))
+        return imagenes
+
+    def get(self, request):
+        filtros = _filtros_deteccion(request)
+        cursor = request.GET.get('cursor')
+        # Plantacion.objects y no request.user.plantaciones: el related manager vuelve a
+        # leer usuario_id (diferido por only) en cada fila
+        plantaciones = list(
+            Plantacion.objects.filter(usuario=request.user).only('id', 'nombre_finca').order_by('nombre_finca')
+        )
+
+        imagenes = self.get_queryset(filtros).filter(plantacion__usuario=request.user)
+        if 'plantacion' in filtros:
+            imagenes = imagenes.filter(plantacion_id=filtros['plantacion'])
+        pagina, siguiente = pagina_keyset(
+            imagenes, 'fecha_envio', cursor, getattr(settings, 'DETECCIONES_POR_PAGINA', 12),
+        )
+
+        # Los enlaces de paginación conservan los filtros
+        parametros = {campo: valor.isoformat() if hasattr(valor, 'isoformat') else valor for campo, valor in filtros.items()}
+        return render(request, self.template_name, {
+            # select_related deja imagen.resultado.imagen enlazado: la plantilla no hace más consultas
+            'detecciones': [imagen.resultado for imagen in pagina],
+            # El total solo se cuenta al entrar al listado, no en cada página
+            'total': None if cursor else imagenes.count(),
+            'es_primera_pagina': not cursor,
+            'url_primera': f"?{urlencode(parametros)}",
+            'url_siguiente': f"?{urlencode({**parametros, 'cursor': siguiente})}" if siguiente else None,
+            'filtros': parametros,
+            'enfermedades': list(class_mapping.values()),
+            'plantaciones': plantaciones,
+        })
+
+
+class DeteccionDetalleView(LoginRequiredMixin, View):
+    """Resultado guardado de un análisis, con la misma presentación que al analizarlo"""
+    template_name = 'core/Dashboard/Modulo Deteccion Enfermedades/deteccion_form.html'
+
+    def get(self, request, pk):
+        resultado_analisis = get_object_or_404(
+            ResultadoAnalisis.objects.select_related('imagen'),
+            pk=pk, imagen__plantacion__usuario=request.user,
+        )
+        contexto = resultado_registrado(resultado_analisis)
+        contexto['plantaciones'] = Plantacion.objects.filter(usuario=request.user).only('id', 'nombre_finca')
+        return render(request, self.template_name, contexto)
+
+
 # --------------------- FUNCIÓN DE ANÁLISIS ---------------------
 
+def _es_ajax(request):
+    return request.headers.get('x-requested-with') == 'XMLHttpRequest'
+
+
+def _obtener_trabajo(request, trabajo_id):
+    try:
+        trabajo = TrabajoAnalisis.objects.get(pk=trabajo_id)
+    except (TrabajoAnalisis.DoesNotExist, ValidationError):
+        raise Http404
+    # Un trabajo con dueño solo lo puede consultar ese usuario
+    if trabajo.usuario_id and trabajo.usuario_id != request.user.id:
+        raise Http404
+    return trabajo
+
+
+# Artefactos de los últimos resultados mostrados en la sesión: un análisis sin
+# plantación (o de un visitante sin cuenta) no queda en ImagenAnalisis y sus
+# imágenes se autorizan por aquí
+CLAVE_ARTEFACTOS_SESION = 'artefactos_permitidos'
+MAX_ARTEFACTOS_SESION = 60
+
+
+def _permitir_artefactos(request, resultado):
+    archivos = resultado.get('archivos') or {}
+    nombres = [os.path.basename(archivos[clave]) for clave in ('contorno', 'overlay', 'damage') if archivos.get(clave)]
+    if not nombres:
+        return
+    permitidos = [nombre for nombre in request.session.get(CLAVE_ARTEFACTOS_SESION, []) if nombre not in nombres]
+    request.session[CLAVE_ARTEFACTOS_SESION] = (permitidos + nombres)[-MAX_ARTEFACTOS_SESION:]
+
+
+def _obtener_plantacion_id(request):
+    """Plantación elegida en el formulario (solo las del usuario autenticado)"""
+    plantacion_id = request.POST.get('plantacion')
+    if not plantacion_id or not request.user.is_authenticated:
+        return None
+    return (
+        Plantacion.objects.filter(pk=plantacion_id, usuario=request.user)
+        .values_list('pk', flat=True)
+        .first()
+    )
+
+
+@csrf_exempt
+@traza('analizar_imagen')
 def analizar_imagen(request):
+    """
+    Instala ImagenUploadHandler antes de que se lea el cuerpo de la petición; por eso
+    la comprobación CSRF no la hace el middleware sino _analizar_imagen.
+    """
+    if request.method == 'POST':
+        # El Content-Length ya supera el límite: se rechaza sin leer el cuerpo
+        if excede_limite(request):
+            if _es_ajax(request):
+                return JsonResponse({'error': mensaje_tamano()}, status=413)
+            messages.error(request, mensaje_tamano())
+            return redirect('core:deteccion_analizar')
+        request.upload_handlers = [ImagenUploadHandler(request)]
+        # request.FILES procesa el cuerpo multipart en streaming: es la etapa de subida
+        with medir('subida'):
+            request.FILES
+    return _analizar_imagen(request)
+
 
-    diagnostico = None
-    diagnostico_numero = None
-    imagenes_procesadas = []
-    imagen_original = None
-    recomendaciones = ""
-    probabilidad = None
+@csrf_protect
+def _analizar_imagen(request):
 
-    if request.method == 'POST' and request.FILES.get('imagen'):
-        imagen = request.FILES['imagen']
+    contexto = {
+        'diagnostico': None,
+        'diagnostico_numero': None,
+        'imagenes': [],
+        'imagen_original': None,
+        'recomendaciones': "",
+        'probabilidad': None,
+        'metricas': None,
+        'teselas': None,
+        'plantaciones': (
+            Plantacion.objects.filter(usuario=request.user).only('id', 'nombre_finca')
+            if request.user.is_authenticated else []
+        ),
+    }
+
+    # Resultado de un trabajo asíncrono (la página redirige aquí al terminar el polling)
+    trabajo_id = request.GET.get('trabajo')
+    if request.method == 'GET' and trabajo_id:
+        trabajo = _obtener_trabajo(request, trabajo_id)
+        if trabajo.estado == TrabajoAnalisis.Estado.COMPLETADO:
+            contexto.update(trabajo.resultado)
+            _permitir_artefactos(request, trabajo.resultado)
+        elif trabajo.estado == TrabajoAnalisis.Estado.ERROR:
+            messages.error(request, f"❌ Ocurrió un error durante el análisis: {trabajo.error}")
+
+    # Archivo descartado por ImagenUploadHandler (no es una imagen o excede el tamaño)
+    rechazo = getattr(request, 'subida_rechazada', None)
+    if request.method == 'POST' and rechazo is not None:
+        estado, mensaje = rechazo
+        if _es_ajax(request):
+            return JsonResponse({'error': mensaje}, status=estado)
+        messages.error(request, mensaje)
+        return render(request, 'core/Dashboard/Modulo Deteccion Enfermedades/deteccion_form.html', contexto, status=estado)
+
+    imagen = request.FILES.get('imagen') if request.method == 'POST' else None
+    if imagen is not None:
+        # Nombre único asignado por ImagenUploadHandler (no el del cliente)
         nombre_archivo = imagen.name
-        
-        # Crear rutas de almacenamiento
-        carpeta_temp = os.path.join(settings.MEDIA_ROOT, 'temp')
-        carpeta_resultados = os.path.join(settings.MEDIA_ROOT, 'resultados')
-        os.makedirs(carpeta_temp, exist_ok=True)
-        os.makedirs(carpeta_resultados, exist_ok=True)
-        
-        ruta_temp = os.path.join(carpeta_temp, nombre_archivo)
-
-        # Guardar imagen temporal
+        plantacion_id = _obtener_plantacion_id(request)
+
+        # Leer la imagen una sola vez: los bytes se decodifican en memoria y el
+        # mismo array alimenta la clasificación y (girado según el EXIF) la segmentación
         try:
-            with open(ruta_temp, 'wb+') as destino:
-                for chunk in imagen.chunks():
-                    destino.write(chunk)
-            logger.info(f"Imagen guardada temporalmente: {ruta_temp}")
+            datos_imagen = imagen.read()
+            imagen_bgr = decode_image_bytes(datos_imagen)
+            orientacion = orientacion_exif(datos_imagen)
         except Exception as e:
-            logger.error(f"Error al guardar imagen temporal: {e}")
-            messages.error(request, "No se pudo guardar la imagen. Intente nuevamente.")
-            return render(request, 'core/Dashboard/Modulo Deteccion/deteccion_form.html', {
-                'diagnostico': diagnostico,
-                'imagenes': imagenes_procesadas,
-                'imagen_original': imagen_original,
-                'recomendaciones': recomendaciones,
-                'probabilidad': probabilidad
-            })
-
-        # Copiar imagen original a resultados
-        nombre_original = f"original_{nombre_archivo}"
-        ruta_original_resultado = os.path.join(carpeta_resultados, nombre_original)
-        
+            logger.error(f"Error al leer la imagen subida: {e}")
+            if _es_ajax(request):
+                return JsonResponse({'error': "No se pudo leer la imagen. Verifique que sea un JPG o PNG válido."}, status=400)
+            messages.error(request, "No se pudo leer la imagen. Verifique que sea un JPG o PNG válido.")
+            return render(request, 'core/Dashboard/Modulo Deteccion Enfermedades/deteccion_form.html', contexto)
+
+        # Imagen ya analizada con la versión actual del modelo: se devuelve el resultado
+        # guardado sin volver a predecir, segmentar ni escribir archivos
+        # El handler ya calculó el hash mientras recibía el archivo
+        hash_imagen = getattr(imagen, 'hash_contenido', None) or cache_analisis.hash_contenido(datos_imagen)
+        resultado_cache = cache_analisis.obtener(hash_imagen)
+        if resultado_cache is not None:
+            if plantacion_id:
+                guardar_analisis(plantacion_id, resultado_cache)
+            if _es_ajax(request):
+                trabajo = TrabajoAnalisis.objects.create(
+                    usuario=request.user if request.user.is_authenticated else None,
+                    plantacion_id=plantacion_id,
+                    imagen_original=os.path.basename(resultado_cache['imagen_original']['url']),
+                    estado=TrabajoAnalisis.Estado.COMPLETADO,
+                    resultado=resultado_cache,
+                )
+                return JsonResponse({
+                    'trabajo_id': str(trabajo.pk),
+                    'estado': trabajo.estado,
+                    'estado_url': reverse('core:deteccion_trabajo_estado', args=[trabajo.pk]),
+                }, status=202)
+            contexto.update(resultado_cache)
+            _permitir_artefactos(request, resultado_cache)
+            messages.success(request, f'✅ Análisis completado correctamente. Diagnóstico: {contexto["diagnostico"]} ({contexto["probabilidad"]}% de confianza)')
+            return render(request, 'core/Dashboard/Modulo Deteccion Enfermedades/deteccion_form.html', contexto)
+
+        # Guardar la imagen original (única escritura del archivo subido)
         try:
-            shutil.copy2(ruta_temp, ruta_original_resultado)
-            logger.info(f"Imagen original copiada a: {ruta_original_resultado}")
+            nombre_original = guardar_original(datos_imagen, nombre_archivo, hash_imagen)
         except Exception as e:
-            logger.error(f"Error al copiar imagen original: {e}")
+            logger.error(f"Error al guardar imagen original: {e}")
+            nombre_original = None
 
-        try:
-            # ========== PASO 1: PREDICCIÓN CON EL MODELO CNN ==========
-            logger.info("Iniciando predicción con Custom CNN...")
-            diagnostico_numero, pred_array = predict_with_custom(ruta_temp)
-            
-            # Obtener información del diagnóstico
-            diagnostico = obtener_nombre_enfermedad_custom(diagnostico_numero)
-            probabilidad_valor = np.max(pred_array)
-            probabilidad = round(float(probabilidad_valor) * 100, 2)
-            recomendaciones = obtener_recomendaciones_custom(diagnostico_numero)
-            
-            logger.info(f"Diagnóstico: {diagnostico} (clase {diagnostico_numero}) - Confianza: {probabilidad}%")
-
-            # ========== PASO 2: SEGMENTACIÓN ADAPTATIVA ==========
-            logger.info("Iniciando segmentación adaptativa...")
-            paths_dict = segment_and_save(
-                image_path=ruta_temp,
-                output_dir=carpeta_resultados,
-                # predicted_class=diagnostico_numero,  # Pasar la clase predicha
-                # adaptive=True  # Activar segmentación adaptativa
+        # Petición desde la página: se encola el trabajo y se responde de inmediato
+        if _es_ajax(request) and nombre_original:
+            trabajo = TrabajoAnalisis.objects.create(
+                usuario=request.user if request.user.is_authenticated else None,
+                plantacion_id=plantacion_id,
+                imagen_original=nombre_original,
             )
-            
-            logger.info(f"Segmentación completada. Archivos generados: {len(paths_dict)}")
-
-            # ========== PASO 3: PREPARAR DATOS PARA LA PLANTILLA ==========
-            imagen_original = {
-                "nombre": "Imagen Original",
-                "url": settings.MEDIA_URL + 'resultados/' + nombre_original
-            }
-
-            imagenes_procesadas = [
-                {
-                    "nombre": "Contorno de la Enfermedad",
-                    "url": settings.MEDIA_URL + 'resultados/' + os.path.basename(paths_dict["contorno"]),
-                    "descripcion": "Áreas afectadas delimitadas con contornos"
-                },
-                {
-                    "nombre": "Mapa de Calor (Overlay)",
-                    "url": settings.MEDIA_URL + 'resultados/' + os.path.basename(paths_dict["overlay"]),
-                    "descripcion": "Visualización superpuesta de las zonas afectadas"
-                },
-                {
-                    "nombre": "Región Afectada",
-                    "url": settings.MEDIA_URL + 'resultados/' + os.path.basename(paths_dict["damage"]),
-                    "descripcion": "Solo las áreas con síntomas de la enfermedad"
-                }
-            ]
-
-            messages.success(request, f'✅ Análisis completado correctamente. Diagnóstico: {diagnostico} ({probabilidad}% de confianza)')
+            encolar_analisis(trabajo, imagen_bgr, hash_imagen, orientacion)
+            return JsonResponse({
+                'trabajo_id': str(trabajo.pk),
+                'estado': trabajo.estado,
+                'estado_url': reverse('core:deteccion_trabajo_estado', args=[trabajo.pk]),
+            }, status=202)
+
+        # Sin JavaScript el análisis se mantiene síncrono
+        try:
+            contexto.update(ejecutar_analisis(
+                imagen_bgr, nombre_original or nombre_archivo, hash_imagen=hash_imagen, orientacion=orientacion,
+            ))
+            _permitir_artefactos(request, contexto)
+            if plantacion_id:
+                guardar_analisis(plantacion_id, contexto)
+            messages.success(request, f'✅ Análisis completado correctamente. Diagnóstico: {contexto["diagnostico"]} ({contexto["probabilidad"]}% de confianza)')
 
         except Exception as e:
             logger.exception(f"Error durante el análisis de la imagen: {e}")
             messages.error(request, f"❌ Ocurrió un error durante el análisis: {str(e)}")
-            diagnostico = "Error en el análisis"
-            recomendaciones = "No se pudo generar una recomendación. Por favor, intente con otra imagen."
-
-        finally:
-            # ========== PASO 4: LIMPIEZA DE ARCHIVOS TEMPORALES ==========
-            try:
-                if os.path.exists(ruta_temp):
-                    os.remove(ruta_temp)
-                    logger.info(f"Archivo temporal eliminado: {ruta_temp}")
-            except Exception as e:
-                logger.warning(f"No se pudo eliminar el archivo temporal: {e}")
+            contexto['diagnostico'] = "Error en el análisis"
+            contexto['recomendaciones'] = "No se pudo generar una recomendación. Por favor, intente con otra imagen."
 
     # Renderizar template con los resultados
-    return render(request, 'core/Dashboard/Modulo Deteccion Enfermedades/deteccion_form.html', {
-        'diagnostico': diagnostico,
-        'diagnostico_numero': diagnostico_numero,
-        'imagenes': imagenes_procesadas,
-        'imagen_original': imagen_original,
-        'recomendaciones': recomendaciones,
-        'probabilidad': probabilidad
-    })
+    return render(request, 'core/Dashboard/Modulo Deteccion Enfermedades/deteccion_form.html', contexto)
+
+
+def estado_trabajo(request, trabajo_id):
+    """Estado de un trabajo de análisis, consultado por deteccion_form.js mediante polling"""
+    trabajo = _obtener_trabajo(request, trabajo_id)
+    respuesta = {
+        'trabajo_id': str(trabajo.pk),
+        'estado': trabajo.estado,
+    }
+    if trabajo.estado == TrabajoAnalisis.Estado.COMPLETADO:
+        respuesta['resultado_url'] = reverse('core:deteccion_analizar') + f'?trabajo={trabajo.pk}'
+        respuesta['diagnostico'] = trabajo.resultado.get('diagnostico')
+        respuesta['probabilidad'] = trabajo.resultado.get('probabilidad')
+    elif trabajo.estado == TrabajoAnalisis.Estado.ERROR:
+        respuesta['error'] = trabajo.error
+    return JsonResponse(respuesta)
+
+
+def artefacto_segmentacion(request, nombre):
+    """
+    Sirve el contorno, overlay o región dañada de un análisis mostrado en la sesión
+    (también sin iniciar sesión, como analizar_imagen) o registrado en una plantación
+    del usuario. Solo se guarda la máscara al analizar; la primera petición genera
+    el JPG y las siguientes lo reutilizan desde disco.
+    """
+    if nombre not in request.session.get(CLAVE_ARTEFACTOS_SESION, []) and not (
+        request.user.is_authenticated and artefacto_de_usuario(nombre, request.user)
+    ):
+        raise Http404
+    try:
+        ruta = obtener_artefacto(nombre)
+    except Exception as e:
+        logger.error(f"No se pudo generar el artefacto {nombre}: {e}")
+        raise Http404
+    if ruta is None:
+        raise Http404
+    content_type = mimetypes.guess_type(ruta)[0] or 'application/octet-stream'
+    respuesta = FileResponse(open(ruta, 'rb'), content_type=content_type)
+    # El nombre es único por análisis: el contenido nunca cambia (privado: es de quien lo analizó)
+    patch_cache_control(respuesta, private=True, max_age=30 * 24 * 3600, immutable=True)
+    return respuesta
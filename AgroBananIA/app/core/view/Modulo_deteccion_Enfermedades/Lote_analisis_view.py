@@ -0,0 +1,71 @@
+from django.shortcuts import render, redirect, get_object_or_404
+from django.views import View
+from django.contrib import messages
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import JsonResponse
+from django.urls import reverse
+from app.core.models import LoteAnalisis, Plantacion
+from app.core.lotes import guardar_archivos_lote
+from app.core.tasks import encolar_lote
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class LoteAnalisisView(LoginRequiredMixin, View):
+    """Carga masiva de imágenes (varios archivos o un ZIP) para una plantación"""
+    template_name = 'core/Dashboard/Modulo Deteccion Enfermedades/deteccion_lote.html'
+
+    def get(self, request):
+        return render(request, self.template_name, {
+            'plantaciones': Plantacion.objects.filter(usuario=request.user).only('id', 'nombre_finca'),
+            'lotes': LoteAnalisis.objects.filter(usuario=request.user).select_related('plantacion')[:10],
+        })
+
+    def post(self, request):
+        plantacion = request.user.plantaciones.filter(pk=request.POST.get('plantacion')).first()
+        archivos = request.FILES.getlist('imagenes') + request.FILES.getlist('archivo_zip')
+
+        if plantacion is None:
+            messages.error(request, "Seleccione una de sus plantaciones.")
+            return redirect('core:deteccion_lote')
+        if not archivos:
+            messages.error(request, "Seleccione las imágenes o un archivo ZIP del levantamiento.")
+            return redirect('core:deteccion_lote')
+
+        lote = LoteAnalisis.objects.create(usuario=request.user, plantacion=plantacion)
+        try:
+            guardar_archivos_lote(lote, archivos)
+        except Exception as e:
+            logger.error(f"Error al guardar los archivos del lote {lote.pk}: {e}")
+            lote.estado = LoteAnalisis.Estado.ERROR
+            lote.mensaje_error = str(e)
+            lote.save(update_fields=['estado', 'mensaje_error'])
+            messages.error(request, "No se pudieron guardar los archivos del lote. Intente nuevamente.")
+            return redirect('core:deteccion_lote')
+
+        encolar_lote(lote)
+        messages.success(request, "Lote recibido. Las imágenes se están analizando en segundo plano.")
+        return redirect('core:deteccion_lote_detalle', lote_id=lote.pk)
+
+
+class LoteAnalisisDetalleView(LoginRequiredMixin, View):
+    """Progreso de un lote; con X-Requested-With responde JSON para el polling"""
+    template_name = 'core/Dashboard/Modulo Deteccion Enfermedades/deteccion_lote.html'
+
+    def get(self, request, lote_id):
+        lote = get_object_or_404(
+            LoteAnalisis.objects.select_related('plantacion'), pk=lote_id, usuario=request.user
+        )
+        if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+            return JsonResponse({
+                'estado': lote.estado,
+                'total': lote.total,
+                'procesadas': lote.procesadas,
+                'errores': lote.errores,
+                'porcentaje': lote.porcentaje,
+                'mensaje_error': lote.mensaje_error,
+                'listado_url': reverse('core:deteccion_list'),
+            })
+        return render(request, self.template_name, {'lote': lote})
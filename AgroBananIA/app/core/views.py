@@ -1,8 +1,24 @@
-from django.shortcuts import render
+from datetime import timedelta
+from django.shortcuts import render, get_object_or_404
 from django.views import View
-import json
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_date
+from django.conf import settings
+from app.core.mapa import plantaciones_bbox
+from app.core.estadisticas import DIA, VARIABLES, serie_registros
+from app.core.models import Plantacion, ResumenRegistroCampo
+from AgroBananIA.utils.metricas import registro
+import hmac
+import math
 # Create your views here.
 
+# Zoom máximo de las teselas de OpenStreetMap
+ZOOM_MAXIMO = 19
+
+
 class HomeView(View):
     def get(self, request):
         return render(request, 'core/home.html')
@@ -10,105 +26,92 @@ class HomeView(View):
 
 class DashboardView(View):
     def get(self, request):
-        # DATOS QUEMADOS - Coordenadas de zonas bananeras reales de Ecuador
-        coordenadas = [
-            {
-                'id': 1,
-                'nombre': 'Finca El Paraíso',
-                'latitud': '-2.170',  # Guayas, Ecuador
-                'longitud': '-79.920',
-                'ubicacion': 'Guayas, Ecuador',
-                'extension_hectareas': '45.5',
-                'fecha_registro': '15/01/2020',
-                'propietario': 'Juan Pérez González'
-            },
-            {
-                'id': 2,
-                'nombre': 'Plantación San José',
-                'latitud': '-1.850',  # Los Ríos, Ecuador
-                'longitud': '-79.450',
-                'ubicacion': 'Los Ríos, Ecuador',
-                'extension_hectareas': '32.8',
-                'fecha_registro': '22/03/2019',
-                'propietario': 'María Carmen Rodríguez'
-            },
-            {
-                'id': 3,
-                'nombre': 'Hacienda Verde',
-                'latitud': '-3.260',  # El Oro, Ecuador
-                'longitud': '-79.850',
-                'ubicacion': 'El Oro, Ecuador',
-                'extension_hectareas': '58.2',
-                'fecha_registro': '10/07/2018',
-                'propietario': 'Carlos Mendoza Silva'
-            },
-            {
-                'id': 4,
-                'nombre': 'Finca La Esperanza',
-                'latitud': '-0.980',  # Esmeraldas, Ecuador
-                'longitud': '-79.650',
-                'ubicacion': 'Esmeraldas, Ecuador',
-                'extension_hectareas': '28.5',
-                'fecha_registro': '05/11/2021',
-                'propietario': 'Ana Sofía Torres'
-            },
-            {
-                'id': 5,
-                'nombre': 'Agrícola Santa Rosa',
-                'latitud': '-2.420',  # Guayas (sur), Ecuador
-                'longitud': '-79.680',
-                'ubicacion': 'Guayas Sur, Ecuador',
-                'extension_hectareas': '72.3',
-                'fecha_registro': '18/06/2017',
-                'propietario': 'Roberto Castro Vargas'
-            },
-            {
-                'id': 6,
-                'nombre': 'Plantación Los Andes',
-                'latitud': '-1.650',  # Los Ríos (norte), Ecuador
-                'longitud': '-79.280',
-                'ubicacion': 'Los Ríos Norte, Ecuador',
-                'extension_hectareas': '41.7',
-                'fecha_registro': '30/09/2020',
-                'propietario': 'Luisa Fernanda Gómez'
-            },
-            {
-                'id': 7,
-                'nombre': 'Finca Bananera El Sol',
-                'latitud': '-2.050',  # Guayas (centro), Ecuador
-                'longitud': '-79.750',
-                'ubicacion': 'Guayas Centro, Ecuador',
-                'extension_hectareas': '35.9',
-                'fecha_registro': '12/02/2019',
-                'propietario': 'Diego Alejandro Morales'
-            },
-            {
-                'id': 8,
-                'nombre': 'Agroindustrial Costa Verde',
-                'latitud': '-3.150',  # El Oro (norte), Ecuador
-                'longitud': '-79.720',
-                'ubicacion': 'El Oro Norte, Ecuador',
-                'extension_hectareas': '64.1',
-                'fecha_registro': '25/04/2018',
-                'propietario': 'Patricia Isabel Vásquez'
-            }
-        ]
-        
-        # Plantación principal (la primera de la lista)
-        plantacion_principal = {
-            'id': 1,
-            'nombre': 'Finca El Paraíso',
-            'ubicacion': 'Zona 1, Guayas',
-            'extension_hectareas': 45.5,
-            'fecha_registro': '01/01/2020',
-            'propietario': 'Juan Pérez González',
-            'latitud': -2.170,
-            'longitud': -79.920
-        }
-        
+        # Las plantaciones del mapa se piden por recuadro a mapa_plantaciones al mover el mapa;
+        # aquí solo va la plantación principal del usuario para centrarlo
+        plantacion_principal = None
+        if request.user.is_authenticated:
+            plantacion = request.user.plantaciones.order_by('id').first()
+            if plantacion is not None:
+                plantacion_principal = {
+                    'id': plantacion.id,
+                    'nombre': plantacion.nombre_finca,
+                    'ubicacion': plantacion.ubicacion,
+                    'extension_hectareas': float(plantacion.extension_hectareas),
+                    'fecha_registro': plantacion.fecha_registro.strftime('%d/%m/%Y'),
+                    'propietario': request.user.get_full_name() or request.user.username,
+                    'latitud': float(plantacion.latitud),
+                    'longitud': float(plantacion.longitud),
+                }
+
         context = {
-            'coordenadas_plantaciones': json.dumps(coordenadas),
-            'plantacion': plantacion_principal
+            'plantacion': plantacion_principal,
+            'mapa': {
+                'url': reverse('core:dashboard_mapa'),
+                'zoom_detalle': getattr(settings, 'MAPA_ZOOM_DETALLE', 12),
+                'principal': plantacion_principal,
+            },
         }
 
         return render(request, 'core/Dashboard/inicio.html', context)
+
+
+def mapa_plantaciones(request):
+    """
+    GeoJSON de las plantaciones en el recuadro visible del mapa:
+    ?bbox=oeste,sur,este,norte&zoom=z. A zoom bajo devuelve grupos con su cantidad.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Debes iniciar sesión para ver el mapa.'}, status=401)
+    try:
+        oeste, sur, este, norte = (float(valor) for valor in request.GET['bbox'].split(','))
+        zoom = int(request.GET['zoom'])
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Parámetros bbox y zoom requeridos.'}, status=400)
+    if not all(map(math.isfinite, (oeste, sur, este, norte))) or sur > norte or oeste > este or not 0 <= zoom <= ZOOM_MAXIMO:
+        return JsonResponse({'error': 'Recuadro o zoom fuera de rango.'}, status=400)
+
+    datos = plantaciones_bbox(sur, oeste, norte, este, zoom)
+    if datos is None:
+        return JsonResponse({'error': 'El recuadro es demasiado grande para este zoom.'}, status=400)
+    respuesta = JsonResponse(datos, content_type='application/geo+json')
+    patch_cache_control(respuesta, private=True, max_age=getattr(settings, 'MAPA_CACHE_TTL', 300))
+    return respuesta
+
+
+def series_plantacion(request, plantacion_id):
+    """
+    Series de los registros de campo para gráficas:
+    ?desde=AAAA-MM-DD&hasta=AAAA-MM-DD&periodo=dia|semana|mes&variables=temperatura,humedad.
+    Sin periodo se elige el más fino que no pase de SERIES_MAX_PUNTOS puntos.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Debes iniciar sesión para ver las series.'}, status=401)
+    get_object_or_404(Plantacion.objects.only('id'), pk=plantacion_id, usuario=request.user)
+
+    try:
+        hasta = parse_date(request.GET['hasta']) if request.GET.get('hasta') else timezone.localdate()
+        desde = parse_date(request.GET['desde']) if request.GET.get('desde') else hasta - timedelta(days=365)
+    except ValueError:
+        desde = hasta = None
+    if desde is None or hasta is None or desde > hasta:
+        return JsonResponse({'error': 'Rango de fechas inválido.'}, status=400)
+    periodo = request.GET.get('periodo') or None
+    if periodo not in (None, DIA, *ResumenRegistroCampo.Periodo.values):
+        return JsonResponse({'error': 'Periodo inválido.'}, status=400)
+    variables = tuple(request.GET['variables'].split(',')) if request.GET.get('variables') else VARIABLES
+    if not set(variables) <= set(VARIABLES):
+        return JsonResponse({'error': f"Variables válidas: {', '.join(VARIABLES)}."}, status=400)
+
+    respuesta = JsonResponse(serie_registros(plantacion_id, desde, hasta, periodo, variables))
+    patch_cache_control(respuesta, private=True, max_age=60)
+    return respuesta
+
+
+def metricas_prometheus(request):
+    """Métricas del proceso en el formato de texto de Prometheus."""
+    token = getattr(settings, 'METRICAS_TOKEN', None)
+    autorizacion = request.headers.get('Authorization', '')
+    con_token = bool(token) and hmac.compare_digest(autorizacion, f"Bearer {token}")
+    if not con_token and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(registro.exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
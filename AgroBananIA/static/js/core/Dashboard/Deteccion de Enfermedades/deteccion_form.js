@@ -119,25 +119,80 @@ function removePreview() {
 imageInput.addEventListener("change", previewImage);
 
 // Manejo del formulario
+// El análisis se encola en el servidor y la página consulta su estado (polling)
+// en lugar de mantener la petición abierta durante la inferencia.
+const POLLING_INTERVALO_MS = 1000;
+const loadingText = document.querySelector(".loading-text");
+const progressFill = document.querySelector(".progress-fill");
+
+function setProgress(value) {
+  progressFill.style.width = Math.min(value, 100) + "%";
+}
+
+function stopLoading() {
+  loadingOverlay.style.display = "none";
+  submitBtn.disabled = false;
+  setProgress(0);
+}
+
+function pollTrabajo(estadoUrl) {
+  fetch(estadoUrl, { headers: { "X-Requested-With": "XMLHttpRequest" } })
+    .then((response) => {
+      if (!response.ok) throw new Error("No se pudo consultar el estado del análisis");
+      return response.json();
+    })
+    .then((data) => {
+      if (data.estado === "completado") {
+        setProgress(100);
+        window.location.href = data.resultado_url;
+      } else if (data.estado === "error") {
+        stopLoading();
+        showAlert(data.error || "Ocurrió un error durante el análisis");
+      } else {
+        if (data.estado === "procesando") {
+          loadingText.textContent = "Analizando imagen...";
+          setProgress(60);
+        }
+        setTimeout(() => pollTrabajo(estadoUrl), POLLING_INTERVALO_MS);
+      }
+    })
+    .catch((error) => {
+      stopLoading();
+      showAlert(error.message);
+    });
+}
+
 uploadForm.addEventListener("submit", (e) => {
+  e.preventDefault();
   if (!imageInput.files.length) {
-    e.preventDefault();
     showAlert("Por favor selecciona una imagen");
     return;
   }
   loadingOverlay.style.display = "flex";
   submitBtn.disabled = true;
-
-  // Animación de progreso
-  let progress = 0;
-  const progressFill = document.querySelector(".progress-fill");
-  const interval = setInterval(() => {
-    progress += Math.random() * 15;
-    if (progress >= 90) {
-      clearInterval(interval);
-    }
-    progressFill.style.width = Math.min(progress, 90) + "%";
-  }, 300);
+  loadingText.textContent = "Subiendo imagen...";
+  setProgress(15);
+
+  fetch(uploadForm.action, {
+    method: "POST",
+    body: new FormData(uploadForm),
+    headers: { "X-Requested-With": "XMLHttpRequest" },
+  })
+    .then((response) =>
+      response.json().then((data) => {
+        if (!response.ok) throw new Error(data.error || "No se pudo enviar la imagen");
+        return data;
+      })
+    )
+    .then((data) => {
+      loadingText.textContent = "En cola para análisis...";
+      setProgress(35);
+      pollTrabajo(data.estado_url);
+    })
+    .catch((error) => {
+      stopLoading();
+      showAlert(error.message);
+    });
 });
 
 // Funciones del modal